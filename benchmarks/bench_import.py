@@ -0,0 +1,45 @@
+"""
+Import time of the package in a fresh interpreter.
+
+'numerics' is what a batch worker needs (utils and performance), 'eager'
+imports every submodule the way the package did before submodules were
+loaded lazily.
+
+    python benchmarks/bench_import.py [repeat]
+"""
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ('bare', 'import factor_analysis'),
+    ('numerics', 'import factor_analysis as fa; fa.utils; fa.performance'),
+    ('eager', 'import factor_analysis as fa; fa.utils; fa.performance; '
+              'fa.panel; fa.sweep; fa.plotting; fa.tears; fa.data'),
+]
+
+def time_import(statement, repeat=5):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', statement], env=env)
+        timings.append(time.perf_counter() - start)
+    return np.median(timings)
+
+def main(repeat=5):
+    baseline = time_import('pass', repeat)
+    print('%-10s %10s' % ('case', 'seconds'))
+    for name, statement in CASES:
+        print('%-10s %10.3f' % (name, time_import(statement, repeat)
+                                - baseline))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,157 @@
+"""
+Times and memory-profiles the stages of the factor pipeline on synthetic
+data and appends the results, tagged with the current git commit, to a CSV
+file so that runs of different commits can be compared.
+
+    python benchmarks/bench_pipeline.py --assets 500 3000 --freq M D \
+        --years 5 --repeat 3
+    python benchmarks/bench_pipeline.py --compare
+"""
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from factor_analysis import utils  # noqa: E402
+from factor_analysis import performance as perf  # noqa: E402
+from factor_analysis.incremental import RunningFactorReturns  # noqa: E402
+import synthetic  # noqa: E402
+
+DEFAULT_OUTPUT = os.path.join(ROOT, 'benchmarks', 'results.csv')
+
+def measure(func, repeat):
+    """
+    Best wall time over 'repeat' runs and peak traced memory of one run.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak, result
+
+def run_case(n_assets, freq, years, periods, repeat):
+    prices = synthetic.make_prices(n_assets, years, freq)
+    factor = synthetic.make_factor(prices)
+    groups = synthetic.make_groups(prices.columns)
+    with contextlib.redirect_stdout(io.StringIO()):
+        forward_returns = utils.compute_forward_returns(factor, prices,
+                                                        periods)
+        factor_data = utils.get_clean_factor(factor, forward_returns,
+                                             groupby=groups, max_loss=1)
+
+    stages = [
+        ('compute_forward_returns',
+         lambda: utils.compute_forward_returns(factor, prices, periods)),
+        ('get_clean_factor',
+         lambda: utils.get_clean_factor(factor, forward_returns,
+                                        groupby=groups, max_loss=1)),
+        ('quantize_factor',
+         lambda: utils.quantize_factor(factor_data, 5)),
+        ('quantize_factor_by_group',
+         lambda: utils.quantize_factor(factor_data, 5, by_group=True)),
+        ('quantize_factor_zero_aware',
+         lambda: utils.quantize_factor(factor_data, 4, zero_aware=True)),
+        ('mean_return_by_quantile',
+         lambda: perf.mean_return_by_quantile(factor_data)),
+        ('mean_return_by_quantile_by_date',
+         lambda: perf.mean_return_by_quantile(factor_data, by_date=True,
+                                              group_adjust=True)),
+        ('factor_returns',
+         lambda: perf.factor_returns(factor_data)),
+        ('factor_weights_group_adjust',
+         lambda: perf.factor_weights(factor_data, group_adjust=True,
+                                     equal_weight=True)),
+        # from the raw factor and prices, cleaned at once or date chunk by
+        # date chunk
+        ('clean_and_mean_return_by_quantile',
+         lambda: perf.mean_return_by_quantile(
+             utils.get_clean_factor_and_forward_returns(
+                 factor, prices, groupby=groups, periods=periods,
+                 max_loss=1))),
+        ('streaming_clean_and_mean_return_by_quantile',
+         lambda: RunningFactorReturns.fold(
+             utils.iter_clean_factor_and_forward_returns(
+                 factor, prices, groupby=groups, periods=periods,
+                 max_loss=1)).mean_return_by_quantile()),
+    ]
+
+    rows = []
+    for name, func in stages:
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds, peak, _ = measure(func, repeat)
+        rows.append(dict(stage=name, assets=n_assets, freq=freq,
+                         years=years, rows=len(factor), seconds=seconds,
+                         peak_mb=peak / 2.0 ** 20))
+        print('%-44s %5d assets %s %2dy %10.4fs %9.1fMB'
+              % (name, n_assets, freq, years, seconds, peak / 2.0 ** 20))
+    return rows
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(output):
+    """
+    Prints the last run of every commit side by side, stage by stage.
+    """
+    results = pd.read_csv(output)
+    last = results.sort_values('timestamp') \
+        .groupby(['commit', 'stage', 'assets', 'freq', 'years']).last()
+    commits = results.sort_values('timestamp')['commit'].unique()
+    for value in ['seconds', 'peak_mb']:
+        table = last[value].unstack('commit').reindex(columns=commits)
+        print('\n%s' % value)
+        print(table.to_string(float_format='%.4f'))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--assets', type=int, nargs='+', default=[500])
+    parser.add_argument('--freq', nargs='+', default=['M'],
+                        choices=sorted(synthetic.FREQUENCIES))
+    parser.add_argument('--years', type=int, nargs='+', default=[5])
+    parser.add_argument('--periods', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--compare', action='store_true',
+                        help='compare the stored runs instead of running')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(args.output)
+        return
+
+    rows = []
+    for n_assets in args.assets:
+        for freq in args.freq:
+            for years in args.years:
+                rows.extend(run_case(n_assets, freq, years,
+                                     tuple(args.periods), args.repeat))
+
+    results = pd.DataFrame(rows)
+    results.insert(0, 'commit', git_commit())
+    results.insert(1, 'timestamp', pd.Timestamp.now().isoformat())
+    results.to_csv(args.output, mode='a', index=False,
+                   header=not os.path.exists(args.output))
+    print('results appended to %s' % args.output)
+
+if __name__ == '__main__':
+    main()
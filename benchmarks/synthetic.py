@@ -0,0 +1,51 @@
+"""
+Seeded synthetic prices, factors and industry groups for benchmarks.
+"""
+import numpy as np
+import pandas as pd
+
+FREQUENCIES = {'D': 'B', 'M': 'M', 'Q': 'Q'}
+PERIODS_PER_YEAR = {'D': 252, 'M': 12, 'Q': 4}
+
+def make_prices(n_assets=500, years=5, freq='M', seed=0):
+    """
+    Geometric random walk prices, dates x assets, with a few assets
+    listed late so the panel is not perfectly rectangular.
+    """
+    rng = np.random.default_rng(seed)
+    n_dates = years * PERIODS_PER_YEAR[freq]
+    dates = pd.date_range('2005-01-01', periods=n_dates,
+                          freq=FREQUENCIES[freq])
+    assets = ['%06d.SZ' % (i + 1) for i in range(n_assets)]
+    vol = 0.02 * np.sqrt(252.0 / PERIODS_PER_YEAR[freq])
+    returns = rng.normal(0.0002, vol, (n_dates, n_assets))
+    prices = 10 * np.exp(np.cumsum(returns, axis=0))
+    listing = rng.integers(0, n_dates // 4, n_assets)
+    listing[rng.random(n_assets) < 0.9] = 0
+    prices[np.arange(n_dates)[:, None] < listing[None, :]] = np.nan
+    return pd.DataFrame(prices, index=dates, columns=assets)
+
+def make_factor(prices, ic=0.05, seed=1):
+    """
+    Factor Series (date, asset) correlated with the next period return,
+    with missing values where prices are missing.
+    """
+    rng = np.random.default_rng(seed)
+    next_returns = prices.pct_change().shift(-1).values
+    noise = rng.normal(size=prices.shape)
+    scale = np.nanstd(next_returns)
+    signal = np.where(np.isnan(next_returns), 0, next_returns / scale)
+    values = ic * signal + np.sqrt(1 - ic ** 2) * noise
+    values[np.isnan(prices.values)] = np.nan
+    factor = pd.DataFrame(values, index=prices.index,
+                          columns=prices.columns).stack()
+    factor.index.set_names(['date', 'asset'], inplace=True)
+    return factor
+
+def make_groups(assets, n_groups=30, seed=2):
+    """
+    Asset -> industry mapping.
+    """
+    rng = np.random.default_rng(seed)
+    return dict(zip(assets, ['IND%02d' % g for g in
+                             rng.integers(0, n_groups, len(assets))]))
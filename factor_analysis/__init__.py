@@ -1,7 +1,18 @@
 # -*- coding: utf-8 -*-
 
-from . import utils
-from . import performance
-from . import plotting
-from . import tears
-from . import data
\ No newline at end of file
+import importlib
+
+# submodules are imported on first access, so that e.g. batch workers
+# using only utils and performance never load matplotlib or WindPy
+__all__ = ['utils', 'performance', 'panel', 'sweep', 'plotting', 'tears',
+           'data', 'cache', 'incremental', 'store', 'ingest']
+
+def __getattr__(name):
+    if name in __all__:
+        module = importlib.import_module('.' + name, __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,476 @@
+import os
+import re
+import json
+import time
+import pickle
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import numpy as np
+
+from . import utils
+from .store import MappedPanel
+
+try:
+    import pyarrow.parquet
+    _FORMAT = 'parquet'
+except ImportError:
+    _FORMAT = 'pickle'
+
+class DataCache(object):
+    """
+    On-disk cache of wide (dates x codes) data frames, one file per field
+    and period, refreshed incrementally: only the codes and the dates not
+    covered yet are fetched and merged into the file.
+
+    Files are written as Parquet when pyarrow is installed, as pickles
+    otherwise, and always through an atomic rename so several processes
+    can share the same directory. The dates covered for every code are
+    stored in the same file as the frame (in the Parquet metadata), so a
+    reader never pairs a frame with the coverage of another version.
+    Parameters
+    ----------
+    path : str
+        Cache directory, created if needed.
+    max_bytes : int, optional
+        If set, the least recently used files are evicted after each write
+        so that the cache stays under this size.
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+
+    def __repr__(self):
+        return "<DataCache: %s>" % self.path
+
+    def get_frame(self, field, period, codes, start_date, end_date, fetch):
+        """
+        Returns the 'field' data of 'codes' between 'start_date' and
+        'end_date', calling fetch(codes, start_date, end_date) only for what
+        is missing from the cache.
+        Parameters
+        ----------
+        field : str
+            Data field, e.g. 'close' or a fundamental factor name.
+        period : str
+            Data frequency, e.g. 'M' or 'Q'.
+        codes : list of str
+            Security codes, the columns of the result.
+        start_date, end_date : str or datetime
+            Date range of the result.
+        fetch : callable
+            fetch(codes, start_date, end_date) returns a DataFrame indexed
+            by date with one column per code, dates as '%Y-%m-%d' strings.
+        Returns
+        -------
+        df : pd.DataFrame
+            Dates x codes data frame.
+        """
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        key = self._key(field, period)
+        frame, coverage = self._load(key)
+
+        # group the codes by missing date range so each range is fetched
+        # with a single call
+        requests = {}
+        for code in codes:
+            if code not in coverage.index:
+                requests.setdefault((start, end), []).append(code)
+                continue
+            covered_start, covered_end = coverage.loc[code, ['start', 'end']]
+            if start < covered_start:
+                requests.setdefault((start, covered_start), []) \
+                    .append(code)
+            if end > covered_end:
+                requests.setdefault((covered_end, end), []).append(code)
+
+        if requests:
+            for (fetch_start, fetch_end), fetch_codes in requests.items():
+                fetched = fetch(fetch_codes,
+                                fetch_start.strftime('%Y-%m-%d'),
+                                fetch_end.strftime('%Y-%m-%d'))
+                frame = _merge(frame, fetched, fetch_codes,
+                               fetch_start, fetch_end)
+                for code in fetch_codes:
+                    if code in coverage.index:
+                        coverage.loc[code, 'start'] = min(
+                            coverage.loc[code, 'start'], fetch_start)
+                        coverage.loc[code, 'end'] = max(
+                            coverage.loc[code, 'end'], fetch_end)
+                    else:
+                        coverage.loc[code] = [fetch_start, fetch_end]
+            self._save(key, frame, coverage)
+
+        return frame.loc[start:end].reindex(columns=list(codes))
+
+    def get_static(self, name, fetch):
+        """
+        Returns the DataFrame cached under 'name', or caches and returns
+        fetch() if there is none.
+        """
+        key = self._key('static', name)
+        path = self._file(key)
+        if os.path.exists(path):
+            self._touch(path)
+            return self._read(path)
+        df = fetch()
+        self._write(df, path)
+        self._evict_to_budget()
+        return df
+
+    def invalidate(self, field=None, period=None, codes=None):
+        """
+        Drops cached field data. With no argument every field is dropped,
+        otherwise only the matching field and/or period, and with 'codes'
+        only those codes of the matching files.
+        """
+        for key in self.keys():
+            key_field, key_period = key.rsplit('_', 1)
+            if field is not None and _escape(field) != key_field:
+                continue
+            if period is not None and _escape(period) != key_period:
+                continue
+            if codes is None:
+                if os.path.exists(self._file(key)):
+                    os.remove(self._file(key))
+            else:
+                frame, coverage = self._load(key)
+                frame = frame.drop(columns=codes, errors='ignore')
+                coverage = coverage.drop(index=codes, errors='ignore')
+                self._save(key, frame, coverage)
+
+    def clear(self):
+        """
+        Removes every cached file.
+        """
+        for name in os.listdir(self.path):
+            if name.endswith('.' + _FORMAT):
+                os.remove(os.path.join(self.path, name))
+
+    def evict(self, max_bytes):
+        """
+        Removes the least recently used files until the cache takes at most
+        'max_bytes' on disk.
+        """
+        files = [os.path.join(self.path, name)
+                 for name in os.listdir(self.path)
+                 if name.endswith('.' + _FORMAT)]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        for path in files:
+            if total <= max_bytes:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+    def keys(self):
+        """
+        Cached field/period keys.
+        """
+        suffix = '.' + _FORMAT
+        return sorted(name[:-len(suffix)] for name in os.listdir(self.path)
+                      if name.endswith(suffix)
+                      and not name.startswith('static_'))
+
+    @property
+    def nbytes(self):
+        return sum(os.path.getsize(os.path.join(self.path, name))
+                   for name in os.listdir(self.path))
+
+    def _key(self, field, period):
+        return '%s_%s' % (_escape(field), _escape(period))
+
+    def _file(self, key):
+        return os.path.join(self.path, '%s.%s' % (key, _FORMAT))
+
+    def _load(self, key):
+        path = self._file(key)
+        if os.path.exists(path):
+            self._touch(path)
+            return self._read(path, coverage=True)
+        coverage = pd.DataFrame({'start': pd.Series(dtype='datetime64[ns]'),
+                                 'end': pd.Series(dtype='datetime64[ns]')})
+        return pd.DataFrame(index=pd.DatetimeIndex([])), coverage
+
+    def _save(self, key, frame, coverage):
+        self._write(frame, self._file(key), coverage)
+        self._evict_to_budget()
+
+    def _evict_to_budget(self):
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def _read(self, path, coverage=False):
+        """
+        Reads a frame, and its coverage with 'coverage'.
+        """
+        if _FORMAT == 'parquet':
+            table = pyarrow.parquet.read_table(path)
+            if coverage:
+                return table.to_pandas(), \
+                    _coverage_from_json(table.schema.metadata[b'coverage'])
+            return table.to_pandas()
+        return pd.read_pickle(path)
+
+    def _write(self, df, path, coverage=None):
+        """
+        Writes a frame, with its coverage if given, in a single atomic
+        rename.
+        """
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        if _FORMAT == 'parquet':
+            table = pyarrow.Table.from_pandas(df)
+            if coverage is not None:
+                metadata = dict(table.schema.metadata or {})
+                metadata[b'coverage'] = _coverage_to_json(coverage)
+                table = table.replace_schema_metadata(metadata)
+            pyarrow.parquet.write_table(table, tmp)
+        else:
+            pd.to_pickle(df if coverage is None else (df, coverage), tmp)
+        os.replace(tmp, path)
+
+    def _touch(self, path):
+        now = time.time()
+        os.utime(path, (now, now))
+
+class FactorDataCache(object):
+    """
+    Memoized utils.get_clean_factor_and_forward_returns: results are kept
+    under a hash of the contents of the factor, prices and groups and of
+    all the binning parameters, so calling it again with the same data,
+    e.g. from a notebook changing only the plotting or performance
+    options, returns at once.
+
+    Results are held in memory, least recently used ones evicted beyond
+    'max_bytes', and optionally written to a directory as well, from which
+    they are read back after being evicted or by another process. Cached
+    results are shared by the calls returning them: copy one before
+    modifying it in place.
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Memory budget of the results held in memory, 1GB by default.
+    path : str, optional
+        Directory of the disk tier, none by default.
+    max_disk_bytes : int, optional
+        If set, the least recently used files are evicted after each write
+        so that the disk tier stays under this size.
+    """
+
+    def __init__(self, max_bytes=2 ** 30, path=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.path = os.path.abspath(os.path.expanduser(path)) \
+            if path is not None else None
+        self.max_disk_bytes = max_disk_bytes
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self._stats = dict(hits=0, disk_hits=0, misses=0, evictions=0)
+
+    def __repr__(self):
+        return "<FactorDataCache: %d entries, %.1fMB>" % (
+            len(self._entries), self.nbytes / 2.0 ** 20)
+
+    def get_clean_factor_and_forward_returns(self, factor, prices,
+                                             groupby=None, **kwargs):
+        """
+        utils.get_clean_factor_and_forward_returns(factor, prices, groupby,
+        **kwargs), computed only if no result is cached for the same
+        arguments. 'instrument' does not take part in the key; calls
+        raising MaxLossExceededError are not cached.
+        """
+        key = self.key(factor, prices, groupby, **kwargs)
+        factor_data = self._get(key)
+        if factor_data is not None:
+            return factor_data
+
+        with self._lock:
+            self._stats['misses'] += 1
+        factor_data = utils.get_clean_factor_and_forward_returns(
+            factor, prices, groupby=groupby, **kwargs)
+        self._put(key, factor_data)
+        if self.path is not None:
+            self._write(key, factor_data)
+        return factor_data
+
+    def key(self, factor, prices, groupby=None, **kwargs):
+        """
+        Hex digest identifying the result of a call with these arguments.
+        """
+        # defaults are filled in, so leaving one out or passing it gives
+        # the same key
+        arguments = inspect.signature(
+            utils.get_clean_factor_and_forward_returns).bind(
+                factor, prices, groupby, **kwargs)
+        arguments.apply_defaults()
+        arguments = arguments.arguments
+        arguments.pop('instrument')
+        digest = hashlib.blake2b(digest_size=20)
+        for name in sorted(arguments):
+            digest.update(name.encode())
+            _hash_into(digest, arguments[name])
+        return digest.hexdigest()
+
+    def stats(self):
+        """
+        Hits in memory and on disk, misses, memory evictions, number of
+        results and bytes held in memory.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), nbytes=self.nbytes)
+        return stats
+
+    def clear(self, disk=True):
+        """
+        Drops the results held in memory, and the disk tier with 'disk'.
+        The statistics are reset as well.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self._stats = dict.fromkeys(self._stats, 0)
+        if disk and self.path is not None:
+            for name in os.listdir(self.path):
+                if name.endswith('.pickle'):
+                    os.remove(os.path.join(self.path, name))
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return self._entries[key][0]
+        if self.path is None:
+            return None
+        path = os.path.join(self.path, key + '.pickle')
+        try:
+            with open(path, 'rb') as f:
+                factor_data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        now = time.time()
+        os.utime(path, (now, now))
+        with self._lock:
+            self._stats['disk_hits'] += 1
+        self._put(key, factor_data)
+        return factor_data
+
+    def _put(self, key, factor_data):
+        nbytes = int(factor_data.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (factor_data, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes and self._entries:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+                self._stats['evictions'] += 1
+
+    def _write(self, key, factor_data):
+        path = os.path.join(self.path, key + '.pickle')
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(factor_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        if self.max_disk_bytes is not None:
+            files = [os.path.join(self.path, name)
+                     for name in os.listdir(self.path)
+                     if name.endswith('.pickle')]
+            files.sort(key=os.path.getmtime)
+            total = sum(os.path.getsize(f) for f in files)
+            for path in files:
+                if total <= self.max_disk_bytes:
+                    break
+                total -= os.path.getsize(path)
+                os.remove(path)
+
+def _hash_into(digest, obj):
+    """
+    Feeds the type, shape and raw contents of 'obj' to 'digest'.
+    """
+    digest.update(type(obj).__name__.encode())
+    if isinstance(obj, pd.MultiIndex):
+        for level, codes in zip(obj.levels, obj.codes):
+            _hash_into(digest, level)
+            _hash_into(digest, np.asarray(codes))
+    elif isinstance(obj, pd.Index):
+        _hash_into(digest, obj.values if obj.dtype.kind in 'biufcmM'
+                   else pd.util.hash_array(np.asarray(obj, dtype=object)))
+    elif isinstance(obj, pd.Series):
+        _hash_into(digest, obj.index)
+        _hash_into(digest, obj.array)
+    elif isinstance(obj, pd.DataFrame):
+        _hash_into(digest, obj.index)
+        _hash_into(digest, obj.columns)
+        if len(set(obj.dtypes)) == 1 and obj.dtypes.iloc[0].kind in 'biufcmM':
+            # a single block, contiguous transposed
+            _hash_into(digest, obj.values.T)
+        else:
+            for _, column in obj.items():
+                _hash_into(digest, column.array)
+    elif isinstance(obj, pd.Categorical):
+        _hash_into(digest, obj.categories)
+        _hash_into(digest, obj.codes)
+    elif isinstance(obj, (np.ndarray, pd.api.extensions.ExtensionArray)):
+        values = np.asarray(obj)
+        if values.dtype.kind == 'O':
+            values = pd.util.hash_array(values)
+        digest.update(str(values.dtype).encode())
+        digest.update(str(values.shape).encode())
+        digest.update(np.ascontiguousarray(values).view(np.uint8))
+    elif isinstance(obj, MappedPanel):
+        # the files are not read: a panel is identified by its values file
+        stat = os.stat(os.path.join(obj.path, 'values.npy'))
+        digest.update(repr((obj.path, stat.st_size,
+                            stat.st_mtime_ns)).encode())
+    elif isinstance(obj, dict):
+        for name, value in sorted(obj.items(), key=repr):
+            digest.update(repr((name, value)).encode())
+    else:
+        digest.update(repr(obj).encode())
+
+def _merge(frame, fetched, codes, start, end):
+    """
+    Merges a freshly fetched chunk into the cached frame. The chunk is
+    authoritative for its codes within [start, end]: cached values there
+    are replaced, and cached dates it does not return are dropped when
+    nothing else is left on them.
+    """
+    fetched = fetched.copy()
+    fetched.index = pd.to_datetime(fetched.index)
+    fetched = fetched.reindex(columns=codes)
+
+    frame = frame.reindex(columns=frame.columns.union(codes, sort=False))
+    in_range = (frame.index >= start) & (frame.index <= end)
+    frame.loc[in_range, codes] = np.nan
+    stale = frame.index[in_range].difference(fetched.index)
+
+    frame = frame.reindex(frame.index.union(fetched.index))
+    frame.loc[fetched.index, codes] = fetched.values
+    empty = frame.loc[stale].isnull().all(axis=1)
+    frame = frame.drop(index=empty.index[empty.values])
+    frame.index.name = None
+    return frame.astype(np.float64)
+
+def _coverage_to_json(coverage):
+    return json.dumps({
+        'code': coverage.index.tolist(),
+        'start': [str(date) for date in coverage['start']],
+        'end': [str(date) for date in coverage['end']]}).encode()
+
+def _coverage_from_json(text):
+    coverage = json.loads(text)
+    return pd.DataFrame({'start': pd.to_datetime(coverage['start']),
+                         'end': pd.to_datetime(coverage['end'])},
+                        index=pd.Index(coverage['code'], dtype=object))
+
+def _escape(name):
+    return re.sub(r'[^0-9A-Za-z.\-]', '-', str(name))
@@ -1,24 +1,365 @@
 import pandas as pd
 import numpy as np
 import datetime as dt
-from WindPy import w
+import os
+import zlib
+import time
+import logging
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
-w.start()
+from .cache import DataCache, _escape
+
+logger = logging.getLogger(__name__)
 
 today = dt.datetime.today().strftime('%Y-%m-%d')
 
+class DataSource(ABC):
+    """
+    Provider of the data behind get_stock_list, get_stocks_history_close
+    and get_stocks_fundamental_factor. Select one with set_source.
+    """
+
+    @abstractmethod
+    def get_stock_list(self, index_code, date):
+        """
+        Constituents of 'index_code' at 'date', a DataFrame with
+        'wind_code' and 'sec_name' columns.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_history(self, codes, field, start_date, end_date, period):
+        """
+        'field' values of 'codes' from 'start_date' to 'end_date' at the
+        end of every 'period' ('M' or 'Q'), a DataFrame indexed by date with
+        one column per code.
+        """
+        raise NotImplementedError
+
+class WindError(Exception):
+    """
+    A Wind request failed, with the error code Wind returned if any.
+    """
+
+    def __init__(self, message, error_code=None):
+        super(WindError, self).__init__(message)
+        self.error_code = error_code
+
+class WindDataSource(DataSource):
+    """
+    Data from a Wind terminal. WindPy is imported and the session started
+    on the first request, not at import time.
+
+    Histories are fetched in chunks of codes and of dates, sent
+    concurrently from a pool of threads and reassembled into one frame, so
+    that long code lists stay under the server limits and a failed request
+    only costs its own chunk: every request is retried with an exponential
+    backoff, and they can be rate limited.
+    Parameters
+    ----------
+    w : object, optional
+        WindPy's 'w' or an object with the same wsd/wset interface, WindPy's
+        by default.
+    codes_per_request : int, optional
+        Number of codes of every history request, all of them if None.
+    periods_per_request : int, optional
+        Number of periods ('M' or 'Q') of every history request, the whole
+        date range if None.
+    max_workers : int, optional
+        Number of requests sent concurrently.
+    max_retries : int, optional
+        Number of times a failed request is sent again before giving up
+        with a WindError.
+    backoff : float, optional
+        Seconds waited before the first retry, doubled at each one.
+    max_requests_per_second : float, optional
+        Limit on the rate requests are sent at, across all the threads.
+    """
+
+    def __init__(self, w=None, codes_per_request=500,
+                 periods_per_request=None, max_workers=4, max_retries=3,
+                 backoff=1.0, max_requests_per_second=None):
+        self._w = w
+        self.codes_per_request = codes_per_request
+        self.periods_per_request = periods_per_request
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._limiter = _RateLimiter(max_requests_per_second) \
+            if max_requests_per_second else None
+
+    @property
+    def w(self):
+        if self._w is None:
+            from WindPy import w
+            w.start()
+            self._w = w
+        return self._w
+
+    def get_stock_list(self, index_code, date):
+        data = self._request(
+            self.w.wset, "sectorconstituent",
+            "date=%s;windcode=%s;field=wind_code,sec_name"%(date, index_code))
+        return pd.DataFrame(data.Data, index=data.Fields).T
+
+    def get_history(self, codes, field, start_date, end_date, period):
+        codes = list(codes)
+        if not codes:
+            return pd.DataFrame(index=pd.DatetimeIndex([]), columns=codes,
+                                dtype=np.float64)
+        size = self.codes_per_request or len(codes)
+        code_chunks = [codes[i:i + size] for i in range(0, len(codes), size)]
+        date_chunks = _date_chunks(start_date, end_date, period,
+                                   self.periods_per_request)
+        w = self.w
+
+        def fetch(chunk):
+            chunk_codes, (start, end) = chunk
+            data = self._request(w.wsd, chunk_codes, field,
+                                 start.strftime('%Y-%m-%d'),
+                                 end.strftime('%Y-%m-%d'),
+                                 'Period=%s;Days=Alldays'%(period))
+            return pd.DataFrame(data.Data, index=data.Codes,
+                                columns=pd.to_datetime(data.Times)).T
+
+        chunks = list(itertools.product(code_chunks, date_chunks))
+        if self.max_workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(self.max_workers) as pool:
+                frames = list(pool.map(fetch, chunks))
+        else:
+            frames = [fetch(chunk) for chunk in chunks]
+
+        columns = []
+        for i in range(len(code_chunks)):
+            column = pd.concat(frames[i * len(date_chunks):
+                                      (i + 1) * len(date_chunks)])
+            columns.append(column[~column.index.duplicated(keep='last')])
+        df = pd.concat(columns, axis=1) if len(columns) > 1 else columns[0]
+        df = df.loc[:, ~df.columns.duplicated()]
+        return df.sort_index().reindex(columns=codes)
+
+    def _request(self, method, *args):
+        """
+        method(*args), sent again with an exponential backoff while it
+        raises or returns an error code.
+        """
+        for attempt in range(self.max_retries + 1):
+            if self._limiter is not None:
+                self._limiter.wait()
+            try:
+                data = method(*args)
+                if getattr(data, 'ErrorCode', 0) != 0:
+                    raise WindError("%s%r failed with error code %s"
+                                    % (method.__name__, args,
+                                       data.ErrorCode), data.ErrorCode)
+                return data
+            except Exception as e:
+                if attempt == self.max_retries:
+                    if isinstance(e, WindError):
+                        raise
+                    raise WindError("%s%r failed: %s"
+                                    % (method.__name__, args, e)) from e
+                delay = self.backoff * 2 ** attempt
+                logger.warning("%s failed (%s), retrying in %.1fs",
+                               method.__name__, e, delay)
+                time.sleep(delay)
+
+class _RateLimiter(object):
+    """
+    Spaces the calls to wait, from any thread, 1 / rate seconds apart.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(max(start - now, 0.0))
+
+def _date_chunks(start_date, end_date, period, periods_per_request):
+    """
+    Consecutive date ranges covering start_date to end_date, each of
+    'periods_per_request' periods and ending on a period end, so that
+    every range returns the dates the whole one would.
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    if periods_per_request is None:
+        return [(start, end)]
+    ends = list(pd.date_range(start, end, freq=period)[
+        periods_per_request - 1::periods_per_request])
+    if not ends or ends[-1] < end:
+        ends.append(end)
+    chunks = []
+    for chunk_end in ends:
+        chunks.append((start, chunk_end))
+        start = chunk_end + pd.Timedelta(days=1)
+    return chunks
+
+class FileDataSource(DataSource):
+    """
+    Data read from wide files in a directory named as in a DataCache
+    directory, which can be read as is: '<field>_<period>' files indexed
+    by date with one column per code, and
+    'static_sectorconstituent_<index_code>_<date>' files with 'wind_code'
+    and 'sec_name' columns, the latest one up to the requested date being
+    read. Characters of the names other than letters, digits, '.' and '-'
+    are replaced by '-'. Parquet, pickle, csv and Excel files are
+    recognized by their extension.
+    Parameters
+    ----------
+    path : str
+        Directory of the files.
+    """
+
+    extensions = ('parquet', 'pickle', 'pkl', 'csv', 'xlsx')
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_stock_list(self, index_code, date):
+        prefix = 'static_' + _escape('sectorconstituent_%s_' % index_code)
+        dates = sorted(os.path.splitext(name)[0][len(prefix):]
+                       for name in os.listdir(self.path)
+                       if name.startswith(prefix))
+        date = _escape(pd.Timestamp(date).strftime('%Y-%m-%d'))
+        dates = [d for d in dates if d <= date] or dates
+        if not dates:
+            raise FileNotFoundError("no %s file in %s" % (prefix, self.path))
+        return self._read(prefix + dates[-1], index_col=None)
+
+    def get_history(self, codes, field, start_date, end_date, period):
+        df = self._read('%s_%s' % (_escape(field), _escape(period)),
+                        index_col=0)
+        df.index = pd.to_datetime(df.index)
+        return df.sort_index().loc[start_date:end_date] \
+            .reindex(columns=list(codes))
+
+    def _read(self, name, index_col):
+        for ext in self.extensions:
+            path = os.path.join(self.path, '%s.%s' % (name, ext))
+            if not os.path.exists(path):
+                continue
+            if ext == 'parquet':
+                return pd.read_parquet(path)
+            elif ext in ('pickle', 'pkl'):
+                df = pd.read_pickle(path)
+                # DataCache pickles its frames with their coverage
+                return df[0] if isinstance(df, tuple) else df
+            elif ext == 'csv':
+                return pd.read_csv(path, index_col=index_col)
+            return pd.read_excel(path, index_col=index_col)
+        raise FileNotFoundError("no %s file in %s" % (name, self.path))
+
+class SyntheticDataSource(DataSource):
+    """
+    Deterministic random data of the same shape as Wind's, for offline runs
+    and benchmarks. Every code gets its own seeded series, so overlapping
+    requests return consistent values.
+    Parameters
+    ----------
+    seed : int
+        Seed of the generated data.
+    n_stocks : int
+        Number of constituents of any index.
+    """
+
+    origin = '2000-01-01'
+
+    def __init__(self, seed=0, n_stocks=50):
+        self.seed = seed
+        self.n_stocks = n_stocks
+
+    def get_stock_list(self, index_code, date):
+        codes = ['%06d.SZ' % (i + 1) for i in range(self.n_stocks)]
+        return pd.DataFrame({'wind_code': codes,
+                             'sec_name': ['STOCK%d' % (i + 1)
+                                          for i in range(self.n_stocks)]})
+
+    def get_history(self, codes, field, start_date, end_date, period):
+        dates = pd.date_range(self.origin, end_date, freq=period)
+        columns = {}
+        for code in codes:
+            rng = np.random.RandomState(
+                zlib.crc32(('%s|%s|%s' % (self.seed, code, field)).encode()))
+            if field == 'close':
+                returns = rng.normal(0.005, 0.08, len(dates))
+                columns[code] = 10 * np.exp(np.cumsum(returns))
+            else:
+                columns[code] = rng.normal(0.1, 0.05, len(dates))
+        df = pd.DataFrame(columns, index=dates, columns=list(codes))
+        return df.loc[pd.Timestamp(start_date):]
+
+_source = WindDataSource()
+
+# local cache of the source data, see set_cache
+_cache = DataCache(os.environ['FACTOR_ANALYSIS_CACHE']) \
+    if os.environ.get('FACTOR_ANALYSIS_CACHE') else None
+
+def set_source(source):
+    """
+    Selects the DataSource used by the functions of this module, Wind by
+    default.
+    """
+    global _source
+    _source = source
+    return _source
+
+def get_source():
+    return _source
+
+def set_cache(path, max_bytes=None):
+    """
+    Points the data cache at a directory, shared by every process
+    using the same path. Pass None to disable caching. The default
+    directory is taken from the FACTOR_ANALYSIS_CACHE environment variable.
+    Parameters
+    ----------
+    path : str or None
+        Cache directory.
+    max_bytes : int, optional
+        Size budget of the cache, least recently used files are evicted
+        beyond it.
+    Returns
+    -------
+    cache : cache.DataCache or None
+    """
+    global _cache
+    _cache = DataCache(path, max_bytes) if path is not None else None
+    return _cache
+
+def get_cache():
+    return _cache
+
 def get_stock_list(index_code):
-    data = w.wset("sectorconstituent", "date=%s;windcode=%s;field=wind_code,sec_name"%(today, index_code))
-    df = pd.DataFrame(data.Data, index=data.Fields).T
-    return df
+    def fetch():
+        return _source.get_stock_list(index_code, today)
+
+    if _cache is None:
+        return fetch()
+    return _cache.get_static('sectorconstituent_%s_%s' % (index_code, today),
+                             fetch)
 
 def get_stocks_history_close(codes, start_date, end_date, period):
-    if period in ['M', 'Q']:
-        data = w.wsd(codes, 'close', start_date, end_date, 'Period=%s;Days=Alldays'%(period))
-        df = pd.DataFrame(data.Data, index=data.Codes, columns=pd.to_datetime(data.Times)).T
-    return df
+    if period not in ['M', 'Q']:
+        raise ValueError("period should be 'M' or 'Q'")
+    return _get_history(codes, 'close', start_date, end_date, period)
 
 def get_stocks_fundamental_factor(codes, factor_name, start_date, end_date):
-    data = w.wsd(codes, factor_name, start_date, end_date, "Period=Q;Days=Alldays")
-    df = pd.DataFrame(data.Data, index=data.Codes, columns=pd.to_datetime(data.Times)).T
-    return df
\ No newline at end of file
+    return _get_history(codes, factor_name, start_date, end_date, 'Q')
+
+def _get_history(codes, field, start_date, end_date, period):
+    def fetch(codes, start_date, end_date):
+        return _source.get_history(codes, field, start_date, end_date,
+                                   period)
+
+    if _cache is None:
+        return fetch(codes, start_date, end_date)
+    return _cache.get_frame(field, period, codes, start_date, end_date, fetch)
\ No newline at end of file
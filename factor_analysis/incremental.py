@@ -0,0 +1,495 @@
+import os
+import pickle
+
+import pandas as pd
+import numpy as np
+
+from . import utils
+from . import performance as perf
+
+class IncrementalFactorState(object):
+    """
+    Factor analysis updated one date at a time, e.g. at every month-end,
+    without recomputing the history.
+
+    Each call to append adds the factor cross-section and the prices of a
+    new date. A date is final once all of its forward returns have matured,
+    max(periods) dates later: its entries are then cleaned and binned like
+    get_clean_factor_and_forward_returns would, and its quantile returns,
+    factor weighted returns and the cumulative returns are appended to the
+    running results. Only the prices of the last max(periods) + 1 dates and
+    the cross-sections not final yet are kept to do so, so every append
+    costs O(new rows).
+
+    Over the same dates the results equal those of the batch functions on
+    the full history for the final dates.
+    Parameters
+    ----------
+    periods : sequence[int]
+        Forward return periods.
+    quantiles, bins, binning_by_group, zero_aware
+        Binning of the factor, see utils.get_clean_factor_and_forward_returns
+    groupby : dict, optional
+        Asset -> group mapping, used when append gets no groups.
+    groupby_labels : dict, optional
+        Group -> label mapping.
+    long_short : bool
+        Demean quantile returns and factor weights across the universe.
+    group_neutral : bool
+        Demean quantile returns and factor weights at the group level.
+    equal_weight : bool
+        Equal weighted instead of factor weighted portfolio returns,
+        see performance.factor_weights
+    keep_factor_data : bool
+        Keep the cleaned entries of the final dates, see factor_data.
+    """
+
+    def __init__(self,
+                 periods=(1, 5, 10),
+                 quantiles=5,
+                 bins=None,
+                 binning_by_group=False,
+                 zero_aware=False,
+                 groupby=None,
+                 groupby_labels=None,
+                 long_short=True,
+                 group_neutral=False,
+                 equal_weight=False,
+                 keep_factor_data=True):
+        self.periods = tuple(sorted(periods))
+        self.quantiles = quantiles
+        self.bins = bins
+        self.binning_by_group = binning_by_group
+        self.zero_aware = zero_aware
+        self.groupby = groupby
+        self.groupby_labels = groupby_labels
+        self.long_short = long_short
+        self.group_neutral = group_neutral
+        self.equal_weight = equal_weight
+        self.keep_factor_data = keep_factor_data
+
+        self.dates = []
+        self.freq = None
+        # forward filled prices of the last max(periods) + 1 dates
+        self._prices = pd.DataFrame()
+        # cross-sections whose forward returns have not all matured yet
+        self._pending = []
+        self._factor_data = []
+        self._mean_ret = []
+        self._std_err = []
+        self._factor_returns = []
+        self._cum_factor = None
+        self._cum_quantile = {}
+        self._cum_factor_rows = []
+        self._cum_quantile_rows = []
+        self._counts = dict(initial=0, forward_returns=0, binning=0)
+        self._cached = {}
+
+    def __repr__(self):
+        return "<IncrementalFactorState: %d dates, %d final>" % (
+            len(self.dates), len(self.dates) - len(self._pending))
+
+    @classmethod
+    def from_history(cls, factor, prices, groupby=None, **kwargs):
+        """
+        Builds the state of a history, appending its dates one by one.
+        Parameters
+        ----------
+        factor : pd.Series - MultiIndex
+            Factor values indexed by date (level 0) and asset (level 1).
+        prices : pd.DataFrame
+            Prices indexed by the dates of the factor, one column per asset.
+        groupby : pd.Series - MultiIndex or dict, optional
+            Group of every factor entry, or asset -> group mapping.
+        **kwargs
+            Parameters of IncrementalFactorState.
+        """
+        if isinstance(groupby, dict):
+            kwargs['groupby'] = groupby
+            groupby = None
+        state = cls(**kwargs)
+        by_date = dict(iter(factor.groupby(level=0)))
+        groups = dict(iter(groupby.groupby(level=0))) \
+            if groupby is not None else {}
+        for date in prices.index:
+            cross_section = by_date.get(date, factor.iloc[:0])
+            group = groups.get(date)
+            state.append(date, cross_section.droplevel(0), prices.loc[date],
+                         None if group is None else group.droplevel(0))
+        return state
+
+    def append(self, date, factor, prices, groups=None):
+        """
+        Adds a new date.
+        Parameters
+        ----------
+        date : datetime
+            The new date, after all the dates appended so far.
+        factor : pd.Series
+            Factor values of the date, indexed by asset.
+        prices : pd.Series
+            Prices of the date, indexed by asset. Missing prices are
+            forward filled.
+        groups : pd.Series or dict, optional
+            Group of the assets at the date, defaults to 'groupby'.
+        Returns
+        -------
+        factor_quantile : pd.Series
+            Quantile of every finite factor value of the new date. It is
+            provisional: once the date is final it is binned again without
+            the assets whose forward returns turned out to be missing.
+        """
+        date = pd.Timestamp(date)
+        if self.dates and date <= self.dates[-1]:
+            raise ValueError("date %s is not after the last date %s"
+                             % (date, self.dates[-1]))
+        if len(self.dates) == 1:
+            self.freq = utils.get_frequency((date - self.dates[0]).days)
+        self.dates.append(date)
+        self._cached.clear()
+
+        self._append_prices(date, prices)
+
+        factor = factor.where(np.isfinite(factor))
+        factor.index = factor.index.rename('asset')
+        groups = self._groups(factor.dropna().index, groups)
+        self._pending.append(dict(date=date, factor=factor, groups=groups))
+
+        # the pending dates are the last ones, the first is final when the
+        # prices of its longest period have been appended
+        while len(self._pending) > self.periods[-1]:
+            self._finalize(self._pending.pop(0))
+
+        return self._binning(date, factor.dropna(), groups)
+
+    def _append_prices(self, date, prices):
+        prices = prices.astype(np.float64)
+        columns = self._prices.columns.union(prices.index, sort=False)
+        tail = self._prices.reindex(columns=columns)
+        row = prices.reindex(columns)
+        if len(tail) > 0:
+            row = row.fillna(tail.iloc[-1])
+        tail.loc[date] = row.values
+        self._prices = tail.iloc[-(self.periods[-1] + 1):]
+
+    def _groups(self, assets, groups):
+        if groups is None:
+            groups = self.groupby
+        if groups is None:
+            return None
+        if isinstance(groups, dict):
+            diff = set(assets) - set(groups.keys())
+            if len(diff) > 0:
+                raise KeyError("Assets {} not in group mapping".format(
+                    list(diff)))
+        groups = pd.Series(groups).reindex(assets).dropna()
+        if self.groupby_labels is not None:
+            diff = set(groups.values) - set(self.groupby_labels.keys())
+            if len(diff) > 0:
+                raise KeyError("groups {} not in passed group names".format(
+                    list(diff)))
+            groups = pd.Series(pd.Series(self.groupby_labels)[
+                groups.values].values, index=groups.index)
+        return groups
+
+    def _binning(self, date, factor_data, groups):
+        factor_data = pd.DataFrame({'factor': factor_data})
+        if groups is not None:
+            factor_data['group'] = groups.reindex(factor_data.index) \
+                .astype('category')
+        factor_data.index = pd.MultiIndex.from_product(
+            [[date], factor_data.index], names=['date', 'asset'])
+        return utils.quantize_factor(factor_data, self.quantiles, self.bins,
+                                     self.binning_by_group, True,
+                                     self.zero_aware)
+
+    def _finalize(self, pending):
+        date, factor, groups = \
+            pending['date'], pending['factor'], pending['groups']
+        # the date is the first row of the price tail
+        prices = self._prices.reindex(columns=factor.index)
+        start = prices.iloc[0].values
+        columns = self.forward_returns_columns
+        factor_data = pd.DataFrame(index=factor.index)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for period, column in zip(self.periods, columns):
+                factor_data[column] = prices.iloc[period].values / start - 1
+        factor_data['factor'] = factor
+        if groups is not None:
+            factor_data['group'] = groups.astype('category')
+        factor_data.index = pd.MultiIndex.from_product(
+            [[date], factor_data.index], names=['date', 'asset'])
+
+        self._counts['initial'] += len(factor_data)
+        factor_data = factor_data.dropna()
+        self._counts['forward_returns'] += len(factor_data)
+        factor_data['factor_quantile'] = self._binning(
+            date, factor_data['factor'].droplevel(0),
+            factor_data['group'].droplevel(0) if groups is not None
+            else None)
+        factor_data = factor_data.dropna()
+        self._counts['binning'] += len(factor_data)
+        if self.keep_factor_data:
+            self._factor_data.append(factor_data)
+        if len(factor_data) == 0:
+            return
+
+        mean_ret, std_err = perf.mean_return_by_quantile(
+            factor_data, by_date=True, demeaned=self.long_short,
+            group_adjust=self.group_neutral)
+        returns = perf.factor_returns(factor_data, self.long_short,
+                                      self.group_neutral, self.equal_weight)
+        self._mean_ret.append(mean_ret)
+        self._std_err.append(std_err)
+        self._factor_returns.append(returns)
+
+        # running products, as performance.cumulative_returns
+        step = returns.iloc[0].fillna(0) + 1
+        self._cum_factor = step if self._cum_factor is None \
+            else self._cum_factor * step
+        self._cum_factor_rows.append(self._cum_factor.rename(date))
+        for quantile, row in mean_ret.droplevel('date').iterrows():
+            self._cum_quantile[quantile] = self._cum_quantile.get(
+                quantile, 1.0) * (row.fillna(0) + 1)
+        self._cum_quantile_rows.append(
+            pd.concat(self._cum_quantile, names=['factor_quantile'])
+            .rename(date))
+
+    @property
+    def forward_returns_columns(self):
+        return ['%d%s' % (period, self.freq) for period in self.periods]
+
+    @property
+    def pending_dates(self):
+        """
+        Dates whose forward returns have not all matured yet.
+        """
+        return pd.DatetimeIndex([p['date'] for p in self._pending],
+                                name='date')
+
+    @property
+    def factor_data(self):
+        """
+        The cleaned entries of the final dates, as returned by
+        utils.get_clean_factor_and_forward_returns.
+        """
+        if not self.keep_factor_data:
+            raise ValueError("factor data is not kept, see keep_factor_data")
+        return self._concat('factor_data', self._factor_data)
+
+    @property
+    def mean_return_by_date(self):
+        """
+        The mean returns of performance.mean_return_by_quantile with
+        by_date=True, for the final dates.
+        """
+        return self._concat('mean_ret', self._mean_ret, sort=True)
+
+    @property
+    def std_error_by_date(self):
+        return self._concat('std_err', self._std_err, sort=True)
+
+    @property
+    def factor_returns(self):
+        """
+        Factor weighted portfolio returns of the final dates, see
+        performance.factor_returns
+        """
+        return self._concat('factor_returns', self._factor_returns)
+
+    @property
+    def cumulative_returns(self):
+        """
+        Cumulative factor weighted portfolio returns of every period,
+        performance.cumulative_returns of factor_returns.
+        """
+        if 'cum_factor' not in self._cached:
+            self._cached['cum_factor'] = pd.DataFrame(
+                self._cum_factor_rows,
+                columns=self.forward_returns_columns) \
+                .rename_axis('date')
+        return self._cached['cum_factor']
+
+    @property
+    def cumulative_returns_by_quantile(self):
+        """
+        Cumulative returns of every quantile, dates x (period, quantile),
+        performance.cumulative_returns of the unstacked
+        mean_return_by_date.
+        """
+        if 'cum_quantile' not in self._cached:
+            cum = pd.DataFrame(self._cum_quantile_rows)
+            quantiles = self.mean_return_by_date.index.levels[0]
+            cum.columns = pd.MultiIndex.from_arrays(
+                [cum.columns.get_level_values(1),
+                 cum.columns.get_level_values(0).astype(quantiles.dtype)],
+                names=[None, 'factor_quantile'])
+            # quantiles seen late start at 1, like a zero return
+            self._cached['cum_quantile'] = cum.sort_index(axis=1) \
+                .fillna(1.0).rename_axis('date')
+        return self._cached['cum_quantile']
+
+    @property
+    def loss(self):
+        """
+        Share of the entries of the final dates dropped in total, in the
+        forward returns computation and in the binning phase, as reported
+        by get_clean_factor.
+        """
+        initial = float(self._counts['initial'])
+        if initial == 0:
+            return dict(total=0.0, forward_returns=0.0, binning=0.0)
+        total = (initial - self._counts['binning']) / initial
+        fwdret = (initial - self._counts['forward_returns']) / initial
+        return dict(total=total, forward_returns=fwdret,
+                    binning=total - fwdret)
+
+    def _concat(self, name, frames, sort=False):
+        if name not in self._cached:
+            if frames:
+                result = pd.concat(frames)
+                self._cached[name] = result.sort_index() if sort else result
+            else:
+                self._cached[name] = pd.DataFrame(
+                    columns=self.forward_returns_columns)
+        return self._cached[name]
+
+    def save(self, path):
+        """
+        Writes the state to 'path', atomically.
+        """
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a state written by save.
+        """
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if not isinstance(state, cls):
+            raise TypeError("%s does not hold an %s" % (path, cls.__name__))
+        return state
+
+class RunningFactorReturns(object):
+    """
+    Quantile and factor weighted portfolio returns folded from chunks of
+    dates of factor data, e.g. those of
+    utils.iter_clean_factor_and_forward_returns, so that only results by
+    date are kept rather than the entries.
+
+    The chunks must not share dates: the returns of a date only depend on
+    its own entries, so over the same dates the results equal those of
+    performance.mean_return_by_quantile and performance.factor_returns on
+    the concatenated chunks.
+    Parameters
+    ----------
+    by_group : bool
+        Quantile returns separately for each group.
+    demeaned : bool
+        Demean quantile returns and factor weights across the universe.
+    group_adjust : bool
+        Demean quantile returns and factor weights at the group level.
+    equal_weight : bool
+        Equal weighted instead of factor weighted portfolio returns,
+        see performance.factor_weights
+    """
+
+    def __init__(self,
+                 by_group=False,
+                 demeaned=True,
+                 group_adjust=False,
+                 equal_weight=False):
+        self.by_group = by_group
+        self.demeaned = demeaned
+        self.group_adjust = group_adjust
+        self.equal_weight = equal_weight
+        self.rows = 0
+        self._mean_ret = []
+        self._std_err = []
+        self._factor_returns = []
+        self._cached = {}
+
+    def __repr__(self):
+        return "<RunningFactorReturns: %d chunks, %d rows>" % (
+            len(self._factor_returns), self.rows)
+
+    @classmethod
+    def fold(cls, chunks, **kwargs):
+        """
+        Folds an iterable of factor data chunks.
+        Parameters
+        ----------
+        chunks : iterable of pd.DataFrame - MultiIndex
+            Factor data of disjoint dates, see
+            utils.iter_clean_factor_and_forward_returns
+        **kwargs
+            Parameters of RunningFactorReturns.
+        """
+        running = cls(**kwargs)
+        for factor_data in chunks:
+            running.update(factor_data)
+        return running
+
+    def update(self, factor_data):
+        """
+        Adds the returns of a chunk of factor data.
+        """
+        if len(factor_data) == 0:
+            return
+        self._cached.clear()
+        self.rows += len(factor_data)
+        mean_ret, std_err = perf.mean_return_by_quantile(
+            factor_data, by_date=True, by_group=self.by_group,
+            demeaned=self.demeaned, group_adjust=self.group_adjust)
+        self._mean_ret.append(mean_ret)
+        self._std_err.append(std_err)
+        self._factor_returns.append(perf.factor_returns(
+            factor_data, self.demeaned, self.group_adjust,
+            self.equal_weight))
+
+    @property
+    def mean_return_by_date(self):
+        """
+        The mean returns of performance.mean_return_by_quantile with
+        by_date=True.
+        """
+        return self._concat('mean_ret', self._mean_ret)
+
+    @property
+    def std_error_by_date(self):
+        return self._concat('std_err', self._std_err)
+
+    @property
+    def factor_returns(self):
+        """
+        Factor weighted portfolio returns by date, see
+        performance.factor_returns
+        """
+        return self._concat('factor_returns', self._factor_returns)
+
+    def mean_return_by_quantile(self):
+        """
+        Mean returns and standard errors of
+        performance.mean_return_by_quantile with by_date=False: the mean
+        and standard error across dates of the returns by date.
+        """
+        if 'by_quantile' not in self._cached:
+            mean_by_date = self.mean_return_by_date
+            levels = ['factor_quantile']
+            if self.by_group:
+                levels.append('group')
+            grouped = mean_by_date.groupby(level=levels)
+            mean_ret = grouped.mean()
+            std_error_ret = grouped.std() / np.sqrt(grouped.count())
+            self._cached['by_quantile'] = (mean_ret, std_error_ret)
+        return self._cached['by_quantile']
+
+    def _concat(self, name, frames):
+        if name not in self._cached:
+            self._cached[name] = pd.concat(frames).sort_index() if frames \
+                else pd.DataFrame()
+        return self._cached[name]
@@ -0,0 +1,165 @@
+"""
+Converts wide sheets of factor values or prices (dates in the first column,
+one column per asset) from Excel or csv to a columnar format once, and
+loads them back in the shapes get_clean_factor_and_forward_returns expects.
+
+    python -m factor_analysis.ingest data/factor.xlsx data/prices.xlsx
+"""
+import argparse
+import os
+
+import pandas as pd
+import numpy as np
+
+from .store import MappedPanel
+
+try:
+    import pyarrow  # noqa: F401
+    _DEFAULT_FORMAT = 'parquet'
+except ImportError:
+    _DEFAULT_FORMAT = 'npy'
+
+FORMATS = ('parquet', 'feather', 'npy', 'pickle')
+
+_SHEETS = ('.xlsx', '.xls', '.csv')
+
+def convert(source, destination=None, fmt=None):
+    """
+    Converts a wide Excel or csv sheet to a columnar file, with a datetime
+    'date' index, string 'asset' columns and float64 values.
+    Parameters
+    ----------
+    source : str
+        Path of the sheet.
+    destination : str, optional
+        Path of the converted file, next to the sheet with the extension
+        of the format by default ('npy' panels are directories named as
+        the sheet without extension).
+    fmt : str, optional
+        One of 'parquet', 'feather' (both need pyarrow), 'npy' (a
+        store.MappedPanel) or 'pickle'. Parquet if pyarrow is installed,
+        npy otherwise.
+    Returns
+    -------
+    destination : str
+    """
+    fmt = fmt or _DEFAULT_FORMAT
+    if fmt not in FORMATS:
+        raise ValueError("fmt must be one of %s" % (FORMATS,))
+    if destination is None:
+        destination = _converted_path(source, fmt)
+
+    frame = _normalize(_read_sheet(source))
+    if fmt == 'npy':
+        MappedPanel.write(destination, frame)
+        return destination
+
+    tmp = '%s.%d.tmp' % (destination, os.getpid())
+    if fmt == 'parquet':
+        frame.to_parquet(tmp)
+    elif fmt == 'feather':
+        frame.reset_index().to_feather(tmp)
+    else:
+        frame.to_pickle(tmp)
+    os.replace(tmp, destination)
+    return destination
+
+def read_wide(path):
+    """
+    Reads a wide dates x assets frame from a sheet or a converted file,
+    the format being told by the extension.
+    """
+    if os.path.isdir(path):
+        return MappedPanel(path).to_frame()
+    ext = os.path.splitext(path)[1].lower()
+    if ext in _SHEETS:
+        return _normalize(_read_sheet(path))
+    if ext == '.parquet':
+        frame = pd.read_parquet(path)
+    elif ext == '.feather':
+        frame = pd.read_feather(path).set_index('date')
+    elif ext in ('.pickle', '.pkl'):
+        frame = pd.read_pickle(path)
+    else:
+        raise ValueError("unknown file format %r" % path)
+    frame.columns.name = 'asset'
+    return frame
+
+def load_prices(path, fmt=None, refresh=False, mmap=False):
+    """
+    Prices as a wide frame indexed by date with one column per asset.
+    A sheet is converted to 'fmt' on first use, and again only when it is
+    newer than its converted file, which is read instead.
+    Parameters
+    ----------
+    path : str
+        Sheet or converted file.
+    fmt : str, optional
+        Format of the conversion, see convert.
+    refresh : bool, optional
+        Convert the sheet even if its converted file is up to date.
+    mmap : bool, optional
+        Return an 'npy' panel as a store.MappedPanel, read on demand,
+        instead of loading it.
+    Returns
+    -------
+    prices : pd.DataFrame or store.MappedPanel
+    """
+    path = _up_to_date(path, fmt, refresh)
+    if mmap and os.path.isdir(path):
+        return MappedPanel(path)
+    return read_wide(path)
+
+def load_factor(path, fmt=None, refresh=False):
+    """
+    Factor values as a Series indexed by date (level 0) and asset
+    (level 1), without the missing values. Sheets are converted as in
+    load_prices.
+    """
+    path = _up_to_date(path, fmt, refresh)
+    if os.path.isdir(path):
+        return MappedPanel(path).stack()
+    factor = read_wide(path).stack()
+    factor.index.set_names(['date', 'asset'], inplace=True)
+    return factor
+
+def _up_to_date(path, fmt, refresh):
+    """
+    The converted file of a sheet, converted if needed, or 'path' itself.
+    """
+    if os.path.splitext(path)[1].lower() not in _SHEETS:
+        return path
+    converted = _converted_path(path, fmt or _DEFAULT_FORMAT)
+    stamp = os.path.join(converted, 'values.npy') \
+        if os.path.isdir(converted) else converted
+    if refresh or not os.path.exists(stamp) \
+            or os.path.getmtime(stamp) < os.path.getmtime(path):
+        convert(path, converted, fmt)
+    return converted
+
+def _converted_path(source, fmt):
+    stem = os.path.splitext(source)[0]
+    return stem if fmt == 'npy' else '%s.%s' % (stem, fmt)
+
+def _read_sheet(path):
+    if os.path.splitext(path)[1].lower() == '.csv':
+        return pd.read_csv(path, index_col=0)
+    return pd.read_excel(path, index_col=0)
+
+def _normalize(frame):
+    frame = frame[pd.notnull(frame.index)]
+    frame.index = pd.DatetimeIndex(pd.to_datetime(frame.index), name='date')
+    frame.columns = pd.Index(frame.columns.astype(str), name='asset')
+    frame = frame.apply(pd.to_numeric, errors='coerce').astype(np.float64)
+    return frame.sort_index()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('sources', nargs='+')
+    parser.add_argument('--format', default=None, choices=FORMATS)
+    args = parser.parse_args(argv)
+    for source in args.sources:
+        print('%s -> %s' % (source, convert(source, fmt=args.format)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+import os
+
+import numpy as np
+
+try:
+    import numba
+    prange = numba.prange
+except ImportError:
+    numba = None
+    prange = range
+
+BACKENDS = ('auto', 'numpy', 'numba')
+
+# backend of the per date (and group) kernels, see set_backend
+_backend = os.environ.get('FACTOR_ANALYSIS_BACKEND', 'auto')
+
+_compiled = {}
+
+# what np.nan_to_num turns an infinite weight into
+_MAX = np.finfo(np.float64).max
+
+def set_backend(name, threads=None):
+    """
+    Selects how utils.quantize_factor, utils.demean_forward_returns and
+    performance.factor_weights run their per date (and group) operations:
+    'numpy' with vectorized NumPy, 'numba' with compiled loops over the
+    segments of rows sharing a date (and group), run in parallel across
+    segments, or 'auto' (default) for numba when it is installed and numpy
+    otherwise. Both give identical results. The default is taken from the
+    FACTOR_ANALYSIS_BACKEND environment variable.
+    Parameters
+    ----------
+    name : str
+        'auto', 'numpy' or 'numba'.
+    threads : int, optional
+        Number of threads of the numba kernels, all the cores by default.
+    Returns
+    -------
+    backend : str
+        The backend in use, 'numpy' or 'numba'.
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError("backend must be one of %s" % (BACKENDS,))
+    if name == 'numba' and numba is None:
+        raise ImportError("the numba backend needs numba to be installed")
+    _backend = name
+    if threads is not None and numba is not None:
+        numba.set_num_threads(threads)
+    return get_backend()
+
+def get_backend():
+    if _backend == 'auto':
+        return 'numba' if numba is not None else 'numpy'
+    return _backend
+
+def demean(values, keys, n_keys):
+    """
+    utils._demean_values over compiled loops.
+    """
+    missing = keys < 0
+    keys = np.where(missing, n_keys, keys)
+    order, bounds = _segments(keys, n_keys + 1)
+    demeaned = np.empty_like(values, dtype=np.float64)
+    _kernel(_demean_kernel)(np.asarray(values, dtype=np.float64), order,
+                            bounds, demeaned)
+    demeaned[missing] = np.nan
+    return demeaned
+
+def to_weights(values, keys, n_keys, demeaned, equal_weight):
+    """
+    performance._to_weights over compiled loops.
+    """
+    order, bounds = _segments(keys, n_keys)
+    weights = np.empty(len(values))
+    _kernel(_weights_kernel)(np.asarray(values, dtype=np.float64), order,
+                             bounds, demeaned, equal_weight, weights)
+    return weights
+
+def bin_segments(values, keys, quantiles, bins):
+    """
+    utils._bin_segments over compiled loops.
+    """
+    labels = np.full(len(values), np.nan)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return labels, np.zeros(0, dtype=np.int64)
+
+    vals = values[valid]
+    order, bounds = _segments(keys[valid])
+    seg_keys = keys[valid][order[bounds[:-1]]]
+
+    # mode 0: quantiles, 1: number of bins, 2: bin edges
+    qs = edges = np.zeros(0)
+    n_bins = 0
+    if quantiles is not None:
+        mode = 0
+        qs = np.linspace(0, 1, quantiles + 1) \
+            if isinstance(quantiles, (int, np.integer)) \
+            else np.asarray(quantiles, dtype=np.float64)
+    elif isinstance(bins, (int, np.integer)):
+        if bins < 1:
+            raise ValueError("`bins` should be a positive integer.")
+        mode = 1
+        n_bins = int(bins)
+    else:
+        mode = 2
+        edges = np.asarray(bins, dtype=np.float64)
+        if (np.diff(edges) < 0).any():
+            raise ValueError("bins must increase monotonically.")
+
+    out = np.empty(len(vals))
+    bad = np.zeros(len(seg_keys), dtype=np.bool_)
+    _kernel(_bin_kernel)(vals, order, bounds, mode, qs, n_bins, edges, out,
+                         bad)
+    labels[valid] = out
+    return labels, seg_keys[bad]
+
+def _segments(keys, n_keys=None):
+    """
+    Row order grouping the rows by key, keeping their order within a key,
+    and the bounds of every key's rows in it (only the present keys when
+    n_keys is None).
+    """
+    if len(keys) == 0 or (keys[1:] >= keys[:-1]).all():
+        order = np.arange(len(keys))
+    else:
+        order = np.argsort(keys, kind='stable')
+    if n_keys is None:
+        counts = np.unique(keys, return_counts=True)[1]
+    else:
+        counts = np.bincount(keys, minlength=n_keys)
+    bounds = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=bounds[1:])
+    return order, bounds
+
+def _kernel(func):
+    """
+    The compiled 'func', or 'func' itself without numba.
+    """
+    if numba is None:
+        return func
+    if func not in _compiled:
+        _compiled[func] = numba.njit(parallel=True, cache=True,
+                                     error_model='numpy')(func)
+    return _compiled[func]
+
+# The kernels below are compiled by numba, in its subset of Python. Every
+# segment of rows sharing a key is processed on its own, in parallel, in
+# the row order np.bincount adds them, so sums match the NumPy backend's.
+
+def _demean_kernel(values, order, bounds, out):
+    for s in prange(len(bounds) - 1):
+        for j in range(values.shape[1]):
+            total = 0.0
+            count = 0.0
+            for k in range(bounds[s], bounds[s + 1]):
+                value = values[order[k], j]
+                if not np.isnan(value):
+                    total += value
+                    count += 1.0
+            mean = total / count if count > 0 else np.nan
+            for k in range(bounds[s], bounds[s + 1]):
+                out[order[k], j] = values[order[k], j] - mean
+
+def _weights_kernel(values, order, bounds, demeaned, equal_weight, out):
+    for s in prange(len(bounds) - 1):
+        start, stop = bounds[s], bounds[s + 1]
+        if equal_weight:
+            center = 0.0
+            if demeaned:
+                segment = np.empty(stop - start)
+                n_valid = 0
+                for k in range(start, stop):
+                    segment[k - start] = values[order[k]]
+                    if not np.isnan(values[order[k]]):
+                        n_valid += 1
+                # NaNs are sorted last, the median is that of the others
+                segment = np.sort(segment)
+                center = (segment[(n_valid - 1) // 2]
+                          + segment[n_valid // 2]) / 2 if n_valid > 0 \
+                    else np.nan
+            n_negative = 0.0
+            n_positive = 0.0
+            for k in range(start, stop):
+                weight = np.sign(values[order[k]] - center)
+                out[order[k]] = weight
+                if weight < 0:
+                    n_negative += 1.0
+                elif weight > 0:
+                    n_positive += 1.0
+            if demeaned:
+                for k in range(start, stop):
+                    if out[order[k]] < 0:
+                        out[order[k]] = out[order[k]] / n_negative
+                    elif out[order[k]] > 0:
+                        out[order[k]] = out[order[k]] / n_positive
+        else:
+            mean = 0.0
+            if demeaned:
+                total = 0.0
+                count = 0.0
+                for k in range(start, stop):
+                    if not np.isnan(values[order[k]]):
+                        total += values[order[k]]
+                        count += 1.0
+                mean = total / count if count > 0 else np.nan
+            for k in range(start, stop):
+                out[order[k]] = values[order[k]] - mean if demeaned \
+                    else values[order[k]]
+
+        gross = 0.0
+        for k in range(start, stop):
+            weight = abs(out[order[k]])
+            if np.isinf(weight):
+                gross += _MAX
+            elif not np.isnan(weight):
+                gross += weight
+        for k in range(start, stop):
+            out[order[k]] = out[order[k]] / gross if gross != 0 else np.nan
+
+def _bin_kernel(values, order, bounds, mode, qs, n_bins, bin_edges, out,
+                bad):
+    n_edges = len(qs) if mode == 0 else (n_bins + 1 if mode == 1
+                                         else len(bin_edges))
+    for s in prange(len(bounds) - 1):
+        start, stop = bounds[s], bounds[s + 1]
+        n = stop - start
+        segment = np.empty(n)
+        for k in range(start, stop):
+            segment[k - start] = values[order[k]]
+        segment = np.sort(segment)
+
+        edges = np.empty(n_edges)
+        if mode == 0:
+            # np.quantile, linear interpolation, as pd.qcut
+            for j in range(n_edges):
+                index = (n - 1) * qs[j]
+                if index >= n - 1:
+                    lo = hi = n - 1
+                    gamma = index + 1
+                elif index < 0:
+                    lo = hi = 0
+                    gamma = index
+                else:
+                    lo = int(np.floor(index))
+                    hi = lo + 1
+                    gamma = index - lo
+                diff = segment[hi] - segment[lo]
+                if gamma >= 0.5:
+                    edges[j] = segment[hi] - diff * (1 - gamma)
+                else:
+                    edges[j] = segment[lo] + diff * gamma
+        elif mode == 1:
+            # pd.cut with a number of bins
+            mn = segment[0] + 0.0
+            mx = segment[n - 1] + 0.0
+            if np.isinf(mn) or np.isinf(mx):
+                bad[s] = True
+            flat = mn == mx
+            if flat:
+                mn -= 0.001 * abs(mn) if mn != 0 else 0.001
+                mx += 0.001 * abs(mx) if mx != 0 else 0.001
+            step = (mx - mn) / n_bins
+            for j in range(n_bins):
+                edges[j] = j * step + mn
+            edges[n_bins] = mx
+            if not flat:
+                edges[0] -= (mx - mn) * 0.001
+        else:
+            for j in range(n_edges):
+                edges[j] = bin_edges[j]
+
+        if n_edges != 2:
+            sorted_edges = np.sort(edges)
+            for j in range(1, n_edges):
+                if sorted_edges[j] == sorted_edges[j - 1] or (
+                        np.isnan(sorted_edges[j])
+                        and np.isnan(sorted_edges[j - 1])):
+                    bad[s] = True
+
+        for k in range(start, stop):
+            value = values[order[k]]
+            label = 0
+            for j in range(n_edges):
+                if edges[j] < value:
+                    label += 1
+            if mode == 0 and value == edges[0]:
+                label = 1
+            out[order[k]] = np.nan if label == 0 or label == n_edges \
+                or bad[s] else label
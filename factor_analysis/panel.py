@@ -0,0 +1,221 @@
+import pandas as pd
+import numpy as np
+
+from . import utils
+
+class FactorPanel(object):
+    """
+    Dense counterpart of the factor_data DataFrame returned by
+    utils.get_clean_factor_and_forward_returns.
+
+    Every column of factor_data is held as an aligned 2-D ndarray with one
+    row per date and one column per asset, so no MultiIndex has to be
+    aligned or hashed when the arrays are used. 'mask' flags the
+    (date, asset) pairs present in factor_data; outside of it factor values
+    and forward returns are NaN, quantiles are 0 and group codes are -1.
+    Parameters
+    ----------
+    dates : pd.DatetimeIndex
+        Row labels of the arrays.
+    assets : pd.Index
+        Column labels of the arrays.
+    factor : np.ndarray
+        Factor values, dates x assets.
+    forward_returns : dict
+        Forward return column name -> dates x assets array, in column order.
+    factor_quantile : np.ndarray
+        Factor quantiles (1-based) as integers, 0 where missing.
+    mask : np.ndarray
+        Boolean dates x assets array of the valid entries.
+    group : np.ndarray, optional
+        Integer group codes into 'group_categories', -1 where missing.
+    group_categories : pd.Index, optional
+        Group labels, in the order of the codes.
+    """
+
+    def __init__(self, dates, assets, factor, forward_returns,
+                 factor_quantile, mask, group=None, group_categories=None):
+        self.dates = pd.Index(dates, name='date')
+        self.assets = pd.Index(assets, name='asset')
+        self.factor = factor
+        self.forward_returns = dict(forward_returns)
+        self.factor_quantile = factor_quantile
+        self.mask = mask
+        self.group = group
+        self.group_categories = group_categories
+        self.quantile_dtype = np.dtype(np.int64)
+        self._columns = None
+        self._row_order = None
+        self._rows = None
+        self._cols = None
+
+    @classmethod
+    def from_factor_data(cls, factor_data):
+        """
+        Builds a FactorPanel from a factor_data DataFrame.
+        Parameters
+        ----------
+        factor_data : pd.DataFrame - MultiIndex
+            A MultiIndex DataFrame indexed by date (level 0) and asset
+            (level 1), containing the values for a single alpha factor,
+            forward returns for each period, the factor quantile/bin that
+            factor value belongs to, and (optionally) the group the asset
+            belongs to.
+            - See full explanation in utils.get_clean_factor_and_forward_returns
+        Returns
+        -------
+        panel : FactorPanel
+        """
+        index = factor_data.index.remove_unused_levels()
+        date_level = index.names.index('date')
+        asset_level = index.names.index('asset')
+        dates = index.levels[date_level]
+        assets = index.levels[asset_level]
+        rows = index.codes[date_level]
+        cols = index.codes[asset_level]
+        shape = (len(dates), len(assets))
+
+        def dense(values, fill, dtype):
+            out = np.full(shape, fill, dtype=dtype)
+            out[rows, cols] = values
+            return out
+
+        mask = dense(True, False, bool)
+        factor = dense(factor_data['factor'].values, np.nan, np.float64)
+        forward_returns = {
+            col: dense(factor_data[col].values, np.nan, np.float64)
+            for col in utils.get_forward_returns_columns(factor_data.columns)
+        }
+        quantiles = factor_data['factor_quantile'].values
+        factor_quantile = dense(quantiles, 0, _code_dtype(
+            quantiles.max() if len(quantiles) > 0 else 0))
+
+        group, group_categories = None, None
+        if 'group' in factor_data.columns:
+            group_data = factor_data['group'].astype('category')
+            group_categories = group_data.cat.categories
+            codes = group_data.cat.codes.values
+            group = dense(codes, -1, _code_dtype(len(group_categories)))
+
+        panel = cls(dates, assets, factor, forward_returns, factor_quantile,
+                    mask, group, group_categories)
+        panel.quantile_dtype = factor_data['factor_quantile'].dtype
+        panel._columns = list(factor_data.columns)
+        position = rows.astype(np.int64) * len(assets) + cols
+        if (np.diff(position) < 0).any():
+            # remember the original row order for to_factor_data
+            panel._row_order = np.argsort(np.argsort(position))
+        return panel
+
+    def to_factor_data(self):
+        """
+        Converts the panel back to the factor_data DataFrame layout, with
+        the row order of the frame the panel was built from (row major
+        order otherwise).
+        Returns
+        -------
+        factor_data : pd.DataFrame - MultiIndex
+            - See full explanation in utils.get_clean_factor_and_forward_returns
+        """
+        data = {col: self.values(col) for col in self.periods}
+        data['factor'] = self.values('factor')
+        if self.group is not None:
+            data['group'] = pd.Categorical.from_codes(
+                self.values('group'), categories=self.group_categories)
+        data['factor_quantile'] = self.values('factor_quantile') \
+            .astype(self.quantile_dtype)
+
+        factor_data = pd.DataFrame(data, index=self.index)
+        if self._row_order is not None:
+            factor_data = factor_data.iloc[self._row_order]
+        if self._columns is not None:
+            factor_data = factor_data[self._columns]
+        return factor_data
+
+    @property
+    def periods(self):
+        """
+        Forward returns column names.
+        """
+        return pd.Index(list(self.forward_returns))
+
+    @property
+    def columns(self):
+        """
+        Columns of the equivalent factor_data DataFrame.
+        """
+        columns = list(self.periods) + ['factor']
+        if self.group is not None:
+            columns.append('group')
+        return pd.Index(columns + ['factor_quantile'])
+
+    @property
+    def shape(self):
+        return self.mask.shape
+
+    @property
+    def nbytes(self):
+        arrays = [self.factor, self.factor_quantile, self.mask] \
+            + list(self.forward_returns.values())
+        if self.group is not None:
+            arrays.append(self.group)
+        return sum(a.nbytes for a in arrays)
+
+    def __len__(self):
+        return len(self._positions()[0])
+
+    def __repr__(self):
+        return "<FactorPanel: %d dates x %d assets, %d entries, periods %s>" \
+            % (len(self.dates), len(self.assets), len(self),
+               list(self.periods))
+
+    @property
+    def index(self):
+        """
+        (date, asset) MultiIndex of the valid entries, in row major order.
+        """
+        rows, cols = self._positions()
+        return pd.MultiIndex(levels=[self.dates, self.assets],
+                             codes=[rows, cols], names=['date', 'asset'],
+                             verify_integrity=False)
+
+    def values(self, column):
+        """
+        Flat array of the valid entries of a factor_data column, in the
+        order of 'index'. Groups are returned as integer codes.
+        """
+        if column == 'factor':
+            array = self.factor
+        elif column == 'factor_quantile':
+            array = self.factor_quantile
+        elif column == 'group':
+            if self.group is None:
+                raise KeyError('group')
+            array = self.group
+        else:
+            array = self.forward_returns[column]
+        return array[self.mask]
+
+    def segment_keys(self, by_group=False):
+        """
+        Integer key of the date (and optionally group) of every valid entry
+        and an upper bound on the number of keys, as utils._segment_keys.
+        """
+        keys = self._positions()[0].astype(np.int64)
+        n_keys = len(self.dates)
+        if by_group:
+            n_groups = max(len(self.group_categories), 1)
+            keys = keys * n_groups + self.values('group')
+            n_keys *= n_groups
+        return keys, n_keys
+
+    def _positions(self):
+        if self._rows is None:
+            self._rows, self._cols = np.nonzero(self.mask)
+        return self._rows, self._cols
+
+def _code_dtype(max_value):
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
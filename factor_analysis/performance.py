@@ -1,8 +1,11 @@
+import re
+
 import pandas as pd
 import numpy as np
-import empyrical as ep
 
 from . import utils
+from . import kernels
+from .panel import FactorPanel, _code_dtype
 
 def mean_return_by_quantile(factor_data,
                             by_date=False,
@@ -20,6 +23,7 @@ def mean_return_by_quantile(factor_data,
         each period, the factor quantile/bin that factor value belongs to, and
         (optionally) the group the asset belongs to.
         - See full explanation in utils.get_clean_factor_and_forward_returns
+        A panel.FactorPanel is accepted as well.
     by_date : bool
         If True, compute quantile bucket returns separately for each date.
     by_group : bool
@@ -36,38 +40,178 @@ def mean_return_by_quantile(factor_data,
         Standard error of returns by specified quantile.
     """
 
+    if isinstance(factor_data, FactorPanel):
+        return _panel_mean_return_by_quantile(factor_data, by_date, by_group,
+                                              demeaned, group_adjust)
+
+    periods = utils.get_forward_returns_columns(factor_data.columns)
+    returns = factor_data[periods].values.astype(np.float64)
+
+    # demeaned on the returns array only, factor_data is left untouched
     if group_adjust:
-        grouper = [factor_data.index.get_level_values('date')] + ['group']
-        factor_data = utils.demean_forward_returns(factor_data, grouper)
+        returns = utils._demean_values(
+            returns, *utils._grouper_keys(factor_data, ['date', 'group']))
     elif demeaned:
-        factor_data = utils.demean_forward_returns(factor_data)
-    else:
-        factor_data = factor_data.copy()
+        returns = utils._demean_values(returns,
+                                       *utils._grouper_keys(factor_data))
 
-    grouper = ['factor_quantile', factor_data.index.get_level_values('date')]
+    # rows with a missing key are left out, like groupby does
+    quantile = factor_data['factor_quantile']
+    keep = quantile.notnull().values
+    dates, d_labels = _sorted_codes(
+        utils._level_codes(factor_data.index, 'date'),
+        factor_data.index.levels[factor_data.index.names.index('date')])
 
+    groups, g_labels, all_groups = None, None, False
     if by_group:
-        grouper.append('group')
+        group = factor_data['group']
+        if isinstance(group.dtype, pd.CategoricalDtype):
+            # like the categorical groupby, every category is reported
+            groups = group.cat.codes.values.astype(np.int64)
+            g_labels = pd.CategoricalIndex(group.cat.categories,
+                                           dtype=group.dtype, name='group')
+            all_groups = True
+        else:
+            codes, uniques = pd.factorize(group, sort=True)
+            groups = codes.astype(np.int64)
+            g_labels = pd.Index(uniques, name='group')
+        keep &= groups >= 0
+        groups = groups[keep]
+
+    q_labels, quantiles = np.unique(quantile.values[keep],
+                                    return_inverse=True)
+    q_labels = pd.Index(q_labels.astype(quantile.dtype),
+                        name='factor_quantile')
+
+    return _mean_return_by_keys(returns[keep], periods, quantiles, q_labels,
+                                dates[keep], d_labels, groups, g_labels,
+                                all_groups, by_date, by_group)
+
+def _panel_mean_return_by_quantile(panel, by_date, by_group, demeaned,
+                                   group_adjust):
+    """
+    mean_return_by_quantile over the flat arrays of a FactorPanel.
+    """
+    periods = panel.periods
+    returns = np.column_stack([panel.values(col) for col in periods])
+
+    if group_adjust or demeaned:
+        returns = utils._demean_values(
+            returns, *panel.segment_keys(by_group=group_adjust))
+
+    q_labels, quantiles = np.unique(panel.values('factor_quantile'),
+                                    return_inverse=True)
+    q_labels = pd.Index(q_labels.astype(panel.quantile_dtype),
+                        name='factor_quantile')
+    dates, d_labels = _sorted_codes(panel.segment_keys()[0], panel.dates)
+
+    groups, g_labels = None, None
+    if by_group:
+        groups = panel.values('group').astype(np.int64)
+        g_labels = pd.CategoricalIndex(panel.group_categories,
+                                       categories=panel.group_categories,
+                                       name='group')
 
-    group_stats = factor_data.groupby(grouper)[
-        utils.get_forward_returns_columns(factor_data.columns)] \
-        .agg(['mean', 'std', 'count'])
+    return _mean_return_by_keys(returns, periods, quantiles, q_labels,
+                                dates, d_labels, groups, g_labels, True,
+                                by_date, by_group)
 
-    mean_ret = group_stats.T.xs('mean', level=1).T
+def _mean_return_by_keys(returns, periods, quantiles, q_labels, dates,
+                         d_labels, groups, g_labels, all_groups, by_date,
+                         by_group):
+    """
+    Mean returns and standard errors of mean_return_by_quantile, from the
+    integer codes of the quantile, date and group of every row into their
+    sorted labels. All the periods are aggregated in a single pass. With
+    'all_groups' every group is reported for each observed quantile and
+    date, as a groupby on a categorical column does.
+    """
+    n_dates = len(d_labels)
+    n_quantiles = max(len(q_labels), 1)
+    n_groups = max(len(g_labels), 1) if by_group else 1
+    if not by_group:
+        groups = np.zeros(len(quantiles), dtype=np.int64)
+    product = by_group and all_groups
+
+    keys = (quantiles * n_dates + dates) * n_groups + groups
+    mean, std, count = _grouped_stats(returns,
+                                      keys, n_quantiles * n_dates * n_groups)
+    if product:
+        present = _key_product(np.unique(quantiles), np.unique(dates),
+                               n_dates, n_groups)
+    else:
+        present = np.flatnonzero(np.bincount(keys, minlength=len(mean)) > 0)
+    q_codes, rest = np.divmod(present, n_dates * n_groups)
+    d_codes, g_codes = np.divmod(rest, n_groups)
 
     if not by_date:
-        grouper = [mean_ret.index.get_level_values('factor_quantile')]
-        if by_group:
-            grouper.append(mean_ret.index.get_level_values('group'))
-        group_stats = mean_ret.groupby(grouper)\
-            .agg(['mean', 'std', 'count'])
-        mean_ret = group_stats.T.xs('mean', level=1).T
+        keys = q_codes * n_groups + g_codes
+        mean, std, count = _grouped_stats(mean[present], keys,
+                                          n_quantiles * n_groups)
+        if product:
+            present = _key_product(np.unique(q_codes), np.zeros(1, np.int64),
+                                   1, n_groups)
+        else:
+            present = np.unique(keys)
+        q_codes, g_codes = np.divmod(present, n_groups)
+
+    arrays = [q_labels[q_codes]]
+    if by_date:
+        arrays.append(d_labels[d_codes])
+    if by_group:
+        arrays.append(g_labels[g_codes])
+    index = pd.MultiIndex.from_arrays(arrays) if len(arrays) > 1 \
+        else arrays[0]
 
-    std_error_ret = group_stats.T.xs('std', level=1).T \
-        / np.sqrt(group_stats.T.xs('count', level=1).T)
+    mean_ret = pd.DataFrame(mean[present], index=index, columns=periods)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std_error_ret = pd.DataFrame(std[present] / np.sqrt(count[present]),
+                                     index=index, columns=periods)
 
     return mean_ret, std_error_ret
 
+def _sorted_codes(codes, labels):
+    """
+    Codes into sorted labels, for codes into possibly unsorted labels.
+    """
+    if labels.is_monotonic_increasing:
+        return codes, labels
+    order = labels.argsort()
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank[codes], labels[order]
+
+def _key_product(quantiles, dates, n_dates, n_groups):
+    """
+    Sorted (quantile, date, group) keys of every combination of the given
+    quantile and date codes with all the group codes.
+    """
+    keys = (quantiles[:, None, None] * n_dates + dates[None, :, None]) \
+        * n_groups + np.arange(n_groups)[None, None, :]
+    return keys.ravel()
+
+def _grouped_stats(values, keys, n_keys):
+    """
+    Mean, sample standard deviation and count of every column of the 2-D
+    'values' for each integer key, skipping NaNs.
+    """
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    ncols = values.shape[1]
+
+    def segment_sum(x):
+        return np.column_stack([
+            np.bincount(keys, weights=x[:, i], minlength=n_keys)
+            for i in range(ncols)]).reshape(n_keys, ncols)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        count = segment_sum(valid)
+        mean = segment_sum(filled) / count
+        deviation = np.where(valid, values - mean[keys], 0.0)
+        std = np.sqrt(segment_sum(deviation ** 2) / (count - 1))
+
+    return mean, std, count
+
 def cumulative_returns(returns):
     """
     Computes cumulative returns from simple daily returns.
@@ -85,6 +229,8 @@ def cumulative_returns(returns):
             2015-01-08   0.999200
     """
 
+    import empyrical as ep
+
     return ep.cum_returns(returns, starting_value=1)
 
 def factor_returns(factor_data,
@@ -103,6 +249,7 @@ def factor_returns(factor_data,
         each period, the factor quantile/bin that factor value belongs to, and
         (optionally) the group the asset belongs to.
         - See full explanation in utils.get_clean_factor_and_forward_returns
+        A panel.FactorPanel is accepted as well.
     demeaned : bool
         Control how to build factor weights
         -- see performance.factor_weights for a full explanation
@@ -123,6 +270,21 @@ def factor_returns(factor_data,
     weights = \
         factor_weights(factor_data, demeaned, group_adjust, equal_weight)
 
+    if isinstance(factor_data, FactorPanel):
+        weighted_returns = np.column_stack(
+            [factor_data.values(col) * weights.values
+             for col in factor_data.periods])
+        if by_asset:
+            return pd.DataFrame(weighted_returns, index=weights.index,
+                                columns=factor_data.periods)
+        dates = factor_data.segment_keys()[0]
+        returns = np.column_stack(
+            [np.bincount(dates, weights=np.nan_to_num(weighted_returns[:, i]),
+                         minlength=len(factor_data.dates))
+             for i in range(weighted_returns.shape[1])])
+        return pd.DataFrame(returns, index=factor_data.dates,
+                            columns=factor_data.periods)
+
     weighted_returns = \
         factor_data[utils.get_forward_returns_columns(factor_data.columns)] \
         .multiply(weights, axis=0)
@@ -150,6 +312,7 @@ def factor_weights(factor_data,
         each period, the factor quantile/bin that factor value belongs to, and
         (optionally) the group the asset belongs to.
         - See full explanation in utils.get_clean_factor_and_forward_returns
+        A panel.FactorPanel is accepted as well.
     demeaned : bool
         Should this computation happen on a long short portfolio? if True,
         weights are computed by demeaning factor values and dividing by the sum
@@ -172,40 +335,449 @@ def factor_weights(factor_data,
         Assets weighted by factor value.
     """
 
-    def to_weights(group, _demeaned, _equal_weight):
+    if isinstance(factor_data, FactorPanel):
+        segment_keys = factor_data.segment_keys
+        factor = factor_data.values('factor')
+    else:
+        def segment_keys(by_group=False):
+            return utils._segment_keys(factor_data, by_group)
+        factor = factor_data['factor'].values
+
+    keys, n_keys = segment_keys(group_adjust)
+    weights = _to_weights(factor, keys, n_keys, demeaned, equal_weight)
+
+    if group_adjust:
+        keys, n_keys = segment_keys()
+        weights = _to_weights(weights, keys, n_keys, False, False)
 
-        if _equal_weight:
-            group = group.copy()
+    return pd.Series(weights, index=factor_data.index, name='factor')
 
-            if _demeaned:
+def _to_weights(values, keys, n_keys, demeaned, equal_weight):
+    """
+    Vectorized equivalent of applying the per date (or date/group) weighting
+    scheme of factor_weights to every segment of rows sharing a key.
+    """
+    if kernels.get_backend() == 'numba':
+        return kernels.to_weights(values, keys, n_keys, demeaned,
+                                  equal_weight)
+
+    values = np.asarray(values, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if equal_weight:
+            if demeaned:
                 # top assets positive weights, bottom ones negative
-                group = group - group.median()
+                values = values - _segment_median(values, keys, n_keys)[keys]
 
-            negative_mask = group < 0
-            group[negative_mask] = -1.0
-            positive_mask = group > 0
-            group[positive_mask] = 1.0
+            weights = np.sign(values)
 
-            if _demeaned:
+            if demeaned:
                 # positive weights must equal negative weights
-                if negative_mask.any():
-                    group[negative_mask] /= negative_mask.sum()
-                if positive_mask.any():
-                    group[positive_mask] /= positive_mask.sum()
+                negative_mask = weights < 0
+                positive_mask = weights > 0
+                n_negative = np.bincount(keys, weights=negative_mask,
+                                         minlength=n_keys)
+                n_positive = np.bincount(keys, weights=positive_mask,
+                                         minlength=n_keys)
+                weights = np.where(negative_mask, weights / n_negative[keys],
+                                   weights)
+                weights = np.where(positive_mask, weights / n_positive[keys],
+                                   weights)
+
+        elif demeaned:
+            valid = ~np.isnan(values)
+            total = np.bincount(keys, weights=np.where(valid, values, 0.0),
+                                minlength=n_keys)
+            count = np.bincount(keys, weights=valid, minlength=n_keys)
+            weights = values - (total / count)[keys]
+        else:
+            weights = values
+
+        gross = np.bincount(keys, weights=np.nan_to_num(np.abs(weights)),
+                            minlength=n_keys)
+        return weights / gross[keys]
+
+def _segment_median(values, keys, n_keys):
+    """
+    Median of the non NaN 'values' of every key, NaN for empty keys.
+    """
+    order = np.lexsort((values, keys))
+    sorted_values = values[order]
+    sizes = np.bincount(keys, minlength=n_keys)
+    counts = np.bincount(keys[~np.isnan(values)], minlength=n_keys)
+    starts = np.cumsum(sizes) - sizes
+    lo = np.minimum(starts + (counts - 1) // 2, len(values) - 1)
+    hi = np.minimum(starts + counts // 2, len(values) - 1)
+    median = (sorted_values[lo] + sorted_values[hi]) / 2
+    median[counts == 0] = np.nan
+    return median
+
+def factor_information_coefficient(factor_data,
+                                   group_adjust=False,
+                                   by_group=False):
+    """
+    Computes the Spearman Rank Correlation based Information Coefficient (IC)
+    between factor values and N period forward returns for each period in
+    the factor index.
+    Parameters
+    ----------
+    factor_data : pd.DataFrame - MultiIndex
+        A MultiIndex DataFrame indexed by date (level 0) and asset (level 1),
+        containing the values for a single alpha factor, forward returns for
+        each period, the factor quantile/bin that factor value belongs to, and
+        (optionally) the group the asset belongs to.
+        - See full explanation in utils.get_clean_factor_and_forward_returns
+        A panel.FactorPanel is accepted as well.
+    group_adjust : bool
+        Demean forward returns by group before computing IC.
+    by_group : bool
+        If True, compute period wise IC separately for each group.
+    Returns
+    -------
+    ic : pd.DataFrame
+        Spearman Rank correlation between factor and provided forward
+        returns, indexed by date (and group). Entries where a factor value
+        or a forward return is missing are left out of the correlation of
+        that period only.
+    """
 
-        elif _demeaned:
-            group = group - group.mean()
+    if isinstance(factor_data, FactorPanel):
+        segment_keys = factor_data.segment_keys
+        periods = factor_data.periods
+        factor = factor_data.values('factor')
+        returns = np.column_stack([factor_data.values(col)
+                                   for col in periods])
+        dates = factor_data.dates
+        groups = factor_data.group_categories
+    else:
+        def segment_keys(by_group=False):
+            return utils._segment_keys(factor_data, by_group)
+        periods = utils.get_forward_returns_columns(factor_data.columns)
+        factor = factor_data['factor'].values
+        returns = factor_data[periods].values
+        index = factor_data.index
+        dates = index.levels[index.names.index('date')]
+        groups = None
+        if by_group:
+            group = factor_data['group']
+            groups = group.cat.categories \
+                if isinstance(group.dtype, pd.CategoricalDtype) \
+                else pd.factorize(group)[1]
 
-        return group / group.abs().sum()
+    factor = np.asarray(factor, dtype=np.float64)
+    returns = np.asarray(returns, dtype=np.float64)
 
-    grouper = [factor_data.index.get_level_values('date')]
     if group_adjust:
+        returns = utils._demean_values(returns,
+                                       *segment_keys(by_group=True))
+
+    keys, n_keys = segment_keys(by_group)
+    factor_valid = ~np.isnan(factor)
+    factor_ranks = None
+    ic = np.empty((n_keys, len(periods)))
+    for i in range(len(periods)):
+        valid = factor_valid & ~np.isnan(returns[:, i])
+        if factor_ranks is None or not np.array_equal(valid, shared):
+            # the factor ranks are shared by every period with the same
+            # missing entries
+            shared = valid
+            factor_ranks = _segment_rank(factor[valid], keys[valid], n_keys)
+        ic[:, i] = _rank_correlation(
+            factor_ranks, _segment_rank(returns[valid, i], keys[valid],
+                                        n_keys),
+            keys[valid], n_keys)
+
+    present = np.flatnonzero(np.bincount(keys, minlength=n_keys))
+    if by_group:
+        n_groups = max(len(groups), 1)
+        d_codes, g_codes = np.divmod(present, n_groups)
+        index = pd.MultiIndex.from_arrays(
+            [dates[d_codes],
+             pd.CategoricalIndex(pd.Categorical.from_codes(g_codes, groups),
+                                 name='group')],
+            names=['date', 'group'])
+    else:
+        index = pd.Index(dates[present], name='date')
+
+    return pd.DataFrame(ic[present], index=index, columns=periods)
+
+def mean_information_coefficient(factor_data,
+                                 group_adjust=False,
+                                 by_group=False,
+                                 by_time=None):
+    """
+    Get the mean information coefficient of specified groups.
+    Answers questions like:
+    What is the mean IC for each month?
+    What is the mean IC for each group for our whole timerange?
+    What is the mean IC for for each group, each week?
+    Parameters
+    ----------
+    factor_data : pd.DataFrame - MultiIndex
+        A MultiIndex DataFrame indexed by date (level 0) and asset (level 1),
+        containing the values for a single alpha factor, forward returns for
+        each period, the factor quantile/bin that factor value belongs to, and
+        (optionally) the group the asset belongs to.
+        - See full explanation in utils.get_clean_factor_and_forward_returns
+        A panel.FactorPanel is accepted as well.
+    group_adjust : bool
+        Demean forward returns by group before computing IC.
+    by_group : bool
+        If True, take the mean IC for each group.
+    by_time : str (pd time_rule), optional
+        Time window to use when taking mean IC.
+        See http://pandas.pydata.org/pandas-docs/stable/timeseries.html
+        for available options.
+    Returns
+    -------
+    ic : pd.DataFrame or pd.Series
+        Mean Spearman Rank correlation between factor and provided
+        forward price movement windows.
+    """
+
+    ic = factor_information_coefficient(factor_data, group_adjust, by_group)
+
+    grouper = []
+    if by_time is not None:
+        grouper.append(pd.Grouper(freq=by_time))
+    if by_group:
         grouper.append('group')
 
-    weights = factor_data.groupby(grouper)['factor'] \
-        .apply(to_weights, demeaned, equal_weight)
+    if len(grouper) == 0:
+        ic = ic.mean()
+    else:
+        ic = (ic.reset_index().set_index('date').groupby(grouper).mean())
 
-    if group_adjust:
-        weights = weights.groupby(level='date').apply(to_weights, False, False)
+    return ic
 
-    return weights
\ No newline at end of file
+def information_coefficient_summary(ic):
+    """
+    Summary statistics of an IC time series, one row per forward returns
+    period (and group, if 'ic' is by group).
+    Parameters
+    ----------
+    ic : pd.DataFrame
+        IC by date, as returned by factor_information_coefficient.
+    Returns
+    -------
+    summary : pd.DataFrame
+        Mean, standard deviation, information ratio (mean / std) and
+        t-statistic of the mean of the IC, and the number of dates with an
+        IC.
+    """
+
+    if 'group' in ic.index.names:
+        return pd.concat(
+            {group: information_coefficient_summary(
+                group_ic.droplevel('group'))
+             for group, group_ic in ic.groupby(level='group')},
+            names=['group'])
+
+    count = ic.count()
+    summary = pd.DataFrame({'ic_mean': ic.mean(), 'ic_std': ic.std()})
+    summary['ic_ir'] = summary['ic_mean'] \
+        / summary['ic_std'].replace(0, np.nan)
+    summary['ic_t_stat'] = summary['ic_ir'] * np.sqrt(count)
+    summary['n_dates'] = count
+    summary.index.name = 'period'
+    return summary
+
+def _segment_rank(values, keys, n_keys):
+    """
+    1-based rank of 'values' within every key, ties get their average rank
+    (scipy.stats.rankdata's 'average' method). 'values' must not be NaN.
+    """
+    # lay the segments out as the rows of a dense matrix, NaN padded, so
+    # that they are sorted row by row rather than with one global sort
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    sizes = np.bincount(keys, minlength=n_keys)
+    starts = np.cumsum(sizes) - sizes
+    positions = np.arange(len(keys)) - starts[sorted_keys]
+    width = sizes.max() if len(keys) > 0 else 0
+    matrix = np.full((n_keys, width), np.nan)
+    matrix[sorted_keys, positions] = values[order]
+
+    row_order = np.argsort(matrix, axis=1)
+    matrix = np.take_along_axis(matrix, row_order, axis=1)
+    new_run = np.ones(matrix.shape, dtype=bool)
+    new_run[:, 1:] = matrix[:, 1:] != matrix[:, :-1]
+    new_run = new_run.ravel()
+    run_starts = np.flatnonzero(new_run)
+    run_sizes = np.diff(np.append(run_starts, new_run.size))
+    run = np.cumsum(new_run) - 1
+    sorted_ranks = (run_starts[run] % max(width, 1)
+                    + (run_sizes[run] + 1) / 2.0).reshape(matrix.shape)
+
+    matrix_ranks = np.empty(matrix.shape)
+    np.put_along_axis(matrix_ranks, row_order, sorted_ranks, axis=1)
+    ranks = np.empty(len(values))
+    ranks[order] = matrix_ranks[sorted_keys, positions]
+    return ranks
+
+def _rank_correlation(x_ranks, y_ranks, keys, n_keys):
+    """
+    Pearson correlation of the ranks of every key, NaN for keys with fewer
+    than two entries or constant ranks.
+    """
+    count = np.bincount(keys, minlength=n_keys)
+    # average ranks of n entries always have mean (n + 1) / 2
+    center = ((count + 1) / 2.0)[keys]
+    x = x_ranks - center
+    y = y_ranks - center
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ic = np.bincount(keys, weights=x * y, minlength=n_keys) / np.sqrt(
+            np.bincount(keys, weights=x * x, minlength=n_keys)
+            * np.bincount(keys, weights=y * y, minlength=n_keys))
+    ic[count < 2] = np.nan
+    return ic
+
+def quantile_turnover(quantile_factor, quantile=None, period=1):
+    """
+    Computes the proportion of names in a factor quantile that were
+    not in that quantile in the previous period.
+    Parameters
+    ----------
+    quantile_factor : pd.Series
+        DataFrame with date, asset and factor quantile.
+        A panel.FactorPanel is accepted as well.
+    quantile : int, optional
+        Quantile on which to perform turnover analysis, all the quantiles
+        if None.
+    period: int or str, optional
+        Number of dates over which to calculate the turnover, or a forward
+        returns column name (e.g. '5M') to use its period.
+    Returns
+    -------
+    quant_turnover : pd.Series or pd.DataFrame
+        Period by period turnover for that quantile, or for every quantile
+        (one column each) if 'quantile' is None, NaN for the first 'period'
+        dates.
+    """
+
+    dates, quantiles = _quantile_matrix(quantile_factor)
+    lag = _lag(period)
+    labels = np.unique(quantiles[quantiles > 0]) if quantile is None \
+        else [quantile]
+
+    turnover = {}
+    for label in labels:
+        members = quantiles == label
+        count = members.sum(axis=1)
+        new = np.full(len(dates), np.nan)
+        new[lag:] = (members[lag:] & ~members[:-lag]).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = pd.Series(new / count, index=dates, name=label)
+        # dates without the quantile are not part of its history, the first
+        # 'period' ones have no turnover
+        turnover[label] = ratio[count > 0]
+
+    if quantile is not None:
+        return turnover[quantile]
+    return pd.DataFrame(turnover)
+
+def factor_rank_autocorrelation(factor_data, period=1):
+    """
+    Computes autocorrelation of mean factor ranks in specified time spans.
+    We must compare period to period factor ranks rather than factor values
+    to account for systematic shifts in the factor values of all names or
+    names within a group. This metric is useful for measuring the turnover
+    of a factor. If the value of a factor for each name changes randomly
+    from period to period, we'd expect an autocorrelation of 0.
+    Parameters
+    ----------
+    factor_data : pd.DataFrame - MultiIndex
+        A MultiIndex DataFrame indexed by date (level 0) and asset (level 1),
+        containing the values for a single alpha factor, forward returns for
+        each period, the factor quantile/bin that factor value belongs to, and
+        (optionally) the group the asset belongs to.
+        - See full explanation in utils.get_clean_factor_and_forward_returns
+        A panel.FactorPanel is accepted as well.
+    period: int or str, optional
+        Number of dates over which to calculate the autocorrelation, or a
+        forward returns column name (e.g. '5M') to use its period.
+    Returns
+    -------
+    autocorr : pd.Series
+        Rolling 1 period (defined by time_rule) autocorrelation of
+        factor values.
+    """
+
+    if isinstance(factor_data, FactorPanel):
+        dates = factor_data.dates
+        keys, n_keys = factor_data.segment_keys()
+        rows, cols = factor_data._positions()
+        shape = factor_data.shape
+        factor = factor_data.values('factor')
+    else:
+        index = factor_data.index.remove_unused_levels()
+        date_level = index.names.index('date')
+        asset_level = index.names.index('asset')
+        dates = index.levels[date_level]
+        rows = index.codes[date_level]
+        cols = index.codes[asset_level]
+        shape = (len(dates), len(index.levels[asset_level]))
+        keys, n_keys = rows.astype(np.int64), len(dates)
+        factor = factor_data['factor'].values
+
+    factor = np.asarray(factor, dtype=np.float64)
+    valid = ~np.isnan(factor)
+    ranks = np.full(shape, np.nan)
+    ranks[rows[valid], cols[valid]] = _segment_rank(factor[valid],
+                                                    keys[valid], n_keys)
+
+    lag = _lag(period)
+    autocorr = np.full(len(dates), np.nan)
+    if lag < len(dates):
+        current, previous = ranks[lag:], ranks[:-lag]
+        both = ~np.isnan(current) & ~np.isnan(previous)
+        autocorr[lag:] = _row_correlation(np.where(both, current, 0.0),
+                                          np.where(both, previous, 0.0),
+                                          both)
+
+    return pd.Series(autocorr, index=dates, name=period)
+
+def _quantile_matrix(quantile_factor):
+    """
+    Dates and the compact dates x assets matrix of the quantiles, 0 where
+    an asset has no quantile.
+    """
+    if isinstance(quantile_factor, FactorPanel):
+        return quantile_factor.dates, quantile_factor.factor_quantile
+    index = quantile_factor.index.remove_unused_levels()
+    date_level = index.names.index('date')
+    asset_level = index.names.index('asset')
+    values = quantile_factor.values
+    quantiles = np.zeros((len(index.levels[date_level]),
+                          len(index.levels[asset_level])),
+                         dtype=_code_dtype(np.nanmax(values)
+                                           if len(values) > 0 else 0))
+    quantiles[index.codes[date_level], index.codes[asset_level]] = \
+        np.nan_to_num(values)
+    return index.levels[date_level], quantiles
+
+def _lag(period):
+    """
+    Number of dates of a period given as an int or a forward returns column
+    name.
+    """
+    if isinstance(period, str):
+        match = re.match(r'^(\d+)', period)
+        if match is None:
+            raise ValueError("invalid period %r" % period)
+        period = int(match.group(1))
+    if period < 1:
+        raise ValueError("period must be positive")
+    return period
+
+def _row_correlation(x, y, count):
+    """
+    Pearson correlation of every row of 'x' and 'y' over the entries
+    flagged in the boolean 'count' (the others must be 0).
+    """
+    n = count.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.where(count, x - (x.sum(axis=1) / n)[:, None], 0.0)
+        y = np.where(count, y - (y.sum(axis=1) / n)[:, None], 0.0)
+        return (x * y).sum(axis=1) / np.sqrt((x * x).sum(axis=1)
+                                             * (y * y).sum(axis=1))
\ No newline at end of file
@@ -0,0 +1,177 @@
+import os
+import shutil
+
+import pandas as pd
+import numpy as np
+
+class MappedPanel(object):
+    """
+    Dates x assets panel of prices or factor values stored on disk and
+    opened with memory mapping, so that only the rows which are read are
+    loaded, and processes opening the same files share their pages through
+    the OS cache.
+
+    A panel is a directory holding 'values.npy', the dates x assets array,
+    and 'dates.npy' and 'assets.npy', its labels (assets as strings). It is
+    pickled as its path only, so shipping it to worker processes is cheap.
+    Parameters
+    ----------
+    path : str
+        Directory of the panel.
+    mode : str, optional
+        'r' to read (default), 'r+' to also write the values in place.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.mode = mode
+        self.values = np.load(os.path.join(self.path, 'values.npy'),
+                              mmap_mode=mode)
+        self.dates = pd.DatetimeIndex(
+            np.load(os.path.join(self.path, 'dates.npy')), name='date')
+        self.assets = pd.Index(
+            np.load(os.path.join(self.path, 'assets.npy')), name='asset')
+
+    @classmethod
+    def create(cls, path, dates, assets, dtype=np.float64):
+        """
+        Creates an empty (NaN) panel to be filled in place, e.g. date chunk
+        by date chunk, and opens it with mode 'r+'.
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(path, exist_ok=True)
+        dates = pd.DatetimeIndex(dates)
+        assets = pd.Index(assets)
+        np.save(os.path.join(path, 'dates.npy'),
+                dates.values.astype('datetime64[ns]'))
+        np.save(os.path.join(path, 'assets.npy'),
+                np.asarray(assets.astype(str), dtype=np.str_))
+        values = np.lib.format.open_memmap(
+            os.path.join(path, 'values.npy'), mode='w+', dtype=dtype,
+            shape=(len(dates), len(assets)))
+        values[:] = np.nan
+        values.flush()
+        del values
+        return cls(path, mode='r+')
+
+    @classmethod
+    def write(cls, path, data, dtype=np.float64):
+        """
+        Writes a panel and opens it for reading. The panel is written to a
+        temporary directory swapped in once complete, so an interrupted
+        write leaves no partial panel at 'path'.
+        Parameters
+        ----------
+        path : str
+            Directory of the panel, created if needed.
+        data : pd.DataFrame or pd.Series - MultiIndex
+            Wide frame indexed by date with one column per asset (e.g.
+            prices), or a factor Series indexed by date (level 0) and asset
+            (level 1).
+        dtype : np.dtype, optional
+            Dtype of the stored values.
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        if isinstance(data, pd.Series):
+            data = data.unstack()
+        data = data.sort_index()
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            panel = cls.create(tmp, data.index, data.columns, dtype)
+            panel.values[:] = data.values
+            panel.flush()
+            del panel
+            _replace_dir(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return cls(path)
+
+    def __reduce__(self):
+        return (self.__class__, (self.path, self.mode))
+
+    def __repr__(self):
+        return "<MappedPanel: %d dates x %d assets, %s>" % (
+            self.shape + (self.path,))
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def index(self):
+        return self.dates
+
+    @property
+    def columns(self):
+        return self.assets
+
+    def flush(self):
+        if isinstance(self.values, np.memmap):
+            self.values.flush()
+
+    def rows(self, start=None, end=None):
+        """
+        Positions of the dates between 'start' and 'end', as a slice.
+        """
+        return self.dates.slice_indexer(start, end)
+
+    def loc(self, start=None, end=None, assets=None):
+        """
+        Reads the dates between 'start' and 'end' (included) of 'assets'
+        (all by default) into a DataFrame.
+        """
+        rows = self.rows(start, end)
+        values = self.values[rows]
+        columns = self.assets
+        if assets is not None:
+            columns = pd.Index(assets, name='asset')
+            positions = self.assets.get_indexer(columns)
+            values = np.where(positions >= 0,
+                              values[:, np.maximum(positions, 0)], np.nan)
+        return pd.DataFrame(np.asarray(values), index=self.dates[rows],
+                            columns=columns)
+
+    def to_frame(self):
+        return self.loc()
+
+    def stack(self, start=None, end=None, chunk_size=256):
+        """
+        The non NaN values between 'start' and 'end' as a Series indexed by
+        date (level 0) and asset (level 1), e.g. a factor, read chunk_size
+        dates at a time.
+        """
+        rows = self.rows(start, end)
+        dates, assets, values = [], [], []
+        for begin in range(rows.start, rows.stop, chunk_size):
+            block = np.asarray(self.values[begin:min(begin + chunk_size,
+                                                     rows.stop)])
+            date_pos, asset_pos = np.nonzero(~np.isnan(block))
+            dates.append(date_pos + begin)
+            assets.append(asset_pos)
+            values.append(block[date_pos, asset_pos])
+        if not values:
+            dates = assets = [np.zeros(0, dtype=np.int64)]
+            values = [np.zeros(0, dtype=self.values.dtype)]
+        index = pd.MultiIndex(levels=[self.dates, self.assets],
+                              codes=[np.concatenate(dates),
+                                     np.concatenate(assets)],
+                              names=['date', 'asset'],
+                              verify_integrity=False)
+        return pd.Series(np.concatenate(values),
+                         index=index.remove_unused_levels())
+
+def _replace_dir(src, dst):
+    """
+    Renames the directory 'src' to 'dst', replacing it if it exists.
+    """
+    if not os.path.isdir(dst):
+        os.replace(src, dst)
+        return
+    old = '%s.%d.old' % (dst, os.getpid())
+    os.replace(dst, old)
+    os.replace(src, dst)
+    shutil.rmtree(old, ignore_errors=True)
@@ -0,0 +1,177 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+from . import utils
+from . import performance as perf
+
+_worker_data = {}
+
+def run_sweep(factors,
+              prices,
+              groupby=None,
+              quantiles=(5,),
+              bins=(),
+              long_short=(True,),
+              group_neutral=(False,),
+              periods=((1, 5, 10),),
+              binning_by_group=False,
+              groupby_labels=None,
+              max_loss=0.35,
+              zero_aware=False,
+              max_workers=None):
+    """
+    Evaluates every combination of factor, binning, portfolio construction
+    and forward return periods over a pool of worker processes.
+    Each task runs utils.get_clean_factor_and_forward_returns and the
+    performance functions and is summarized in a few rows of the result.
+    A task that fails (e.g. with MaxLossExceededError) is reported in the
+    'error' column instead of stopping the sweep.
+    On platforms that spawn worker processes (Windows) this must be called
+    from under an ``if __name__ == '__main__'`` guard.
+    Parameters
+    ----------
+    factors : dict, list of pd.Series or pd.DataFrame - MultiIndex
+        The factors to evaluate, either a dict of name -> factor Series,
+        a list of named factor Series, or a DataFrame indexed by date
+        (level 0) and asset (level 1) with one column per factor.
+        - See full explanation in utils.get_clean_factor_and_forward_returns
+    prices : pd.DataFrame
+        A wide form Pandas DataFrame indexed by timestamp with assets
+        in the columns.
+    groupby : pd.Series - MultiIndex or dict
+        Group mapping shared by all the tasks
+        - See utils.get_clean_factor_and_forward_returns
+    quantiles : sequence[int or sequence[float]]
+        Values of 'quantiles' to sweep, each one run with bins=None.
+    bins : sequence[int or sequence[float]]
+        Values of 'bins' to sweep, each one run with quantiles=None.
+    long_short : sequence[bool]
+        Values of 'long_short' (demeaned returns and weights) to sweep.
+    group_neutral : sequence[bool]
+        Values of 'group_neutral' (group adjusted returns and weights)
+        to sweep.
+    periods : sequence[sequence[int]]
+        Forward return periods to sweep.
+    binning_by_group, groupby_labels, max_loss, zero_aware
+        Passed unchanged to utils.get_clean_factor_and_forward_returns.
+    max_workers : int, optional
+        Number of worker processes, defaults to the number of CPUs.
+        With max_workers=1 the tasks run serially in this process.
+    Returns
+    -------
+    results : pd.DataFrame
+        One row per task and forward returns period, in grid order
+        (factor, binning, long_short, group_neutral, periods), with the
+        mean return of every quantile (Q1, Q2, ...), the top minus bottom
+        quantile spread, the mean, standard deviation and information ratio
+        of the factor weighted portfolio returns, and the 'error' message
+        of the tasks that failed, along with the share of the factor entries
+        dropped while cleaning ('loss').
+    """
+    factors = utils._factor_dict(factors)
+
+    binnings = [(q, None) for q in quantiles] + [(None, b) for b in bins]
+    tasks = [dict(factor=name, quantiles=q, bins=b, long_short=ls,
+                  group_neutral=gn, periods=tuple(p),
+                  binning_by_group=binning_by_group, max_loss=max_loss,
+                  zero_aware=zero_aware)
+             for name, (q, b), ls, gn, p in itertools.product(
+                 factors, binnings, long_short, group_neutral, periods)]
+
+    initargs = (factors, prices, groupby, groupby_labels)
+    if max_workers == 1:
+        _init_worker(*initargs)
+        try:
+            results = [_run_task(task) for task in tasks]
+        finally:
+            # do not keep the inputs alive in this process
+            _worker_data.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_init_worker,
+                                 initargs=initargs) as executor:
+            # map keeps the grid order whatever the completion order
+            results = list(executor.map(_run_task, tasks))
+
+    return pd.concat(results, ignore_index=True, sort=False)
+
+def _init_worker(factors, prices, groupby, groupby_labels):
+    """
+    Ships the shared inputs to a worker once instead of once per task.
+    """
+    _worker_data.clear()
+    _worker_data.update(factors=factors, prices=prices, groupby=groupby,
+                        groupby_labels=groupby_labels)
+
+def _run_task(task):
+    params = pd.DataFrame([task])
+    # silent, the loss ends up in the results rather than on the console
+    instrument = utils.Instrumentation(logger=None)
+    try:
+        factor_data = utils.get_clean_factor_and_forward_returns(
+            _worker_data['factors'][task['factor']],
+            _worker_data['prices'],
+            groupby=_worker_data['groupby'],
+            binning_by_group=task['binning_by_group'],
+            quantiles=task['quantiles'],
+            bins=task['bins'],
+            periods=task['periods'],
+            groupby_labels=_worker_data['groupby_labels'],
+            max_loss=task['max_loss'],
+            zero_aware=task['zero_aware'],
+            instrument=instrument)
+        summary = summarize(factor_data, task['long_short'],
+                            task['group_neutral'])
+    except Exception as e:
+        params['error'] = '%s: %s' % (type(e).__name__, e)
+        if instrument.loss is not None:
+            params['loss'] = instrument.loss['total']
+        return params
+
+    summary = summary.reset_index()
+    summary['loss'] = instrument.loss['total']
+    summary['error'] = None
+    return pd.concat([pd.concat([params] * len(summary), ignore_index=True),
+                      summary], axis=1)
+
+def summarize(factor_data, long_short=True, group_neutral=False):
+    """
+    Summary table of a factor, one row per forward returns period.
+    Parameters
+    ----------
+    factor_data : pd.DataFrame - MultiIndex
+        A MultiIndex DataFrame indexed by date (level 0) and asset (level 1),
+        containing the values for a single alpha factor, forward returns for
+        each period, the factor quantile/bin that factor value belongs to,
+        and (optionally) the group the asset belongs to.
+        - See full explanation in utils.get_clean_factor_and_forward_returns
+    long_short : bool
+        Demean quantile returns and factor weights across the universe.
+    group_neutral : bool
+        Demean quantile returns and factor weights at the group level.
+    Returns
+    -------
+    summary : pd.DataFrame
+        Mean return of every quantile, top minus bottom spread and factor
+        weighted portfolio return statistics, indexed by period.
+    """
+    mean_ret, _ = perf.mean_return_by_quantile(factor_data,
+                                               demeaned=long_short,
+                                               group_adjust=group_neutral)
+    factor_returns = perf.factor_returns(factor_data, long_short,
+                                         group_neutral)
+
+    summary = mean_ret.T
+    summary.columns = ['Q%d' % q for q in summary.columns]
+    summary['top_bottom_spread'] = mean_ret.iloc[-1] - mean_ret.iloc[0]
+    summary['factor_return_mean'] = factor_returns.mean()
+    summary['factor_return_std'] = factor_returns.std()
+    summary['factor_return_ir'] = summary['factor_return_mean'] \
+        / summary['factor_return_std'].replace(0, np.nan)
+    summary['n_dates'] = factor_returns.shape[0]
+    summary['n_entries'] = len(factor_data)
+    summary.index.name = 'period'
+    return summary
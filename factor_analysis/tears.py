@@ -1,6 +1,10 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
-import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 from . import plotting
 from . import performance as perf
@@ -9,12 +13,19 @@ from . import utils
 class GridFigure(object):
     """
     It makes life easier with grid plots
+    If headless, the figure is drawn on an Agg canvas outside of pyplot,
+    whatever the active backend, and can only be saved to a file.
     """
 
-    def __init__(self, rows, cols):
+    def __init__(self, rows, cols, headless=False):
         self.rows = rows
         self.cols = cols
-        self.fig = plt.figure(figsize=(14, rows * 7))
+        self.headless = headless
+        if headless:
+            self.fig = Figure(figsize=(14, rows * 7))
+            FigureCanvasAgg(self.fig)
+        else:
+            self.fig = plt.figure(figsize=(14, rows * 7))
         self.gs = gridspec.GridSpec(rows, cols, wspace=0.4, hspace=0.3)
         self.curr_row = 0
         self.curr_col = 0
@@ -23,7 +34,7 @@ class GridFigure(object):
         if self.curr_col != 0:
             self.curr_row += 1
             self.curr_col = 0
-        subplt = plt.subplot(self.gs[self.curr_row, :])
+        subplt = self.fig.add_subplot(self.gs[self.curr_row, :])
         self.curr_row += 1
         return subplt
 
@@ -31,17 +42,24 @@ class GridFigure(object):
         if self.curr_col >= self.cols:
             self.curr_row += 1
             self.curr_col = 0
-        subplt = plt.subplot(self.gs[self.curr_row, self.curr_col])
+        subplt = self.fig.add_subplot(self.gs[self.curr_row, self.curr_col])
         self.curr_col += 1
         return subplt
 
+    def save(self, path):
+        self.fig.savefig(path, bbox_inches='tight')
+
     def close(self):
-        plt.close(self.fig)
+        if not self.headless:
+            plt.close(self.fig)
+        else:
+            self.fig.clear()
         self.fig = None
         self.gs = None
 
 def create_returns_tear_sheet(
-    factor_data, long_short=True, group_neutral=False, by_group=False
+    factor_data, long_short=True, group_neutral=False, by_group=False,
+    path=None
 ):
     """
     Creates a tear sheet for returns analysis of a factor.
@@ -65,6 +83,15 @@ def create_returns_tear_sheet(
         plots
     by_group : bool
         If True, display graphs separately for each group.
+    path : str, optional
+        If given, the tear sheet is rendered headless and written to this
+        file instead of being shown, in the format of its extension
+        (.png, .svg, .pdf, ...).
+    Returns
+    -------
+    tables : dict
+        The computed 'factor_returns', 'mean_quant_ret', 'std_quantile',
+        'mean_quant_ret_bydate' and 'std_quant_daily' tables.
     """
 
     factor_returns = perf.factor_returns(
@@ -87,7 +114,7 @@ def create_returns_tear_sheet(
     )
 
     vertical_sections = 3
-    gf = GridFigure(rows=vertical_sections, cols=1)
+    gf = GridFigure(rows=vertical_sections, cols=1, headless=path is not None)
 
     plotting.plot_quantile_returns_bar(
         mean_quant_ret,
@@ -111,5 +138,68 @@ def create_returns_tear_sheet(
         mean_quant_ret_bydate, period=first_col, ax=gf.next_row()
     )
 
-    plt.show()
-    gf.close()
\ No newline at end of file
+    if path is None:
+        plt.show()
+    else:
+        gf.save(path)
+    gf.close()
+
+    return {
+        'factor_returns': factor_returns,
+        'mean_quant_ret': mean_quant_ret,
+        'std_quantile': std_quantile,
+        'mean_quant_ret_bydate': mean_quant_ret_bydate,
+        'std_quant_daily': std_quant_daily,
+    }
+
+def render_returns_tear_sheets(factor_datas, directory, fmt='png',
+                               long_short=True, group_neutral=False,
+                               max_workers=None):
+    """
+    Writes the returns tear sheet of many factors to files, rendering them
+    headless over a pool of worker processes.
+    On platforms that spawn worker processes (Windows) this must be called
+    from under an ``if __name__ == '__main__'`` guard.
+    Parameters
+    ----------
+    factor_datas : dict
+        Factor name -> factor_data DataFrame
+        - See full explanation in utils.get_clean_factor_and_forward_returns
+    directory : str
+        Output directory, created if needed. The tear sheet of factor
+        'name' is written to '<directory>/<name>.<fmt>'.
+    fmt : str
+        File format, e.g. 'png', 'svg' or 'pdf'.
+    long_short : bool
+        See create_returns_tear_sheet.
+    group_neutral : bool
+        See create_returns_tear_sheet.
+    max_workers : int, optional
+        Number of worker processes, defaults to the number of CPUs.
+        With max_workers=1 the tear sheets are rendered in this process.
+    Returns
+    -------
+    tables : dict
+        Factor name -> tables returned by create_returns_tear_sheet, or the
+        exception raised while rendering that factor.
+    """
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(name, data, os.path.join(directory, '%s.%s' % (name, fmt)),
+              long_short, group_neutral)
+             for name, data in factor_datas.items()]
+
+    if max_workers == 1:
+        results = [_render_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_render_task, tasks))
+
+    return dict(zip(factor_datas.keys(), results))
+
+def _render_task(task):
+    name, factor_data, path, long_short, group_neutral = task
+    try:
+        return create_returns_tear_sheet(factor_data, long_short,
+                                         group_neutral, path=path)
+    except Exception as e:
+        return e
\ No newline at end of file
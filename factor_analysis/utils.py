@@ -1,6 +1,16 @@
 import pandas as pd
 import numpy as np
 import re
+import time
+import logging
+import tracemalloc
+import contextlib
+from collections import namedtuple
+
+from .store import MappedPanel
+from . import kernels
+
+logger = logging.getLogger(__name__)
 
 def get_clean_factor_and_forward_returns(factor,
                                          prices,
@@ -11,7 +21,9 @@ def get_clean_factor_and_forward_returns(factor,
                                          periods=(1, 5, 10),
                                          groupby_labels=None,
                                          max_loss=0.35,
-                                         zero_aware=False):
+                                         zero_aware=False,
+                                         instrument=None,
+                                         compact=False):
     """
     Formats the factor data, pricing data, and group mappings into a DataFrame
     that contains aligned MultiIndex indices of timestamp and asset. The
@@ -38,9 +50,10 @@ def get_clean_factor_and_forward_returns(factor,
                         -----------------------
                         |   LULU     |   2.7
                         -----------------------
-    prices : pd.DataFrame
+        A store.MappedPanel of factor values is accepted as well.
+    prices : pd.DataFrame or store.MappedPanel
         A wide form Pandas DataFrame indexed by timestamp with assets
-        in the columns.
+        in the columns, or a memory mapped panel read on demand.
         Pricing data must span the factor analysis time period plus an
         additional buffer window that is greater than the maximum number
         of expected periods in the forward returns calculations.
@@ -121,6 +134,14 @@ def get_clean_factor_and_forward_returns(factor,
         If True, forward returns columns will contain cumulative returns.
         Setting this to False is useful if you want to analyze how predictive
         a factor is for a single forward day.
+    instrument : utils.Instrumentation, optional
+        Collects the wall time, peak memory and row counts of every stage
+        and the data loss, reported through logging and/or a callback
+        instead of being printed.
+    compact : bool, optional
+        Store the result with small dtypes, about half the memory: float32
+        factor and forward returns, int8 quantiles, a categorical asset
+        index level and a categorical group with small integer codes.
     Returns
     -------
     merged_data : pd.DataFrame - MultiIndex
@@ -155,20 +176,318 @@ def get_clean_factor_and_forward_returns(factor,
     utils.get_clean_factor
         For use when forward returns are already available.
     """
-    forward_returns = compute_forward_returns(
-        factor,
-        prices,
-        periods,
-    )
+    if isinstance(factor, MappedPanel):
+        factor = factor.stack()
+
+    with _stage(instrument, 'forward_returns', len(factor)) as stage:
+        forward_returns = compute_forward_returns(
+            factor,
+            prices,
+            periods,
+        )
+        stage.rows_out = len(forward_returns)
 
     factor_data = get_clean_factor(factor, forward_returns, groupby=groupby,
                                    groupby_labels=groupby_labels,
                                    quantiles=quantiles, bins=bins,
                                    binning_by_group=binning_by_group,
-                                   max_loss=max_loss, zero_aware=zero_aware)
+                                   max_loss=max_loss, zero_aware=zero_aware,
+                                   instrument=instrument, compact=compact)
 
     return factor_data
 
+def iter_clean_factor_and_forward_returns(factor,
+                                          prices,
+                                          groupby=None,
+                                          binning_by_group=False,
+                                          quantiles=5,
+                                          bins=None,
+                                          periods=(1, 5, 10),
+                                          groupby_labels=None,
+                                          max_loss=0.35,
+                                          zero_aware=False,
+                                          chunk_size=64,
+                                          instrument=None,
+                                          compact=False):
+    """
+    get_clean_factor_and_forward_returns one chunk of factor dates at a
+    time, for factors whose forward returns and cleaned data do not fit in
+    memory at once. Every chunk reads the prices of its dates plus the
+    max(periods) following ones, forward filled across chunks, and is
+    binned on its own since quantiles are computed date by date.
+
+    Concatenated, the chunks equal the result of
+    get_clean_factor_and_forward_returns for a factor sorted by date. The
+    group column of every chunk has the categories of all the groups of
+    the factor, so that per group results line up across chunks.
+    See incremental.RunningFactorReturns to fold the chunks into the
+    quantile and factor returns as they come.
+    Parameters
+    ----------
+    factor : pd.Series - MultiIndex or store.MappedPanel
+        Factor values indexed by date (level 0) and asset (level 1), or a
+        memory mapped panel of them, read chunk by chunk.
+    prices : pd.DataFrame or store.MappedPanel
+        Prices, see get_clean_factor_and_forward_returns
+    groupby, binning_by_group, quantiles, bins, periods, groupby_labels,
+    zero_aware, instrument, compact
+        See get_clean_factor_and_forward_returns
+    max_loss : float, optional
+        Maximum share of the factor entries dropped over all the chunks.
+        MaxLossExceededError is raised as soon as the entries dropped so
+        far exceed it, and the loss is reported once the last chunk is done.
+    chunk_size : int, optional
+        Number of factor dates per chunk.
+    Yields
+    ------
+    factor_data : pd.DataFrame - MultiIndex
+        The cleaned entries of a chunk of dates, formatted as the result
+        of get_clean_factor_and_forward_returns.
+    """
+    periods = np.array(sorted(periods), dtype=np.int64)
+    assert(prices.shape[0] > 1)
+    freq = get_frequency((prices.index[1] - prices.index[0]).days)
+    columns = ['%d%s' % (period, freq) for period in periods]
+
+    if isinstance(factor, MappedPanel):
+        dates = factor.dates
+        assets = factor.assets
+        total = sum(np.count_nonzero(~np.isnan(factor.values[begin:begin
+                                                             + chunk_size]))
+                    for begin in range(0, len(factor), chunk_size))
+    else:
+        factor, factor_dates = _sorted_by_date(factor)
+        dates = factor_dates.unique()
+        assets = factor.index.remove_unused_levels().levels[1]
+        total = len(factor)
+
+    categories = None
+    if groupby is not None:
+        if isinstance(groupby, dict):
+            categories = [groupby[asset] for asset in assets
+                          if asset in groupby]
+        else:
+            groupby, group_dates = _sorted_by_date(groupby)
+            categories = groupby.dropna().unique()
+        if groupby_labels is not None:
+            categories = [groupby_labels.get(group, group)
+                          for group in categories]
+        categories = sorted(set(categories))
+
+    counts = np.zeros(3)
+    carry = np.full(prices.shape[1], np.nan)
+    carry_row = 0
+    for start in range(0, len(dates), chunk_size):
+        first, last = dates[start], dates[min(start + chunk_size,
+                                              len(dates)) - 1]
+        if isinstance(factor, MappedPanel):
+            chunk = factor.stack(first, last)
+        else:
+            chunk = factor.iloc[factor_dates.searchsorted(first):
+                                factor_dates.searchsorted(last, 'right')]
+        groups = groupby
+        if groupby is not None and not isinstance(groupby, dict):
+            groups = groupby.iloc[group_dates.searchsorted(first):
+                                  group_dates.searchsorted(last, 'right')]
+
+        # price rows of the chunk dates and their look-ahead, forward
+        # filled from the rows before
+        index = chunk.index.remove_unused_levels()
+        level_dates = prices.index.get_indexer(index.levels[0])
+        found = level_dates[level_dates >= 0]
+        begin = found.min() if len(found) > 0 else carry_row
+        stop = found.max() + 1 if len(found) > 0 else carry_row
+        while carry_row < begin:
+            end = min(begin, carry_row + chunk_size)
+            carry = _ffill(np.vstack([carry[None, :],
+                                      _price_rows(prices, carry_row,
+                                                  end)]))[-1]
+            carry_row = end
+        block = _ffill(np.vstack([carry[None, :], _price_rows(
+            prices, begin, min(stop + periods[-1], len(prices)))]))[1:]
+        if stop > begin:
+            carry = block[stop - 1 - begin]
+            carry_row = stop
+
+        with _stage(instrument, 'forward_returns', len(chunk)) as stage:
+            returns = _gather_returns(
+                block, level_dates[index.codes[0]] - begin,
+                prices.columns.get_indexer(index.levels[1])[index.codes[1]],
+                periods, level_dates[index.codes[0]] >= 0)
+            forward_returns = pd.DataFrame(
+                returns.T, index=chunk.index.set_names(['date', 'asset']),
+                columns=columns)
+            stage.rows_out = len(forward_returns)
+
+        factor_data, chunk_counts = _clean_factor(
+            chunk, forward_returns, groups, binning_by_group, quantiles,
+            bins, groupby_labels, max_loss != 0, zero_aware, instrument)
+        counts += chunk_counts
+
+        # entries not read yet count as kept: the loss can only grow
+        lost = counts[0] - counts[2]
+        if lost / total > max_loss:
+            _report_loss((total, total - (counts[0] - counts[1]),
+                          total - lost), max_loss, instrument)
+
+        if categories is not None:
+            factor_data['group'] = \
+                factor_data['group'].cat.set_categories(categories)
+        if compact:
+            factor_data = _compact(factor_data)
+        yield factor_data
+
+    _report_loss(tuple(counts), max_loss, instrument)
+
+def _sorted_by_date(series):
+    """
+    'series' sorted by date (level 0) and its dates, to read date ranges
+    by position.
+    """
+    dates = series.index.get_level_values(0)
+    if not dates.is_monotonic_increasing:
+        series = series.iloc[np.argsort(dates.values, kind='stable')]
+        dates = series.index.get_level_values(0)
+    return series, dates
+
+def _price_rows(prices, begin, end):
+    if isinstance(prices, MappedPanel):
+        return np.array(prices.values[begin:end], dtype=np.float64)
+    return prices.iloc[begin:end].values.astype(np.float64)
+
+def _gather_returns(values, date_pos, asset_pos, periods, found):
+    """
+    periods[i] forward returns of the j-th entry, at row date_pos[j] and
+    column asset_pos[j] of the forward filled prices 'values', as a
+    len(periods) x entries array (NaN where not 'found' or past the end).
+    """
+    found = found & (asset_pos >= 0)
+    date_pos = np.where(found, date_pos, 0)
+    asset_pos = np.where(found, asset_pos, 0)
+    end_pos = date_pos[None, :] + periods[:, None]
+    valid = found[None, :] & (end_pos < len(values))
+    end_pos = np.where(valid, end_pos, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = values[end_pos, asset_pos] / values[date_pos, asset_pos] \
+            - 1
+    returns[~valid] = np.nan
+    return returns
+
+def get_clean_factors_and_forward_returns(factors,
+                                          prices,
+                                          groupby=None,
+                                          binning_by_group=False,
+                                          quantiles=5,
+                                          bins=None,
+                                          periods=(1, 5, 10),
+                                          groupby_labels=None,
+                                          max_loss=0.35,
+                                          zero_aware=False,
+                                          func=None,
+                                          instrument=None,
+                                          compact=False):
+    """
+    Batch version of get_clean_factor_and_forward_returns for many factors
+    evaluated against the same prices: forward returns are computed once,
+    for the union of the factors' (date, asset) entries, and shared by all
+    of them. A MaxLossExceededError raised for one factor aborts the whole
+    batch.
+    Parameters
+    ----------
+    factors : dict, list of pd.Series or pd.DataFrame - MultiIndex
+        The factors to evaluate, either a dict of name -> factor Series,
+        a list of named factor Series, or a DataFrame indexed by date
+        (level 0) and asset (level 1) with one column per factor.
+        - See full explanation of a factor in
+          utils.get_clean_factor_and_forward_returns
+    prices : pd.DataFrame or store.MappedPanel
+        A wide form Pandas DataFrame indexed by timestamp with assets
+        in the columns, or a memory mapped panel read on demand.
+    func : callable, optional
+        If given, it is called with the cleaned factor_data of every factor
+        and only its result is kept, so the cleaned frames do not pile up in
+        memory (e.g. performance.mean_return_by_quantile).
+    instrument : utils.Instrumentation, optional
+        Shared by all the factors: the stages of every factor are appended
+        to it, 'loss' holds the data loss of the last factor.
+    See get_clean_factor_and_forward_returns for the other parameters,
+    they apply to every factor.
+    Returns
+    -------
+    results : dict
+        Factor name -> cleaned factor_data, or -> func(factor_data) if
+        'func' is provided, in the order of 'factors'.
+    """
+    factors = _factor_dict(factors)
+    if not factors:
+        raise ValueError("factors must hold at least one factor")
+
+    first = next(iter(factors.values()))
+    if all(factor.index.equals(first.index) for factor in factors.values()):
+        union = first.index
+    else:
+        union = first.index.append(
+            [factor.index for factor in factors.values()]) \
+            .drop_duplicates().sort_values()
+        # keep the dates of every factor's date level, as a single factor
+        # keeps them for compute_forward_returns
+        dates = first.index.levels[0].append(
+            [factor.index.levels[0] for factor in factors.values()]) \
+            .unique().sort_values()
+        union = pd.MultiIndex(
+            levels=[dates, union.levels[1]],
+            codes=[dates.get_indexer(union.levels[0])[union.codes[0]],
+                   union.codes[1]],
+            names=union.names, verify_integrity=False)
+
+    with _stage(instrument, 'forward_returns', len(union)) as stage:
+        forward_returns = compute_forward_returns(
+            pd.Series(np.nan, index=union),
+            prices,
+            periods,
+        )
+        stage.rows_out = len(forward_returns)
+
+    results = {}
+    for name, factor in factors.items():
+        if factor.index is union or factor.index.equals(union):
+            factor_returns = forward_returns
+        else:
+            factor_returns = forward_returns.take(
+                union.get_indexer(factor.index))
+            factor_returns.index = factor.index.set_names(['date', 'asset'])
+
+        factor_data = get_clean_factor(factor, factor_returns,
+                                       groupby=groupby,
+                                       groupby_labels=groupby_labels,
+                                       quantiles=quantiles, bins=bins,
+                                       binning_by_group=binning_by_group,
+                                       max_loss=max_loss,
+                                       zero_aware=zero_aware,
+                                       instrument=instrument,
+                                       compact=compact)
+
+        results[name] = factor_data if func is None else func(factor_data)
+
+    return results
+
+def _factor_dict(factors):
+    """
+    Normalizes a dict, list of Series or DataFrame of factors to a dict of
+    name -> factor Series.
+    """
+    if isinstance(factors, (pd.Series, MappedPanel)):
+        factors = [factors]
+    if isinstance(factors, pd.DataFrame):
+        return {name: factors[name] for name in factors.columns}
+    elif isinstance(factors, dict):
+        return {name: factor.stack() if isinstance(factor, MappedPanel)
+                else factor for name, factor in factors.items()}
+    factors = [factor.stack() if isinstance(factor, MappedPanel) else factor
+               for factor in factors]
+    return {(factor.name if factor.name is not None else i): factor
+            for i, factor in enumerate(factors)}
+
 def compute_forward_returns(factor,
                             prices,
                             periods=(1, 2, 3)):
@@ -181,12 +500,14 @@ def compute_forward_returns(factor,
         A MultiIndex Series indexed by timestamp (level 0) and asset
         (level 1), containing the values for a single alpha factor.
         - See full explanation in utils.get_clean_factor_and_forward_returns
-    prices : pd.DataFrame
+    prices : pd.DataFrame or store.MappedPanel
         Pricing data to use in forward price calculation.
         Assets as columns, dates as index. Pricing data must
         span the factor analysis time period plus an additional buffer window
         that is greater than the maximum number of expected periods
         in the forward returns calculations.
+        A memory mapped panel is read date chunk by date chunk, from the
+        first factor date up to max(periods) dates after the last one.
     periods : sequence[int]
         periods to compute forward returns on.
     filter_zscore : int or float, optional
@@ -210,6 +531,9 @@ def compute_forward_returns(factor,
     """
     assert(prices.shape[0] > 1)
 
+    if isinstance(prices, MappedPanel):
+        return _mapped_forward_returns(factor, prices, periods)
+
     factor_dateindex = factor.index.levels[0]
 
     factor_dateindex = factor_dateindex.intersection(prices.index)
@@ -219,37 +543,100 @@ def compute_forward_returns(factor,
     days = (prices.index[1] - prices.index[0]).days
     freq = get_frequency(days)
 
-    raw_values_dict = {}
-    column_list = []
-
-    for period in sorted(periods):
+    periods = np.array(sorted(periods), dtype=np.int64)
+    for period in periods:
         assert(period < factor_dateindex.size)
 
-        returns = prices.pct_change(period)
-        forward_returns = returns.shift(-period).reindex(factor_dateindex)
-
-        start, end = forward_returns.index[0], forward_returns.index[0 + period]
-        period_len = end - start
-
-        label = '%d%s'%(period, freq)
-        column_list.append(label)
-        raw_values_dict[label] = np.concatenate(forward_returns.values)
-
-    df = pd.DataFrame.from_dict(raw_values_dict)
-    df.set_index(
-        pd.MultiIndex.from_product(
-            [factor_dateindex, prices.columns],
-            names=['date', 'asset']
-        ),
-        inplace=True
-    )
-    df = df.reindex(factor.index)
-    # now set the columns correctly
-    df = df[column_list]
-    df.index.set_names(['date', 'asset'], inplace=True)
+    # position of every factor entry in the price frame, only the assets
+    # present in the factor are read from it
+    index = factor.index.remove_unused_levels()
+    date_pos = prices.index.get_indexer(index.levels[0])[index.codes[0]]
+    level_assets = prices.columns.get_indexer(index.levels[1])
+    used = level_assets >= 0
+    asset_pos = np.where(used, np.cumsum(used) - 1, -1)[index.codes[1]]
+
+    # same forward filling as DataFrame.pct_change
+    values = prices.iloc[:, level_assets[used]].ffill().values \
+        .astype(np.float64)
+
+    # all periods in one gather: returns[i, j] is the periods[i] forward
+    # return of the j-th factor entry
+    returns = _gather_returns(values, date_pos, asset_pos, periods,
+                              date_pos >= 0)
+
+    column_list = ['%d%s' % (period, freq) for period in periods]
+    df = pd.DataFrame(returns.T,
+                      index=factor.index.set_names(['date', 'asset']),
+                      columns=column_list)
 
     return df
 
+def _mapped_forward_returns(factor, prices, periods, chunk_size=256):
+    """
+    compute_forward_returns reading the prices of a MappedPanel one chunk
+    of dates (plus the max(periods) following ones) at a time, up to the
+    last factor date. Prices are forward filled from the first price date
+    on, carried over between chunks, as in the DataFrame path.
+    """
+    factor_dateindex = factor.index.levels[0].intersection(prices.dates)
+    assert(factor_dateindex.size == prices.shape[0])
+
+    freq = get_frequency((prices.dates[1] - prices.dates[0]).days)
+
+    periods = np.array(sorted(periods), dtype=np.int64)
+    for period in periods:
+        assert(period < factor_dateindex.size)
+
+    index = factor.index.remove_unused_levels()
+    level_dates = prices.dates.get_indexer(index.levels[0])
+    date_pos = level_dates[index.codes[0]]
+    level_assets = prices.assets.get_indexer(index.levels[1])
+    used = level_assets >= 0
+    asset_pos = np.where(used, np.cumsum(used) - 1, -1)[index.codes[1]]
+    columns = level_assets[used]
+
+    found = np.flatnonzero((date_pos >= 0) & (asset_pos >= 0))
+    known = level_dates[level_dates >= 0]
+    last = known.max() if len(known) > 0 else -1
+
+    order = found[np.argsort(date_pos[found], kind='stable')]
+    sorted_dates = date_pos[order]
+    returns = np.full((len(periods), len(date_pos)), np.nan)
+    carry = np.full(len(columns), np.nan)
+    for begin in range(0, last + 1, chunk_size):
+        stop = min(begin + chunk_size, last + 1)
+        block = np.array(prices.values[
+            begin:min(stop + periods[-1], len(prices))][:, columns],
+            dtype=np.float64)
+        block[0] = np.where(np.isnan(block[0]), carry, block[0])
+        block = _ffill(block)
+        carry = block[stop - 1 - begin]
+
+        rows = order[np.searchsorted(sorted_dates, begin):
+                     np.searchsorted(sorted_dates, stop)]
+        start_pos = date_pos[rows] - begin
+        end_pos = start_pos[None, :] + periods[:, None]
+        valid = end_pos < len(block)
+        end_pos = np.where(valid, end_pos, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chunk = block[end_pos, asset_pos[rows]] \
+                / block[start_pos, asset_pos[rows]] - 1
+        chunk[~valid] = np.nan
+        returns[:, rows] = chunk
+
+    column_list = ['%d%s' % (period, freq) for period in periods]
+    return pd.DataFrame(returns.T,
+                        index=factor.index.set_names(['date', 'asset']),
+                        columns=column_list)
+
+def _ffill(values):
+    """
+    Forward fills the NaNs of every column of a 2-D array.
+    """
+    filled = np.where(np.isnan(values), 0, np.arange(len(values))[:, None])
+    np.maximum.accumulate(filled, axis=0, out=filled)
+    return values[filled, np.arange(values.shape[1])]
+
 def get_clean_factor(factor,
                      forward_returns,
                      groupby=None,
@@ -258,7 +645,9 @@ def get_clean_factor(factor,
                      bins=None,
                      groupby_labels=None,
                      max_loss=0.35,
-                     zero_aware=False):
+                     zero_aware=False,
+                     instrument=None,
+                     compact=False):
     """
     Formats the factor data, forward return data, and group mappings into a
     DataFrame that contains aligned MultiIndex indices of timestamp and asset.
@@ -351,6 +740,14 @@ def get_clean_factor(factor,
         signal values. This is useful if your signal is centered and zero is
         the separation between long and short signals, respectively.
         'quantiles' is None.
+    instrument : utils.Instrumentation, optional
+        Collects the wall time, peak memory and row counts of every stage
+        and the data loss, reported through logging and/or a callback
+        instead of being printed.
+    compact : bool, optional
+        Store the result with small dtypes, about half the memory: float32
+        factor and forward returns, int8 quantiles, a categorical asset
+        index level and a categorical group with small integer codes.
     Returns
     -------
     merged_data : pd.DataFrame - MultiIndex
@@ -381,86 +778,153 @@ def get_clean_factor(factor,
                       --------------------------------------------------------
     """
 
+    merged_data, counts = _clean_factor(factor, forward_returns, groupby,
+                                        binning_by_group, quantiles, bins,
+                                        groupby_labels, max_loss != 0,
+                                        zero_aware, instrument)
+    _report_loss(counts, max_loss, instrument)
+
+    if compact:
+        merged_data = _compact(merged_data)
+
+    return merged_data
+
+def _clean_factor(factor, forward_returns, groupby, binning_by_group,
+                  quantiles, bins, groupby_labels, no_raise, zero_aware,
+                  instrument):
+    """
+    The cleaning and binning of get_clean_factor, returning the cleaned data
+    and the number of entries initially, after the forward returns and after
+    the binning.
+    """
     initial_amount = float(len(factor.index))
 
-    factor_copy = factor.copy()
-    factor_copy.index = factor_copy.index.rename(['date', 'asset'])
-    factor_copy = factor_copy[np.isfinite(factor_copy)]
+    with _stage(instrument, 'merge', len(factor)) as stage:
+        factor_copy = factor.copy()
+        factor_copy.index = factor_copy.index.rename(['date', 'asset'])
+        factor_copy = factor_copy[np.isfinite(factor_copy)]
 
-    merged_data = forward_returns.copy()
-    merged_data['factor'] = factor_copy
+        # new columns only go to the shallow copy, forward_returns itself
+        # may be shared between factors
+        merged_data = forward_returns.copy(deep=False)
+        merged_data['factor'] = factor_copy
 
-    if groupby is not None:
-        if isinstance(groupby, dict):
-            diff = set(factor_copy.index.get_level_values(
-                'asset')) - set(groupby.keys())
-            if len(diff) > 0:
-                raise KeyError(
-                    "Assets {} not in group mapping".format(
-                        list(diff)))
-
-            ss = pd.Series(groupby)
-            groupby = pd.Series(index=factor_copy.index,
-                                data=ss[factor_copy.index.get_level_values(
-                                    'asset')].values)
+        if groupby is not None:
+            if isinstance(groupby, dict):
+                diff = set(factor_copy.index.get_level_values(
+                    'asset')) - set(groupby.keys())
+                if len(diff) > 0:
+                    raise KeyError(
+                        "Assets {} not in group mapping".format(
+                            list(diff)))
 
-        if groupby_labels is not None:
-            diff = set(groupby.values) - set(groupby_labels.keys())
-            if len(diff) > 0:
-                raise KeyError(
-                    "groups {} not in passed group names".format(
-                        list(diff)))
+                ss = pd.Series(groupby)
+                groupby = pd.Series(index=factor_copy.index,
+                                    data=ss[factor_copy.index.get_level_values(
+                                        'asset')].values)
+
+            if groupby_labels is not None:
+                diff = set(groupby.values) - set(groupby_labels.keys())
+                if len(diff) > 0:
+                    raise KeyError(
+                        "groups {} not in passed group names".format(
+                            list(diff)))
 
-            sn = pd.Series(groupby_labels)
-            groupby = pd.Series(index=groupby.index,
-                                data=sn[groupby.values].values)
+                sn = pd.Series(groupby_labels)
+                groupby = pd.Series(index=groupby.index,
+                                    data=sn[groupby.values].values)
 
-        merged_data['group'] = groupby.astype('category')
+            merged_data['group'] = groupby.astype('category')
+        stage.rows_out = len(merged_data)
 
-    merged_data = merged_data.dropna()
+    with _stage(instrument, 'dropna', len(merged_data)) as stage:
+        merged_data = merged_data.dropna()
+        stage.rows_out = len(merged_data)
 
     fwdret_amount = float(len(merged_data.index))
 
-    no_raise = False if max_loss == 0 else True
-    quantile_data = quantize_factor(
-        merged_data,
-        quantiles,
-        bins,
-        binning_by_group,
-        no_raise,
-        zero_aware
-    )
+    with _stage(instrument, 'binning', len(merged_data)) as stage:
+        quantile_data = quantize_factor(
+            merged_data,
+            quantiles,
+            bins,
+            binning_by_group,
+            no_raise,
+            zero_aware
+        )
 
-    merged_data['factor_quantile'] = quantile_data
+        merged_data['factor_quantile'] = quantile_data
 
-    merged_data = merged_data.dropna()
+        merged_data = merged_data.dropna()
+        stage.rows_out = len(merged_data)
 
     binning_amount = float(len(merged_data.index))
 
+    return merged_data, (initial_amount, fwdret_amount, binning_amount)
+
+def _report_loss(counts, max_loss, instrument):
+    """
+    Reports the data loss of the entry counts returned by _clean_factor and
+    raises MaxLossExceededError if it is above max_loss.
+    """
+    initial_amount, fwdret_amount, binning_amount = counts
     tot_loss = (initial_amount - binning_amount) / initial_amount
     fwdret_loss = (initial_amount - fwdret_amount) / initial_amount
     bin_loss = tot_loss - fwdret_loss
 
-    print("Dropped %.1f%% entries from factor data: %.1f%% in forward "
-          "returns computation and %.1f%% in binning phase "
-          "(set max_loss=0 to see potentially suppressed Exceptions)." %
-          (tot_loss * 100, fwdret_loss * 100, bin_loss * 100))
+    message = ("Dropped %.1f%% entries from factor data: %.1f%% in forward "
+               "returns computation and %.1f%% in binning phase "
+               "(set max_loss=0 to see potentially suppressed Exceptions)." %
+               (tot_loss * 100, fwdret_loss * 100, bin_loss * 100))
+    if instrument is None:
+        print(message)
+    else:
+        instrument.loss = dict(total=tot_loss, forward_returns=fwdret_loss,
+                               binning=bin_loss, max_loss=max_loss)
+        instrument.log(logging.INFO, message)
 
     if tot_loss > max_loss:
         message = ("max_loss (%.1f%%) exceeded %.1f%%, consider increasing it."
                    % (max_loss * 100, tot_loss * 100))
         raise MaxLossExceededError(message)
-    else:
+    elif instrument is None:
         print("max_loss is %.1f%%, not exceeded: OK!" % (max_loss * 100))
 
-    return merged_data
+def _compact(factor_data):
+    """
+    factor_data with float32 factor and forward returns, int8 (or int16)
+    quantiles, a categorical asset level and a categorical group.
+    """
+    data = {}
+    for col in factor_data.columns:
+        values = factor_data[col]
+        if col == 'factor_quantile':
+            top = values.max() if len(values) > 0 else 0
+            values = values.astype(np.int8 if top <= np.iinfo(np.int8).max
+                                   else np.int16)
+        elif col == 'group':
+            # categorical codes take the smallest integer dtype
+            values = values.astype('category')
+        elif values.dtype == np.float64:
+            values = values.astype(np.float32)
+        data[col] = values
+
+    index = factor_data.index
+    level = index.names.index('asset')
+    index = index.set_levels(pd.CategoricalIndex(index.levels[level],
+                                                 name='asset'),
+                             level=level, verify_integrity=False)
+    compacted = pd.DataFrame(data, index=index, copy=False)
+    compacted.columns.name = factor_data.columns.name
+    return compacted
 
 def quantize_factor(factor_data,
                     quantiles=5,
                     bins=None,
                     by_group=False,
                     no_raise=False,
-                    zero_aware=False):
+                    zero_aware=False,
+                    engine='vectorized'):
     """
     Computes period wise factor quantiles.
     Parameters
@@ -490,6 +954,11 @@ def quantize_factor(factor_data,
         If True, compute quantile buckets separately for positive and negative
         signal values. This is useful if your signal is centered and zero is
         the separation between long and short signals, respectively.
+    engine : str, optional
+        'vectorized' assigns the buckets of every date (and group) at once
+        over flat arrays. 'reference' runs pd.qcut/pd.cut once per date
+        through groupby.apply; it is much slower and kept to cross-check
+        the vectorized labels.
     Returns
     -------
     factor_quantile : pd.Series
@@ -505,6 +974,16 @@ def quantize_factor(factor_data,
                " integer")
         raise ValueError(msg)
 
+    if engine == 'vectorized':
+        keys, _ = _segment_keys(factor_data, by_group)
+        labels = _quantize_values(factor_data['factor'].values, keys,
+                                  quantiles, bins, zero_aware, no_raise)
+        factor_quantile = pd.Series(labels, index=factor_data.index,
+                                    name='factor_quantile').dropna()
+        return factor_quantile.astype(np.int64)
+    elif engine != 'reference':
+        raise ValueError("engine should be 'vectorized' or 'reference'")
+
     def quantile_calc(x, _quantiles, _bins, _zero_aware, _no_raise):
         try:
             if _quantiles is not None and _bins is None and not _zero_aware:
@@ -532,12 +1011,157 @@ def quantize_factor(factor_data,
     if by_group:
         grouper.append('group')
 
-    factor_quantile = factor_data.groupby(grouper)['factor'] \
+    factor_quantile = factor_data.groupby(grouper, group_keys=False)['factor'] \
         .apply(quantile_calc, quantiles, bins, zero_aware, no_raise)
     factor_quantile.name = 'factor_quantile'
 
     return factor_quantile.dropna()
 
+def _level_codes(index, level):
+    """
+    Integer codes of one MultiIndex level, without materializing its values.
+    """
+    return index.codes[index.names.index(level)].astype(np.int64)
+
+def _group_codes(group):
+    """
+    Integer codes of a group column, categorical or not.
+    """
+    if isinstance(group.dtype, pd.CategoricalDtype):
+        return group.cat.codes.values.astype(np.int64)
+    return pd.factorize(group)[0].astype(np.int64)
+
+def _n_group_codes(group):
+    if isinstance(group.dtype, pd.CategoricalDtype):
+        return max(len(group.cat.categories), 1)
+    return max(group.nunique(), 1)
+
+def _segment_keys(factor_data, by_group=False):
+    """
+    Integer key identifying the date (and optionally the group) of every
+    row of 'factor_data', plus an upper bound on the number of keys so the
+    keys can be used directly with np.bincount.
+    """
+    keys = _level_codes(factor_data.index, 'date')
+    n_keys = len(factor_data.index.levels[
+        factor_data.index.names.index('date')])
+    if by_group:
+        n_groups = _n_group_codes(factor_data['group'])
+        keys = keys * n_groups + _group_codes(factor_data['group'])
+        n_keys *= n_groups
+    return keys, n_keys
+
+def _quantize_values(values, keys, quantiles, bins, zero_aware, no_raise):
+    """
+    Bucket labels (1-based, NaN when binning is not possible) of 'values'
+    computed separately for every distinct integer key. Labels match the
+    ones pd.qcut/pd.cut give segment by segment.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    labels = np.full(len(values), np.nan)
+
+    if not zero_aware:
+        seg_labels, failed = _bin_segments(values, keys, quantiles, bins)
+        labels[:] = seg_labels
+    else:
+        nbuckets = quantiles // 2 if quantiles is not None else bins // 2
+        half_q = nbuckets if quantiles is not None else None
+        half_b = nbuckets if bins is not None else None
+        # the positive and negative halves of every key binned in a single
+        # pass, as segments of their own
+        positive = values >= 0
+        half_keys = keys * 2 + positive
+        seg_labels, half_failed = _bin_segments(values, half_keys, half_q,
+                                                half_b)
+        labels[:] = seg_labels + np.where(positive, nbuckets, 0)
+        # a key whose positive or negative half is empty cannot be cut
+        whole, n_halves = np.unique(
+            np.unique(half_keys[~np.isnan(values)]) // 2, return_counts=True)
+        failed = np.union1d(half_failed // 2, whole[n_halves == 1])
+
+    if len(failed) > 0:
+        if not no_raise:
+            raise ValueError("Bin edges must be unique or the cross-section "
+                             "is empty: cannot compute quantiles")
+        labels[np.isin(keys, failed)] = np.nan
+
+    return labels
+
+def _bin_segments(values, keys, quantiles, bins):
+    """
+    Vectorized pd.qcut/pd.cut(labels=False) + 1 over the segments of
+    'values' sharing the same key. Returns the labels and the keys of the
+    segments for which pandas would raise.
+    """
+    if kernels.get_backend() == 'numba':
+        return kernels.bin_segments(values, keys, quantiles, bins)
+
+    labels = np.full(len(values), np.nan)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return labels, np.zeros(0, dtype=np.int64)
+
+    vals = values[valid]
+    order = np.argsort(keys[valid], kind='stable')
+    sorted_vals = vals[order]
+    seg_keys, starts, counts = np.unique(keys[valid][order],
+                                         return_index=True,
+                                         return_counts=True)
+    seg_of_row = np.empty(len(vals), dtype=np.int64)
+    seg_of_row[order] = np.repeat(np.arange(len(seg_keys)), counts)
+
+    include_lowest = quantiles is not None
+    bad = np.zeros(len(seg_keys), dtype=bool)
+
+    if quantiles is not None:
+        qs = np.linspace(0, 1, quantiles + 1) \
+            if isinstance(quantiles, (int, np.integer)) \
+            else np.asarray(quantiles, dtype=np.float64)
+        edges = np.empty((len(seg_keys), len(qs)))
+        # np.quantile over equal sized segments at once, the call pd.qcut
+        # makes for a single cross-section
+        for length in np.unique(counts):
+            sel = np.flatnonzero(counts == length)
+            idx = starts[sel][:, None] + np.arange(length)
+            edges[sel] = np.quantile(sorted_vals[idx], qs, axis=1).T
+    elif isinstance(bins, (int, np.integer)):
+        if bins < 1:
+            raise ValueError("`bins` should be a positive integer.")
+        mn = np.minimum.reduceat(sorted_vals, starts) + 0.0
+        mx = np.maximum.reduceat(sorted_vals, starts) + 0.0
+        bad |= np.isinf(mn) | np.isinf(mx)
+        flat = mn == mx
+        mn[flat] -= np.where(mn[flat] != 0, 0.001 * np.abs(mn[flat]), 0.001)
+        mx[flat] += np.where(mx[flat] != 0, 0.001 * np.abs(mx[flat]), 0.001)
+        edges = np.linspace(mn, mx, bins + 1, endpoint=True, axis=1)
+        edges[~flat, 0] -= (mx[~flat] - mn[~flat]) * 0.001
+    else:
+        edges = np.asarray(bins, dtype=np.float64)
+        if (np.diff(edges) < 0).any():
+            raise ValueError("bins must increase monotonically.")
+        edges = np.broadcast_to(edges, (len(seg_keys), len(edges)))
+
+    nedges = edges.shape[1]
+    if nedges != 2:
+        sorted_edges = np.sort(edges, axis=1)
+        same = sorted_edges[:, 1:] == sorted_edges[:, :-1]
+        same |= np.isnan(sorted_edges[:, 1:]) & np.isnan(sorted_edges[:, :-1])
+        bad |= same.any(axis=1)
+
+    # searchsorted(edges, x, side='left') done edge by edge, so memory stays
+    # linear in the number of rows
+    ids = np.zeros(len(vals), dtype=np.int64)
+    for j in range(nedges):
+        ids += edges[seg_of_row, j] < vals
+    if include_lowest:
+        ids[vals == edges[seg_of_row, 0]] = 1
+
+    out = ids.astype(np.float64)
+    out[(ids == 0) | (ids == nedges) | bad[seg_of_row]] = np.nan
+    labels[valid] = out
+
+    return labels, seg_keys[bad]
+
 def get_frequency(days):
     if days >= 88:
         return 'Q'
@@ -546,7 +1170,7 @@ def get_frequency(days):
     else:
         return 'D'
 
-def demean_forward_returns(factor_data, grouper=None):
+def demean_forward_returns(factor_data, grouper=None, inplace=False):
     """
     Convert forward returns to returns relative to mean
     period wise all-universe or group returns.
@@ -564,6 +1188,11 @@ def demean_forward_returns(factor_data, grouper=None):
         Separate column for each forward return window.
     grouper : list
         If True, demean according to group.
+    inplace : bool, optional
+        Write the demeaned returns into 'factor_data' itself instead of a
+        new frame. The new frame otherwise shares every column but the
+        forward returns with 'factor_data', so these must not be modified
+        in place afterwards.
     Returns
     -------
     adjusted_forward_returns : pd.DataFrame - MultiIndex
@@ -571,16 +1200,88 @@ def demean_forward_returns(factor_data, grouper=None):
         security's returns normalized by group.
     """
 
-    factor_data = factor_data.copy()
+    cols = get_forward_returns_columns(factor_data.columns)
+    keys, n_keys = _grouper_keys(factor_data, grouper)
+
+    def demean(col):
+        values = factor_data[col].values.astype(np.float64, copy=False)
+        return _demean_values(values[:, None], keys, n_keys)[:, 0]
+
+    if inplace:
+        for col in cols:
+            values = factor_data[col].values
+            if values.dtype == np.float64 and values.flags.writeable:
+                # writes through to the frame's own array
+                values[:] = demean(col)
+            else:
+                factor_data[col] = demean(col)
+        return factor_data
+
+    # a frame built from the columns without copying them, the ones which
+    # are not forward returns are those of 'factor_data'
+    data = {col: demean(col) if col in cols else factor_data[col]
+            for col in factor_data.columns}
+    adjusted = pd.DataFrame(data, index=factor_data.index, copy=False)
+    adjusted.columns.name = factor_data.columns.name
 
+    return adjusted
+
+def _grouper_keys(factor_data, grouper=None):
+    """
+    Integer key of every row of 'factor_data' for a groupby 'grouper' (the
+    dates if empty), -1 where a grouping value is missing, and an upper
+    bound on the number of keys.
+    """
     if not grouper:
-        grouper = factor_data.index.get_level_values('date')
+        return _segment_keys(factor_data)
+    if not isinstance(grouper, list):
+        grouper = [grouper]
 
-    cols = get_forward_returns_columns(factor_data.columns)
-    factor_data[cols] = factor_data.groupby(grouper)[cols] \
-        .transform(lambda x: x - x.mean())
+    keys = np.zeros(len(factor_data), dtype=np.int64)
+    n_keys = 1
+    missing = np.zeros(len(factor_data), dtype=bool)
+    for item in grouper:
+        if isinstance(item, str) and item in factor_data.columns:
+            codes = _group_codes(factor_data[item])
+            n_codes = _n_group_codes(factor_data[item])
+        elif isinstance(item, str):
+            codes = _level_codes(factor_data.index, item)
+            n_codes = len(factor_data.index.levels[
+                factor_data.index.names.index(item)])
+        else:
+            codes, uniques = pd.factorize(np.asarray(item))
+            n_codes = max(len(uniques), 1)
+        missing |= codes < 0
+        keys = keys * n_codes + codes
+        n_keys *= n_codes
+        if n_keys > len(factor_data):
+            # keep the keys dense
+            keys, n_keys = np.unique(keys, return_inverse=True)[1], \
+                len(factor_data)
+    keys[missing] = -1
+    return keys, n_keys
 
-    return factor_data
+def _demean_values(values, keys, n_keys):
+    """
+    Columns of the 2-D 'values' minus the mean of their key, skipping NaNs
+    in the means. Rows with a negative key become NaN.
+    """
+    if kernels.get_backend() == 'numba':
+        return kernels.demean(values, keys, n_keys)
+
+    missing = keys < 0
+    keys = np.where(missing, 0, keys)
+    demeaned = np.empty_like(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(values.shape[1]):
+            column = values[:, i]
+            valid = ~np.isnan(column) & ~missing
+            total = np.bincount(keys, weights=np.where(valid, column, 0.0),
+                                minlength=n_keys)
+            count = np.bincount(keys, weights=valid, minlength=n_keys)
+            demeaned[:, i] = column - (total / count)[keys]
+    demeaned[missing] = np.nan
+    return demeaned
 
 def get_forward_returns_columns(columns):
     """
@@ -594,3 +1295,86 @@ def get_forward_returns_columns(columns):
 
 class MaxLossExceededError(Exception):
     pass
+
+StageStats = namedtuple('StageStats',
+                        ['stage', 'seconds', 'peak_bytes', 'rows_in',
+                         'rows_out'])
+
+class Instrumentation(object):
+    """
+    Opt-in instrumentation of get_clean_factor and
+    get_clean_factor_and_forward_returns. Passing one as 'instrument'
+    replaces their console output: every stage ('forward_returns',
+    'merge', 'dropna', 'binning') is recorded with its wall time, peak
+    memory and row counts, and the data loss is kept in 'loss'.
+    Parameters
+    ----------
+    callback : callable, optional
+        Called with the StageStats of every stage as soon as it completes.
+    trace_memory : bool, optional
+        Measure the peak memory allocated by each stage with tracemalloc.
+        This slows the stages down noticeably.
+    logger : logging.Logger or None, optional
+        Where stages (DEBUG) and data loss (INFO) are reported, the
+        'factor_analysis.utils' logger by default. None reports nothing.
+    """
+
+    def __init__(self, callback=None, trace_memory=False, logger=logger):
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.logger = logger
+        self.stages = []
+        self.loss = None
+
+    def __repr__(self):
+        return "<Instrumentation: %d stages>" % len(self.stages)
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in):
+        """
+        Records the block it wraps as stage 'name'. The block sets
+        'rows_out' on the object it is given.
+        """
+        record = _StageRecord()
+        tracing = self.trace_memory
+        if tracing:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                if started:
+                    tracemalloc.stop()
+            stats = StageStats(name, seconds, peak, rows_in, record.rows_out)
+            self.stages.append(stats)
+            self.log(logging.DEBUG, "%s: %.3fs, %s -> %s rows%s" % (
+                name, seconds, rows_in, record.rows_out,
+                '' if peak is None else ', peak %.1fMB' % (peak / 2.0 ** 20)))
+            if self.callback is not None:
+                self.callback(stats)
+
+    def log(self, level, message):
+        if self.logger is not None:
+            self.logger.log(level, message)
+
+    def to_frame(self):
+        """
+        The recorded stages as a DataFrame, one row per stage.
+        """
+        return pd.DataFrame(self.stages, columns=StageStats._fields)
+
+class _StageRecord(object):
+    rows_out = None
+
+def _stage(instrument, name, rows_in):
+    if instrument is None:
+        return contextlib.nullcontext(_StageRecord())
+    return instrument.stage(name, rows_in)
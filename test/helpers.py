@@ -0,0 +1,65 @@
+"""
+Synthetic inputs shared by the test modules.
+"""
+import numpy as np
+import pandas as pd
+
+def make_inputs(n_dates=12, n_assets=30, freq='M', start='2015-01-31',
+                volatility=0.05, missing=0., random_factor=False, seed=0):
+    """
+    Random walk prices (dates x assets) and a factor Series indexed by date
+    and asset: the prices' returns, or standard normal values if
+    'random_factor'. A 'missing' share of the prices is set to NaN.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=n_dates, freq=freq)
+    assets = ['A%d' % i for i in range(n_assets)]
+    prices = pd.DataFrame(10 * np.exp(np.cumsum(
+        rng.normal(0, volatility, (n_dates, n_assets)), axis=0)),
+        index=dates, columns=assets)
+    if missing:
+        prices[rng.random(prices.shape) < missing] = np.nan
+    if random_factor:
+        factor = pd.DataFrame(rng.normal(size=prices.shape), index=dates,
+                              columns=assets).stack()
+    else:
+        factor = prices.pct_change().stack()
+    factor.index.set_names(['date', 'asset'], inplace=True)
+    return factor, prices
+
+def make_factor_data(n_dates=6, n_assets=40, returns=None, ties=False,
+                     quantiles=None, missing=0., seed=0):
+    """
+    factor_data with a standard normal 'factor' (small integers if 'ties')
+    and a 'group' among three, without the forward returns of the cleaning.
+    Parameters
+    ----------
+    returns : dict, optional
+        Forward returns column -> volatility of its normal returns.
+    quantiles : int, optional
+        Adds the 'factor_quantile' column, pd.qcut of every date.
+    missing : float, optional
+        Share of the rows dropped at random.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2015-01-31', periods=n_dates, freq='M')
+    assets = ['A%d' % i for i in range(n_assets)]
+    index = pd.MultiIndex.from_product([dates, assets],
+                                       names=['date', 'asset'])
+    columns = {name: rng.normal(0, volatility, len(index))
+               for name, volatility in (returns or {}).items()}
+    if ties:
+        columns['factor'] = rng.integers(-3, 4, size=len(index)) \
+            .astype(float)
+    else:
+        columns['factor'] = rng.normal(size=len(index))
+    columns['group'] = pd.Categorical(
+        rng.choice(['G1', 'G2', 'G3'], size=len(index)))
+    factor_data = pd.DataFrame(columns, index=index)
+    if quantiles is not None:
+        factor_data['factor_quantile'] = factor_data.groupby(level='date')[
+            'factor'].transform(lambda x: pd.qcut(x, quantiles,
+                                                  labels=False) + 1)
+    if missing:
+        factor_data = factor_data[rng.random(len(index)) > missing]
+    return factor_data
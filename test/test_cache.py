@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from factor_analysis import utils
+from factor_analysis.cache import DataCache, FactorDataCache
+from helpers import make_inputs
+
+class FakeSource(object):
+    """
+    Month end closes of any code, recording the requested ranges.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, codes, start_date, end_date):
+        self.calls.append((list(codes), start_date, end_date))
+        dates = pd.date_range(start_date, end_date, freq='M')
+        values = [[hash((code, date)) % 1000 for code in codes]
+                  for date in dates]
+        return pd.DataFrame(values, index=dates, columns=codes, dtype=float)
+
+def test_incremental_refresh(tmp_path):
+    cache = DataCache(str(tmp_path))
+    fetch = FakeSource()
+
+    first = cache.get_frame('close', 'M', ['A', 'B'], '2019-01-01',
+                            '2019-06-30', fetch)
+    pd.testing.assert_frame_equal(
+        first, fetch(['A', 'B'], '2019-01-01', '2019-06-30'),
+        check_freq=False)
+    fetch.calls = fetch.calls[:1]
+
+    again = cache.get_frame('close', 'M', ['A', 'B'], '2019-01-01',
+                            '2019-06-30', fetch)
+    pd.testing.assert_frame_equal(again, first)
+    assert len(fetch.calls) == 1
+
+    more = cache.get_frame('close', 'M', ['A', 'B', 'C'], '2019-01-01',
+                           '2019-12-31', fetch)
+    assert sorted(fetch.calls[1:]) == [
+        (['A', 'B'], '2019-06-30', '2019-12-31'),
+        (['C'], '2019-01-01', '2019-12-31')]
+    expected = fetch(['A', 'B', 'C'], '2019-01-01', '2019-12-31')
+    pd.testing.assert_frame_equal(more, expected, check_freq=False)
+
+def test_invalidate_and_evict(tmp_path):
+    cache = DataCache(str(tmp_path))
+    fetch = FakeSource()
+    cache.get_frame('close', 'M', ['A', 'B'], '2019-01-01', '2019-06-30',
+                    fetch)
+    cache.get_frame('roe', 'Q', ['A'], '2019-01-01', '2019-06-30', fetch)
+    assert cache.keys() == ['close_M', 'roe_Q']
+
+    cache.invalidate(field='close', codes=['B'])
+    cache.get_frame('close', 'M', ['A', 'B'], '2019-01-01', '2019-06-30',
+                    fetch)
+    assert fetch.calls[-1][0] == ['B']
+
+    cache.invalidate(period='Q')
+    assert cache.keys() == ['close_M']
+
+    cache.evict(0)
+    assert cache.keys() == []
+    assert np.isclose(cache.nbytes, 0)
+
+def test_frame_and_coverage_in_one_file(tmp_path):
+    cache = DataCache(str(tmp_path))
+    fetch = FakeSource()
+    cache.get_frame('close', 'M', ['A', 'B'], '2019-01-01', '2019-06-30',
+                    fetch)
+    cache.get_frame('roe', 'Q', ['A'], '2019-01-01', '2019-12-31', fetch)
+    assert len(os.listdir(str(tmp_path))) == 2
+
+    # evicting a field removes its frame and coverage together
+    os.utime(cache._file('roe_Q'), (0, 0))
+    cache.evict(os.path.getsize(cache._file('close_M')))
+    assert cache.keys() == ['close_M']
+    frame, coverage = cache._load('close_M')
+    assert list(coverage.index) == ['A', 'B']
+    assert list(frame.columns) == ['A', 'B']
+
+    calls = len(fetch.calls)
+    cache.get_frame('close', 'M', ['A', 'B'], '2019-01-01', '2019-06-30',
+                    fetch)
+    assert len(fetch.calls) == calls
+
+def test_factor_data_cache(tmp_path):
+    factor, prices = make_inputs()
+    groups = {a: a[-1] for a in prices.columns}
+    cache = FactorDataCache(path=str(tmp_path))
+    first = cache.get_clean_factor_and_forward_returns(
+        factor, prices, groups, periods=(1, 2), max_loss=1)
+    again = cache.get_clean_factor_and_forward_returns(
+        factor.copy(), prices.copy(), dict(groups), periods=(1, 2),
+        max_loss=1, quantiles=5)
+    assert again is first
+    pd.testing.assert_frame_equal(
+        first, utils.get_clean_factor_and_forward_returns(
+            factor, prices, groups, periods=(1, 2), max_loss=1))
+
+    changed = factor.copy()
+    changed.iloc[0] += 1
+    for args, kwargs in [((changed, prices, groups), {}),
+                         ((factor, prices, None), {}),
+                         ((factor, prices, groups), dict(quantiles=3))]:
+        assert cache.key(*args, periods=(1, 2), max_loss=1, **kwargs) != \
+            cache.key(factor, prices, groups, periods=(1, 2), max_loss=1)
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+    # another process reads the disk tier
+    other = FactorDataCache(path=str(tmp_path))
+    pd.testing.assert_frame_equal(
+        other.get_clean_factor_and_forward_returns(
+            factor, prices, groups, periods=(1, 2), max_loss=1), first)
+    assert other.stats()['disk_hits'] == 1
+
+    cache.clear()
+    assert cache.stats() == dict(hits=0, disk_hits=0, misses=0,
+                                 evictions=0, entries=0, nbytes=0)
+    assert os.listdir(str(tmp_path)) == []
+
+def test_factor_data_cache_eviction():
+    factor, prices = make_inputs()
+    sizes = FactorDataCache()
+    for periods in [(1,), (1, 2), (1, 3)]:
+        sizes.get_clean_factor_and_forward_returns(factor, prices,
+                                                   periods=periods,
+                                                   max_loss=1)
+
+    cache = FactorDataCache(max_bytes=sizes.nbytes - 1)
+    for periods in [(1,), (1, 2), (1,), (1, 3)]:
+        cache.get_clean_factor_and_forward_returns(factor, prices,
+                                                   periods=periods,
+                                                   max_loss=1)
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    # the least recently used result, (1, 2), was evicted
+    assert stats['entries'] == 2 and stats['evictions'] == 1
+    assert stats['nbytes'] <= cache.max_bytes
+    cache.get_clean_factor_and_forward_returns(factor, prices,
+                                               periods=(1,), max_loss=1)
+    assert cache.stats()['hits'] == 2
+
+    with pytest.raises(utils.MaxLossExceededError):
+        cache.get_clean_factor_and_forward_returns(factor, prices,
+                                                   max_loss=0.01)
+    assert cache.stats()['entries'] == 2
@@ -0,0 +1,155 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+import factor_analysis as fa
+from factor_analysis import data
+
+def test_synthetic_source_pipeline(tmp_path):
+    data.set_source(data.SyntheticDataSource(seed=1))
+    try:
+        stocks = data.get_stock_list('CI005016.WI')
+        codes = stocks['wind_code'].tolist()
+        prices = data.get_stocks_history_close(codes, '2009-12-31',
+                                               '2015-9-30', period='Q')
+        factor = data.get_stocks_fundamental_factor(
+            codes, 'grossprofitmargin', '2009-12-31', '2015-9-30')
+        assert prices.shape == factor.shape == (24, len(codes))
+        assert list(prices.columns) == codes
+
+        factor.index.set_names(['date'], inplace=True)
+        factor = factor.stack()
+        factor.index.set_names(['date', 'asset'], inplace=True)
+        factor_data = fa.utils.get_clean_factor_and_forward_returns(
+            factor, prices, periods=(1, 2, 3))
+        assert list(factor_data.columns[:3]) == ['1Q', '2Q', '3Q']
+
+        # a cache directory can be read back as a file source
+        data.set_cache(str(tmp_path))
+        cached = data.get_stocks_history_close(codes[:5], '2009-12-31',
+                                               '2015-9-30', period='Q')
+        data.get_stock_list('CI005016.WI')
+        data.set_source(data.FileDataSource(str(tmp_path)))
+        data.set_cache(None)
+        pd.testing.assert_frame_equal(data.get_stock_list('CI005016.WI'),
+                                      stocks)
+        pd.testing.assert_frame_equal(
+            data.get_stocks_history_close(codes[:5], '2009-12-31',
+                                          '2015-9-30', period='Q'),
+            cached, check_freq=False)
+    finally:
+        data.set_source(data.WindDataSource())
+        data.set_cache(None)
+
+def test_incomplete_source():
+    class HistoryOnly(data.DataSource):
+        def get_history(self, codes, field, start_date, end_date, period):
+            return pd.DataFrame()
+
+    with pytest.raises(TypeError):
+        HistoryOnly()
+
+class FakeWind(object):
+    """
+    Stands for WindPy's 'w': answers wsd with deterministic values after
+    'latency' seconds, failing the calls 'fail(codes, start)' selects.
+    """
+
+    class Result(object):
+        def __init__(self, error_code, data=None, codes=None, times=None):
+            self.ErrorCode = error_code
+            self.Data = data
+            self.Codes = codes
+            self.Times = times
+
+    def __init__(self, latency=0.0, fail=None):
+        self.latency = latency
+        self.fail = fail or (lambda codes, start: None)
+        self.calls = []
+        self.active = self.max_active = 0
+        self._lock = threading.Lock()
+
+    def wsd(self, codes, field, start_date, end_date, options):
+        with self._lock:
+            self.calls.append((list(codes), start_date, end_date,
+                               time.monotonic()))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.latency)
+            failure = self.fail(codes, start_date)
+            if failure == 'raise':
+                raise RuntimeError('connection lost')
+            if failure is not None:
+                return self.Result(failure)
+            period = options.split(';')[0].split('=')[1]
+            times = pd.date_range(start_date, end_date, freq=period)
+            data = [[float(int(code) * 1000 + i)
+                     for i in times.year * 12 + times.month]
+                    for code in codes]
+            return self.Result(0, data, list(codes), list(times))
+        finally:
+            with self._lock:
+                self.active -= 1
+
+CODES = [str(600000 + i) for i in range(23)]
+
+def test_wind_chunks_match_a_single_request():
+    whole = data.WindDataSource(w=FakeWind(), codes_per_request=None) \
+        .get_history(CODES, 'close', '2009-12-31', '2015-9-30', 'Q')
+    assert whole.shape == (24, len(CODES))
+
+    w = FakeWind(latency=0.02)
+    source = data.WindDataSource(w=w, codes_per_request=5,
+                                 periods_per_request=7, max_workers=4)
+    chunked = source.get_history(CODES, 'close', '2009-12-31', '2015-9-30',
+                                 'Q')
+    pd.testing.assert_frame_equal(chunked, whole)
+
+    # 5 code chunks x 4 date chunks, each date chunk ending on a quarter
+    assert len(w.calls) == 20
+    assert max(len(codes) for codes, _, _, _ in w.calls) == 5
+    assert sorted(set((start, end) for _, start, end, _ in w.calls)) == [
+        ('2009-12-31', '2011-06-30'), ('2011-07-01', '2013-03-31'),
+        ('2013-04-01', '2014-12-31'), ('2015-01-01', '2015-09-30')]
+    assert w.max_active > 1
+
+    empty = source.get_history([], 'close', '2009-12-31', '2015-9-30', 'Q')
+    assert empty.empty and len(w.calls) == 20
+
+def test_wind_retries_failed_chunks():
+    attempts = {}
+
+    def flaky(codes, start):
+        key = (codes[0], start)
+        attempts[key] = attempts.get(key, 0) + 1
+        if attempts[key] == 1:
+            return 'raise' if codes[0] == CODES[0] else -40520007
+        return None
+
+    w = FakeWind(fail=flaky)
+    source = data.WindDataSource(w=w, codes_per_request=10,
+                                 periods_per_request=12, backoff=0.0)
+    frame = source.get_history(CODES, 'close', '2009-12-31', '2015-9-30',
+                               'Q')
+    assert frame.notnull().all().all()
+    assert len(w.calls) == 2 * 3 * 2
+
+    w = FakeWind(fail=lambda codes, start:
+                 -40521010 if codes[0] == CODES[10] else None)
+    source = data.WindDataSource(w=w, codes_per_request=10, max_retries=2,
+                                 backoff=0.0)
+    with pytest.raises(data.WindError) as error:
+        source.get_history(CODES, 'close', '2009-12-31', '2015-9-30', 'Q')
+    assert error.value.error_code == -40521010
+    assert sum(codes[0] == CODES[10] for codes, _, _, _ in w.calls) == 3
+
+def test_wind_rate_limit():
+    w = FakeWind()
+    source = data.WindDataSource(w=w, codes_per_request=4, max_workers=8,
+                                 max_requests_per_second=50)
+    source.get_history(CODES, 'close', '2009-12-31', '2015-9-30', 'Q')
+    starts = sorted(start for _, _, _, start in w.calls)
+    assert len(starts) == 6
+    assert starts[-1] - starts[0] >= 5 / 50. * 0.9
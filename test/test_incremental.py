@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+from factor_analysis import utils
+from factor_analysis import performance as perf
+from factor_analysis.incremental import IncrementalFactorState, \
+    RunningFactorReturns
+import helpers
+
+def make_inputs(seed=0):
+    factor, prices = helpers.make_inputs(n_dates=30, n_assets=40,
+                                         random_factor=True, seed=seed)
+    prices[prices > prices.quantile(0.97)] = np.nan
+    groups = {a: 'G%d' % (i % 3 + 1) for i, a in enumerate(prices.columns)}
+    return factor, prices, groups
+
+@pytest.mark.parametrize('group_neutral', [False, True])
+def test_matches_batch(group_neutral):
+    factor, prices, groups = make_inputs()
+    factor_data = utils.get_clean_factor_and_forward_returns(
+        factor, prices, groupby=groups, periods=(1, 3), max_loss=1)
+    state = IncrementalFactorState.from_history(
+        factor, prices, groupby=groups, periods=(1, 3),
+        group_neutral=group_neutral)
+
+    assert list(state.pending_dates) == list(prices.index[-3:])
+    pd.testing.assert_frame_equal(state.factor_data, factor_data,
+                                  check_categorical=False)
+    mean_ret, _ = perf.mean_return_by_quantile(
+        factor_data, by_date=True, group_adjust=group_neutral)
+    pd.testing.assert_frame_equal(state.mean_return_by_date, mean_ret)
+    returns = perf.factor_returns(factor_data, True, group_neutral)
+    pd.testing.assert_frame_equal(state.factor_returns, returns)
+    pd.testing.assert_frame_equal(state.cumulative_returns,
+                                  perf.cumulative_returns(returns),
+                                  check_names=False)
+    by_quantile = mean_ret['1M'].unstack('factor_quantile') \
+        .apply(perf.cumulative_returns)
+    pd.testing.assert_frame_equal(
+        state.cumulative_returns_by_quantile['1M'], by_quantile,
+        check_names=False)
+
+def test_save_and_resume(tmp_path):
+    factor, prices, groups = make_inputs()
+    full = IncrementalFactorState.from_history(factor, prices,
+                                               groupby=groups,
+                                               periods=(1, 2))
+
+    history = prices.index[:-5]
+    state = IncrementalFactorState.from_history(
+        factor.loc[history], prices.loc[history], groupby=groups,
+        periods=(1, 2))
+    path = str(tmp_path / 'state.pickle')
+    state.save(path)
+    state = IncrementalFactorState.load(path)
+    for date in prices.index[-5:]:
+        quantiles = state.append(date, factor.loc[date], prices.loc[date])
+        assert quantiles.index.get_level_values('date').unique() == [date]
+
+    pd.testing.assert_frame_equal(state.factor_data, full.factor_data)
+    pd.testing.assert_frame_equal(state.cumulative_returns,
+                                  full.cumulative_returns)
+    assert state.loss == full.loss
+
+    with pytest.raises(ValueError):
+        state.append(prices.index[-1], factor.loc[prices.index[-1]],
+                     prices.iloc[-1])
+
+@pytest.mark.parametrize('by_group, group_adjust',
+                         [(False, False), (True, False), (True, True)])
+def test_running_factor_returns(by_group, group_adjust):
+    factor, prices, groups = make_inputs()
+    factor_data = utils.get_clean_factor_and_forward_returns(
+        factor, prices, groupby=groups, periods=(1, 3), max_loss=1)
+    running = RunningFactorReturns.fold(
+        utils.iter_clean_factor_and_forward_returns(
+            factor, prices, groupby=groups, periods=(1, 3), max_loss=1,
+            chunk_size=4),
+        by_group=by_group, group_adjust=group_adjust)
+
+    assert running.rows == len(factor_data)
+    expected = perf.mean_return_by_quantile(factor_data, by_group=by_group,
+                                            group_adjust=group_adjust)
+    for result, exp in zip(running.mean_return_by_quantile(), expected):
+        pd.testing.assert_frame_equal(result, exp, rtol=1e-10)
+    mean_ret, _ = perf.mean_return_by_quantile(
+        factor_data, by_date=True, by_group=by_group,
+        group_adjust=group_adjust)
+    pd.testing.assert_frame_equal(running.mean_return_by_date, mean_ret)
+    pd.testing.assert_frame_equal(
+        running.factor_returns,
+        perf.factor_returns(factor_data, True, group_adjust))
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from factor_analysis import ingest
+from factor_analysis.store import MappedPanel
+
+def write_sheet(path, n_dates=10, n_assets=6, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame(rng.normal(size=(n_dates, n_assets)),
+                         index=pd.date_range('2015-01-31', periods=n_dates,
+                                             freq='M'),
+                         columns=[600000 + i for i in range(n_assets)])
+    frame.iloc[2, 3] = np.nan
+    frame.iloc[::-1].to_csv(path)
+    return frame
+
+def formats():
+    try:
+        import pyarrow  # noqa: F401
+        return ingest.FORMATS
+    except ImportError:
+        return ('npy', 'pickle')
+
+@pytest.mark.parametrize('fmt', formats())
+def test_load(tmp_path, fmt):
+    sheet = str(tmp_path / 'prices.csv')
+    frame = write_sheet(sheet)
+
+    prices = ingest.load_prices(sheet, fmt=fmt)
+    assert os.path.exists(ingest._converted_path(sheet, fmt))
+    assert prices.index.name == 'date'
+    assert prices.columns.name == 'asset'
+    assert list(prices.columns) == [str(a) for a in frame.columns]
+    np.testing.assert_array_equal(prices.index.values, frame.index.values)
+    np.testing.assert_allclose(prices.values, frame.values)
+
+    factor = ingest.load_factor(sheet, fmt=fmt)
+    expected = prices.stack()
+    expected.index.set_names(['date', 'asset'], inplace=True)
+    pd.testing.assert_series_equal(factor, expected,
+                                   check_index_type=False)
+
+def test_reconverts_stale_files(tmp_path):
+    sheet = str(tmp_path / 'factor.csv')
+    write_sheet(sheet)
+    converted = ingest.convert(sheet, fmt='pickle')
+    stale = pd.read_pickle(converted)
+
+    frame = write_sheet(sheet, seed=1)
+    os.utime(converted, (0, 0))
+    prices = ingest.load_prices(sheet, fmt='pickle')
+    np.testing.assert_allclose(prices.values, frame.values)
+
+    pd.to_pickle(stale, converted)
+    prices = ingest.load_prices(sheet, fmt='pickle')
+    np.testing.assert_array_equal(prices.values, stale.values)
+    prices = ingest.load_prices(sheet, fmt='pickle', refresh=True)
+    np.testing.assert_allclose(prices.values, frame.values)
+
+def test_mmap_and_cli(tmp_path, capsys):
+    sheet = str(tmp_path / 'prices.csv')
+    write_sheet(sheet)
+    ingest.main([sheet, '--format', 'npy'])
+    assert str(tmp_path / 'prices') in capsys.readouterr().out
+
+    panel = ingest.load_prices(sheet, fmt='npy', mmap=True)
+    assert isinstance(panel, MappedPanel)
+    pd.testing.assert_frame_equal(panel.to_frame(),
+                                  ingest.read_wide(sheet))
+
+def test_load_xlsx(tmp_path):
+    pytest.importorskip('openpyxl')
+    sheet = str(tmp_path / 'prices.xlsx')
+    frame = write_sheet(str(tmp_path / 'prices.csv'))
+    frame.iloc[::-1].to_excel(sheet)
+
+    prices = ingest.load_prices(sheet, fmt='npy')
+    assert os.path.isdir(str(tmp_path / 'prices'))
+    assert list(prices.columns) == [str(a) for a in frame.columns]
+    np.testing.assert_array_equal(prices.index.values, frame.index.values)
+    np.testing.assert_allclose(prices.values, frame.values)
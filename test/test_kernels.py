@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import pytest
+from factor_analysis import kernels
+from factor_analysis import utils
+from factor_analysis import performance as perf
+
+# without numba the kernels run as plain Python, so their logic is checked
+# against the NumPy backend either way
+
+@pytest.fixture(autouse=True)
+def numpy_backend():
+    backend = kernels._backend
+    kernels.set_backend('numpy')
+    yield
+    kernels._backend = backend
+
+def make_segments(n=600, n_keys=12, seed=0):
+    rng = np.random.default_rng(seed)
+    keys = rng.integers(0, n_keys, n)
+    # ties, NaNs, a flat segment and a single row segment
+    values = np.round(rng.normal(size=n), 1)
+    values[rng.random(n) < 0.1] = np.nan
+    values[keys == 3] = 0.5
+    keys[keys == 4] = 5
+    keys[0] = 4
+    return values, keys, n_keys
+
+def test_demean():
+    values, keys, n_keys = make_segments()
+    values = np.column_stack([values, values[::-1]])
+    keys[::17] = -1
+    np.testing.assert_array_equal(kernels.demean(values, keys, n_keys),
+                                  utils._demean_values(values, keys, n_keys))
+
+@pytest.mark.parametrize('demeaned', [False, True])
+@pytest.mark.parametrize('equal_weight', [False, True])
+def test_to_weights(demeaned, equal_weight):
+    values, keys, n_keys = make_segments()
+    np.testing.assert_array_equal(
+        kernels.to_weights(values, keys, n_keys, demeaned, equal_weight),
+        perf._to_weights(values, keys, n_keys, demeaned, equal_weight))
+
+def pandas_bins(values, keys, quantiles, bins):
+    """
+    pd.qcut/pd.cut(labels=False) + 1 segment by segment, and the keys of
+    the segments pandas raises for.
+    """
+    labels = np.full(len(values), np.nan)
+    bad = []
+    for key in np.unique(keys):
+        rows = np.flatnonzero((keys == key) & ~np.isnan(values))
+        try:
+            if quantiles is not None:
+                labels[rows] = pd.qcut(values[rows], quantiles,
+                                       labels=False) + 1
+            else:
+                labels[rows] = pd.cut(values[rows], bins, labels=False) + 1
+        except ValueError:
+            bad.append(key)
+    return labels, np.array(bad, dtype=np.int64)
+
+@pytest.mark.parametrize('quantiles, bins', [
+    (5, None), ([0, .1, .5, .9, 1], None), (3, None), (10, None),
+    (None, 4), (None, [-2, -0.5, 0, 0.5, 2])])
+def test_bin_segments(quantiles, bins):
+    values, keys, _ = make_segments()
+    labels, bad = kernels.bin_segments(values, keys, quantiles, bins)
+
+    expected, expected_bad = pandas_bins(values, keys, quantiles, bins)
+    if quantiles is not None:
+        assert len(expected_bad) > 0
+    np.testing.assert_array_equal(bad, expected_bad)
+    ok = ~np.isin(keys, bad)
+    np.testing.assert_array_equal(labels[ok], expected[ok])
+
+    expected, expected_bad = utils._bin_segments(values, keys, quantiles,
+                                                 bins)
+    np.testing.assert_array_equal(labels, expected)
+    np.testing.assert_array_equal(bad, expected_bad)
+
+def test_bin_segments_edge_values():
+    # range(7) in thirds puts 2 on the first edge: [1 1 1 2 2 3 3]
+    values = np.arange(7.)
+    labels, _ = kernels.bin_segments(values, np.zeros(7, dtype=np.int64),
+                                     3, None)
+    np.testing.assert_array_equal(labels, [1, 1, 1, 2, 2, 3, 3])
+
+def test_set_backend():
+    with pytest.raises(ValueError):
+        kernels.set_backend('cuda')
+    assert kernels.set_backend('auto') == \
+        ('numpy' if kernels.numba is None else 'numba')
+    if kernels.numba is None:
+        with pytest.raises(ImportError):
+            kernels.set_backend('numba')
+
+@pytest.mark.skipif(kernels.numba is None, reason="numba is not installed")
+def test_numba_backend_pipeline():
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('2015-01-31', periods=24, freq='M')
+    assets = ['A%d' % i for i in range(200)]
+    prices = pd.DataFrame(10 * np.exp(np.cumsum(
+        rng.normal(0, 0.05, (len(dates), len(assets))), axis=0)),
+        index=dates, columns=assets)
+    factor = prices.pct_change().stack()
+    groups = {a: a[-1] for a in assets}
+
+    def run():
+        factor_data = utils.get_clean_factor_and_forward_returns(
+            factor, prices, groupby=groups, periods=(1, 3), max_loss=1,
+            zero_aware=True, quantiles=4)
+        return (factor_data,
+                perf.factor_weights(factor_data, group_adjust=True),
+                perf.mean_return_by_quantile(factor_data,
+                                             group_adjust=True)[0])
+
+    factor_data, weights, mean_ret = run()
+    kernels.set_backend('numba')
+    result = run()
+    pd.testing.assert_frame_equal(result[0], factor_data)
+    pd.testing.assert_series_equal(result[1], weights)
+    pd.testing.assert_frame_equal(result[2], mean_ret)
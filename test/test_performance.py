@@ -0,0 +1,164 @@
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pytest
+from factor_analysis import performance as perf
+from factor_analysis.panel import FactorPanel
+import helpers
+
+make_factor_data = partial(helpers.make_factor_data, n_dates=8, n_assets=30,
+                           returns={'1M': 0.05, '3M': 0.08}, quantiles=5)
+
+@pytest.mark.parametrize('equal_weight', [False, True])
+@pytest.mark.parametrize('group_adjust', [False, True])
+def test_factor_weights_gross_leverage(group_adjust, equal_weight):
+    factor_data = make_factor_data()
+    weights = perf.factor_weights(factor_data, demeaned=True,
+                                  group_adjust=group_adjust,
+                                  equal_weight=equal_weight)
+
+    assert weights.index.equals(factor_data.index)
+    gross = weights.abs().groupby(level='date').sum()
+    np.testing.assert_allclose(gross.values, 1.0)
+    net = weights.groupby(level='date').sum()
+    np.testing.assert_allclose(net.values, 0.0, atol=1e-12)
+
+    if group_adjust:
+        by_group = weights.groupby(
+            [factor_data.index.get_level_values('date'),
+             factor_data['group']]).sum()
+        np.testing.assert_allclose(by_group.values, 0.0, atol=1e-12)
+
+def test_factor_weights_matches_per_date_formula():
+    factor_data = make_factor_data()
+    weights = perf.factor_weights(factor_data, demeaned=True)
+    expected = factor_data.groupby(level='date')['factor'].transform(
+        lambda x: (x - x.mean()) / (x - x.mean()).abs().sum())
+    np.testing.assert_allclose(weights.values, expected.values)
+
+def test_factor_panel_round_trip():
+    factor_data = make_factor_data()
+    panel = FactorPanel.from_factor_data(factor_data)
+    assert panel.shape == (8, 30)
+    pd.testing.assert_frame_equal(panel.to_factor_data(), factor_data)
+
+@pytest.mark.parametrize('by_date', [False, True])
+@pytest.mark.parametrize('by_group', [False, True])
+@pytest.mark.parametrize('group_adjust', [False, True])
+def test_factor_panel_matches_factor_data(by_date, by_group, group_adjust):
+    factor_data = make_factor_data().sample(frac=0.8, random_state=1) \
+        .sort_index()
+    panel = FactorPanel.from_factor_data(factor_data)
+
+    expected = perf.mean_return_by_quantile(factor_data, by_date, by_group,
+                                            group_adjust=group_adjust)
+    result = perf.mean_return_by_quantile(panel, by_date, by_group,
+                                          group_adjust=group_adjust)
+    for res, exp in zip(result, expected):
+        pd.testing.assert_frame_equal(res, exp, check_names=False)
+
+    pd.testing.assert_frame_equal(
+        perf.factor_returns(panel, group_adjust=group_adjust),
+        perf.factor_returns(factor_data, group_adjust=group_adjust),
+        check_names=False, check_freq=False)
+
+@pytest.mark.parametrize('by_date', [False, True])
+@pytest.mark.parametrize('by_group', [False, True])
+def test_mean_return_by_quantile_matches_groupby(by_date, by_group):
+    factor_data = make_factor_data().sample(frac=0.7, random_state=2) \
+        .sort_index()
+    factor_data.iloc[::9, 0] = np.nan
+    mean_ret, std_err = perf.mean_return_by_quantile(
+        factor_data, by_date, by_group, demeaned=False)
+
+    grouper = ['factor_quantile', factor_data.index.get_level_values('date')]
+    if by_group:
+        grouper.append('group')
+    returns = factor_data.groupby(grouper)[['1M', '3M']]
+    expected_mean, expected_std = returns.mean(), returns.std()
+    expected_count = returns.count()
+    if not by_date:
+        grouper = [expected_mean.index.get_level_values('factor_quantile')]
+        if by_group:
+            grouper.append(expected_mean.index.get_level_values('group'))
+        returns = expected_mean.groupby(grouper)
+        expected_mean, expected_std = returns.mean(), returns.std()
+        expected_count = returns.count()
+
+    pd.testing.assert_frame_equal(mean_ret, expected_mean,
+                                  check_names=False)
+    pd.testing.assert_frame_equal(std_err,
+                                  expected_std / np.sqrt(expected_count),
+                                  check_names=False)
+
+@pytest.mark.parametrize('group_adjust', [False, True])
+def test_information_coefficient_matches_spearman(group_adjust):
+    factor_data = make_factor_data()
+    factor_data['factor'] = factor_data['factor'].round(1)
+    factor_data.iloc[::7, 0] = np.nan
+    ic = perf.factor_information_coefficient(factor_data, group_adjust)
+
+    returns = factor_data[['1M', '3M']]
+    if group_adjust:
+        returns = returns - returns.groupby(
+            [factor_data.index.get_level_values('date'),
+             factor_data['group']]).transform('mean')
+    expected = pd.DataFrame({
+        col: returns[col].groupby(level='date').apply(
+            lambda x: x.corr(factor_data.loc[x.index, 'factor'],
+                             method='spearman'))
+        for col in ['1M', '3M']})
+    pd.testing.assert_frame_equal(ic, expected, check_names=False)
+
+    panel = FactorPanel.from_factor_data(factor_data.dropna())
+    pd.testing.assert_frame_equal(
+        perf.factor_information_coefficient(panel, group_adjust),
+        perf.factor_information_coefficient(factor_data.dropna(),
+                                            group_adjust))
+
+def test_information_coefficient_by_group_and_summary():
+    factor_data = make_factor_data()
+    ic = perf.factor_information_coefficient(factor_data, by_group=True)
+    assert ic.index.names == ['date', 'group']
+    assert len(ic) == 8 * 3
+
+    summary = perf.information_coefficient_summary(
+        perf.factor_information_coefficient(factor_data))
+    ic = perf.factor_information_coefficient(factor_data)
+    np.testing.assert_allclose(summary['ic_mean'], ic.mean())
+    np.testing.assert_allclose(summary['ic_t_stat'],
+                               ic.mean() / ic.std() * np.sqrt(len(ic)))
+    pd.testing.assert_series_equal(
+        perf.mean_information_coefficient(factor_data), ic.mean())
+
+@pytest.mark.parametrize('period', [1, 2, '3M'])
+def test_quantile_turnover_matches_sets(period):
+    factor_data = make_factor_data().iloc[5:]
+    lag = int(str(period).rstrip('M'))
+    quantiles = factor_data['factor_quantile']
+    turnover = perf.quantile_turnover(quantiles, period=period)
+
+    dates = quantiles.index.levels[0]
+    for q in range(1, 6):
+        names = [set(quantiles.loc[date][quantiles.loc[date] == q].index)
+                 for date in dates]
+        expected = [np.nan] * lag + [
+            len(names[i] - names[i - lag]) / float(len(names[i]))
+            for i in range(lag, len(dates))]
+        np.testing.assert_allclose(turnover[q].values, expected)
+    pd.testing.assert_frame_equal(
+        perf.quantile_turnover(FactorPanel.from_factor_data(factor_data),
+                               period=period), turnover,
+        check_column_type=False)
+
+def test_factor_rank_autocorrelation():
+    factor_data = make_factor_data().iloc[3:]
+    autocorr = perf.factor_rank_autocorrelation(factor_data, 2)
+
+    ranks = factor_data['factor'].groupby(level='date').rank().unstack()
+    expected = ranks.corrwith(ranks.shift(2), axis=1)
+    np.testing.assert_allclose(autocorr.values, expected.values)
+    pd.testing.assert_series_equal(
+        perf.factor_rank_autocorrelation(
+            FactorPanel.from_factor_data(factor_data), 2), autocorr)
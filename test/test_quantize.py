@@ -0,0 +1,78 @@
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pytest
+from factor_analysis import utils
+import helpers
+
+make_factor_data = partial(helpers.make_factor_data, missing=0.2)
+
+@pytest.mark.parametrize('ties', [False, True])
+@pytest.mark.parametrize('by_group', [False, True])
+@pytest.mark.parametrize('kwargs', [
+    dict(quantiles=5, bins=None),
+    dict(quantiles=3, bins=None),
+    dict(quantiles=10, bins=None),
+    dict(quantiles=20, bins=None),
+    dict(quantiles=[0, .1, .5, .9, 1.], bins=None),
+    dict(quantiles=None, bins=5),
+    dict(quantiles=None, bins=[-4, -2, -0.5, 0, 10]),
+    dict(quantiles=4, bins=None, zero_aware=True),
+    dict(quantiles=None, bins=4, zero_aware=True),
+])
+def test_vectorized_matches_reference(kwargs, by_group, ties):
+    factor_data = make_factor_data(ties=ties)
+    expected = utils.quantize_factor(factor_data, by_group=by_group,
+                                     no_raise=True, engine='reference',
+                                     **kwargs)
+    result = utils.quantize_factor(factor_data, by_group=by_group,
+                                   no_raise=True, engine='vectorized',
+                                   **kwargs)
+    pd.testing.assert_series_equal(result.sort_index(),
+                                   expected.sort_index(),
+                                   check_dtype=False)
+
+@pytest.mark.parametrize('quantiles', [3, 6, 7, 10, 20])
+def test_vectorized_edge_values(quantiles):
+    # values falling exactly on the quantile edges
+    index = pd.MultiIndex.from_product(
+        [pd.date_range('2015-01-31', periods=3, freq='M'),
+         ['A%d' % i for i in range(21)]], names=['date', 'asset'])
+    factor_data = pd.DataFrame({'factor': np.tile(np.arange(21.), 3)},
+                               index=index)
+    factor_data = factor_data[factor_data['factor'] < np.repeat([7, 13, 21],
+                                                                21)]
+    expected = utils.quantize_factor(factor_data, quantiles=quantiles,
+                                     no_raise=True, engine='reference')
+    result = utils.quantize_factor(factor_data, quantiles=quantiles,
+                                   no_raise=True, engine='vectorized')
+    pd.testing.assert_series_equal(result, expected, check_dtype=False)
+
+def test_vectorized_raises_like_reference():
+    factor_data = make_factor_data(n_assets=4, ties=True)
+    with pytest.raises(ValueError):
+        utils.quantize_factor(factor_data, quantiles=5, engine='reference')
+    with pytest.raises(ValueError):
+        utils.quantize_factor(factor_data, quantiles=5, engine='vectorized')
+
+@pytest.mark.parametrize('kwargs', [dict(quantiles=4, bins=None),
+                                    dict(quantiles=None, bins=4)])
+def test_zero_aware_one_sided_dates(kwargs):
+    factor_data = make_factor_data()
+    dates = factor_data.index.get_level_values('date')
+    # no negative values on one date, no positive ones on another
+    factor_data.loc[dates == dates[0], 'factor'] = \
+        factor_data['factor'].abs()
+    factor_data.loc[dates == dates[-1], 'factor'] = \
+        -factor_data['factor'].abs()
+    expected = utils.quantize_factor(factor_data, no_raise=True,
+                                     zero_aware=True, engine='reference',
+                                     **kwargs)
+    result = utils.quantize_factor(factor_data, no_raise=True,
+                                   zero_aware=True, **kwargs)
+    pd.testing.assert_series_equal(result.sort_index(),
+                                   expected.sort_index(), check_dtype=False)
+    assert dates[0] not in result.index.get_level_values('date')
+    with pytest.raises(ValueError):
+        utils.quantize_factor(factor_data, zero_aware=True, **kwargs)
@@ -0,0 +1,89 @@
+import os
+import pickle
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pytest
+from factor_analysis import utils
+from factor_analysis.store import MappedPanel
+import helpers
+
+# daily prices with gaps and a random factor
+make_inputs = partial(helpers.make_inputs, n_dates=40, n_assets=25, freq='B',
+                      start='2015-01-01', volatility=0.02, missing=0.05,
+                      random_factor=True)
+
+def test_round_trip(tmp_path):
+    factor, prices = make_inputs()
+    panel = MappedPanel.write(str(tmp_path / 'prices'), prices)
+
+    assert isinstance(panel.values, np.memmap)
+    assert panel.shape == prices.shape
+    pd.testing.assert_frame_equal(panel.to_frame(), prices,
+                                  check_names=False, check_freq=False)
+    window = panel.loc(prices.index[3], prices.index[9], ['A2', 'ZZ'])
+    assert window.shape == (7, 2) and window['ZZ'].isnull().all()
+    pd.testing.assert_series_equal(window['A2'], prices['A2'].iloc[3:10],
+                                   check_names=False, check_freq=False)
+
+    restored = pickle.loads(pickle.dumps(panel))
+    assert restored.path == panel.path
+
+    stored = MappedPanel.write(str(tmp_path / 'factor'), factor)
+    pd.testing.assert_series_equal(stored.stack(chunk_size=7), factor,
+                                   check_names=False)
+
+def test_interrupted_write(tmp_path, monkeypatch):
+    factor, prices = make_inputs()
+    path = str(tmp_path / 'prices')
+    MappedPanel.write(path, prices)
+
+    def fail(self):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(MappedPanel, 'flush', fail)
+    with pytest.raises(KeyboardInterrupt):
+        MappedPanel.write(path, prices * 2)
+    monkeypatch.undo()
+    assert os.listdir(str(tmp_path)) == ['prices']
+    pd.testing.assert_frame_equal(MappedPanel(path).to_frame(), prices,
+                                  check_names=False, check_freq=False)
+
+    MappedPanel.write(path, prices * 2)
+    np.testing.assert_array_equal(MappedPanel(path).values,
+                                  prices.values * 2)
+    assert os.listdir(str(tmp_path)) == ['prices']
+
+def test_forward_returns_from_mapped_prices(tmp_path):
+    factor, prices = make_inputs()
+    panel = MappedPanel.write(str(tmp_path / 'prices'), prices)
+
+    expected = utils.compute_forward_returns(factor, prices, (1, 3))
+    result = utils._mapped_forward_returns(factor, panel, (1, 3),
+                                           chunk_size=6)
+    pd.testing.assert_frame_equal(result, expected)
+
+    expected = utils.get_clean_factor_and_forward_returns(
+        factor, prices, periods=(1, 3), max_loss=1)
+    result = utils.get_clean_factor_and_forward_returns(
+        MappedPanel.write(str(tmp_path / 'factor'), factor), panel,
+        periods=(1, 3), max_loss=1)
+    pd.testing.assert_frame_equal(result, expected)
+
+def test_forward_returns_from_mapped_prices_before_factor(tmp_path):
+    factor, prices = make_inputs()
+    # prices start before the factor, with gaps spanning its first date
+    wide = factor.unstack()
+    wide.iloc[:4] = np.nan
+    factor = wide.stack()
+    assert factor.index.levels[0].equals(prices.index)
+    prices.iloc[2:7, :5] = np.nan
+    prices.iloc[10:13, 5] = np.nan
+    panel = MappedPanel.write(str(tmp_path / 'prices'), prices)
+
+    expected = utils.compute_forward_returns(factor, prices, (1, 3))
+    assert expected.loc[prices.index[4]].iloc[:5].notnull().all().all()
+    for chunk_size in (3, 256):
+        result = utils._mapped_forward_returns(factor, panel, (1, 3),
+                                               chunk_size=chunk_size)
+        pd.testing.assert_frame_equal(result, expected)
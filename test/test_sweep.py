@@ -0,0 +1,30 @@
+from functools import partial
+
+import numpy as np
+import pytest
+from factor_analysis import sweep
+import helpers
+
+make_inputs = partial(helpers.make_inputs, random_factor=True)
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_run_sweep(max_workers):
+    factor, prices = make_inputs()
+    # mostly NaN, exceeds max_loss
+    sparse = factor.where(np.arange(len(factor)) % 3 == 0)
+    results = sweep.run_sweep({'good': factor, 'sparse': sparse}, prices,
+                              quantiles=(5, 3), long_short=(True, False),
+                              periods=((1, 2),), max_workers=max_workers)
+
+    good = results[results['factor'] == 'good']
+    assert good['error'].isnull().all()
+    assert len(good) == 2 * 2 * 2
+    assert list(good['quantiles'][::4]) == [5, 3]
+    assert list(good['period'][:2]) == ['1M', '2M']
+    assert good['Q1'].notnull().all()
+
+    bad = results[results['factor'] == 'sparse']
+    assert len(bad) == 2 * 2
+    assert bad['error'].str.startswith('MaxLossExceededError').all()
+    # the in-process run does not keep the inputs alive
+    assert sweep._worker_data == {}
@@ -0,0 +1,35 @@
+import os
+
+import matplotlib.pyplot as plt
+import pytest
+from factor_analysis import utils
+from factor_analysis import tears
+from helpers import make_inputs
+
+def clean_factor_data(seed=0):
+    factor, prices = make_inputs(seed=seed)
+    return utils.get_clean_factor_and_forward_returns(
+        factor, prices, periods=(1, 2), max_loss=1)
+
+def test_tear_sheet_to_file(tmp_path):
+    path = str(tmp_path / 'factor.png')
+    tables = tears.create_returns_tear_sheet(clean_factor_data(), path=path)
+    assert os.path.getsize(path) > 0
+    assert plt.get_fignums() == []
+    assert set(tables) == {'factor_returns', 'mean_quant_ret',
+                           'std_quantile', 'mean_quant_ret_bydate',
+                           'std_quant_daily'}
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_render_tear_sheets(tmp_path, max_workers):
+    factor_datas = {'a': clean_factor_data(seed=0),
+                    'b': clean_factor_data(seed=1)}
+    results = tears.render_returns_tear_sheets(
+        factor_datas, str(tmp_path / 'sheets'), fmt='svg',
+        max_workers=max_workers)
+    assert list(results) == ['a', 'b']
+    for name, tables in results.items():
+        assert not isinstance(tables, Exception)
+        assert os.path.getsize(str(tmp_path / 'sheets' / (name + '.svg'))) \
+            > 0
+    assert plt.get_fignums() == []
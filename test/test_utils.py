@@ -0,0 +1,250 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+from factor_analysis import utils
+from factor_analysis import performance as perf
+from factor_analysis.store import MappedPanel
+from helpers import make_inputs
+
+def test_instrumentation_records_stages(capsys):
+    factor, prices = make_inputs()
+    seen = []
+    instrument = utils.Instrumentation(callback=seen.append,
+                                       trace_memory=True, logger=None)
+    factor_data = utils.get_clean_factor_and_forward_returns(
+        factor, prices, periods=(1, 2), max_loss=1, instrument=instrument)
+
+    assert capsys.readouterr().out == ''
+    stages = instrument.to_frame()
+    assert list(stages['stage']) == ['forward_returns', 'merge', 'dropna',
+                                     'binning']
+    assert seen == instrument.stages
+    assert (stages['seconds'] >= 0).all()
+    assert (stages['peak_bytes'] >= 0).all()
+    assert stages['rows_out'].iloc[-1] == len(factor_data)
+    loss = instrument.loss
+    assert loss['total'] == pytest.approx(1 - len(factor_data) / len(factor))
+    assert loss['binning'] == pytest.approx(loss['total']
+                                            - loss['forward_returns'])
+
+def test_instrumentation_max_loss(caplog):
+    factor, prices = make_inputs()
+    instrument = utils.Instrumentation()
+    with caplog.at_level(logging.INFO, logger='factor_analysis.utils'):
+        with pytest.raises(utils.MaxLossExceededError):
+            utils.get_clean_factor_and_forward_returns(
+                factor, prices, periods=(1, 2), max_loss=0.01,
+                instrument=instrument)
+    assert instrument.loss['total'] > 0.01
+    assert 'Dropped' in caplog.text
+
+def test_without_instrumentation_prints(capsys):
+    factor, prices = make_inputs()
+    utils.get_clean_factor_and_forward_returns(factor, prices,
+                                               periods=(1, 2), max_loss=1)
+    assert 'Dropped' in capsys.readouterr().out
+
+@pytest.mark.parametrize('by_group', [False, True])
+def test_demean_forward_returns(by_group):
+    factor, prices = make_inputs()
+    factor_data = utils.get_clean_factor_and_forward_returns(
+        factor, prices, groupby={a: a[-1] for a in prices.columns},
+        periods=(1, 2), max_loss=1)
+    factor_data.iloc[::5, 0] = np.nan
+    original = factor_data.copy()
+
+    grouper = [factor_data.index.get_level_values('date')]
+    if by_group:
+        grouper.append('group')
+    expected = factor_data.copy()
+    expected[['1M', '2M']] = factor_data.groupby(grouper)[['1M', '2M']] \
+        .transform(lambda x: x - x.mean())
+
+    result = utils.demean_forward_returns(factor_data, grouper)
+    pd.testing.assert_frame_equal(result, expected)
+    pd.testing.assert_frame_equal(factor_data, original)
+    assert np.shares_memory(result['factor'].values,
+                            factor_data['factor'].values)
+
+    result = utils.demean_forward_returns(factor_data, grouper, inplace=True)
+    assert result is factor_data
+    pd.testing.assert_frame_equal(factor_data, expected)
+
+def test_compact_factor_data():
+    factor, prices = make_inputs(n_assets=60)
+    groupby = {a: a[-1] for a in prices.columns}
+    factor_data = utils.get_clean_factor_and_forward_returns(
+        factor, prices, groupby=groupby, periods=(1, 2), max_loss=1)
+    compact = utils.get_clean_factor_and_forward_returns(
+        factor, prices, groupby=groupby, periods=(1, 2), max_loss=1,
+        compact=True)
+
+    assert compact['1M'].dtype == np.float32
+    assert compact['factor'].dtype == np.float32
+    assert compact['factor_quantile'].dtype == np.int8
+    assert compact['group'].cat.codes.dtype == np.int8
+    assert isinstance(compact.index.levels[1], pd.CategoricalIndex)
+    assert compact.memory_usage().sum() < factor_data.memory_usage().sum()
+    assert list(compact.index) == list(factor_data.index)
+    pd.testing.assert_frame_equal(compact.set_axis(factor_data.index),
+                                  factor_data, check_dtype=False, rtol=1e-6)
+
+    expected = perf.mean_return_by_quantile(factor_data, group_adjust=True)
+    result = perf.mean_return_by_quantile(compact, group_adjust=True)
+    for res, exp in zip(result, expected):
+        pd.testing.assert_frame_equal(res, exp, check_index_type=False,
+                                      rtol=1e-5)
+
+@pytest.mark.parametrize('group_neutral', [False, True])
+def test_compact_factor_data_downstream(group_neutral, tmp_path):
+    from factor_analysis import tears
+
+    factor, prices = make_inputs(n_assets=60)
+    groupby = {a: a[-1] for a in prices.columns}
+    factor_data = utils.get_clean_factor_and_forward_returns(
+        factor, prices, groupby=groupby, periods=(1, 2), max_loss=1)
+    compact = utils.get_clean_factor_and_forward_returns(
+        factor, prices, groupby=groupby, periods=(1, 2), max_loss=1,
+        compact=True)
+
+    def check(result, expected):
+        # compact indexes hold categorical assets and int8 quantiles
+        assert_equal = pd.testing.assert_series_equal \
+            if isinstance(expected, pd.Series) \
+            else pd.testing.assert_frame_equal
+        assert_equal(result.set_axis(expected.index), expected, rtol=1e-5,
+                     check_dtype=False)
+
+    check(perf.factor_weights(compact, True, group_neutral),
+          perf.factor_weights(factor_data, True, group_neutral))
+    check(perf.factor_returns(compact, True, group_neutral),
+          perf.factor_returns(factor_data, True, group_neutral))
+    for by_date in (False, True):
+        result = perf.mean_return_by_quantile(
+            compact, by_date=by_date, group_adjust=group_neutral)
+        expected = perf.mean_return_by_quantile(
+            factor_data, by_date=by_date, group_adjust=group_neutral)
+        for res, exp in zip(result, expected):
+            check(res, exp)
+
+    result = tears.create_returns_tear_sheet(
+        compact, group_neutral=group_neutral,
+        path=str(tmp_path / 'compact.png'))
+    expected = tears.create_returns_tear_sheet(
+        factor_data, group_neutral=group_neutral,
+        path=str(tmp_path / 'default.png'))
+    for name in expected:
+        check(result[name], expected[name])
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 100])
+def test_iter_clean_factor_matches_batch(chunk_size, tmp_path):
+    factor, prices = make_inputs(n_dates=20)
+    factor = factor.sample(frac=0.8, random_state=0)
+    groupby = {a: a[-1] for a in prices.columns}
+    expected = utils.get_clean_factor_and_forward_returns(
+        factor.sort_index(), prices, groupby=groupby, periods=(1, 3),
+        max_loss=1)
+
+    chunks = list(utils.iter_clean_factor_and_forward_returns(
+        factor, prices, groupby=groupby, periods=(1, 3), max_loss=1,
+        chunk_size=chunk_size))
+    n_dates = factor.index.get_level_values('date').nunique()
+    assert len(chunks) == -(-n_dates // chunk_size)
+    pd.testing.assert_frame_equal(pd.concat(chunks).sort_index(), expected)
+
+    mapped = utils.iter_clean_factor_and_forward_returns(
+        MappedPanel.write(str(tmp_path / 'factor'), factor),
+        MappedPanel.write(str(tmp_path / 'prices'), prices),
+        groupby=groupby, periods=(1, 3), max_loss=1, chunk_size=chunk_size)
+    pd.testing.assert_frame_equal(pd.concat(mapped).sort_index(), expected,
+                                  check_index_type=False)
+
+def test_iter_clean_factor_max_loss():
+    factor, prices = make_inputs(n_dates=20)
+    expected = utils.Instrumentation(logger=None)
+    utils.get_clean_factor_and_forward_returns(
+        factor, prices, periods=(1, 3), max_loss=1, instrument=expected)
+    instrument = utils.Instrumentation(logger=None)
+    for _ in utils.iter_clean_factor_and_forward_returns(
+            factor, prices, periods=(1, 3), max_loss=1, chunk_size=4,
+            instrument=instrument):
+        pass
+    assert instrument.loss == pytest.approx(expected.loss)
+
+    # no prices for the first chunk: it already drops more than max_loss
+    # of the whole factor
+    prices.iloc[:5] = np.nan
+    chunks = utils.iter_clean_factor_and_forward_returns(
+        factor, prices, periods=(1, 3), max_loss=0.01, chunk_size=4,
+        instrument=instrument)
+    with pytest.raises(utils.MaxLossExceededError):
+        next(chunks)
+
+def baseline_forward_returns(factor, prices, periods):
+    """
+    compute_forward_returns as it was, through pct_change and shift.
+    """
+    factor_dateindex = factor.index.levels[0].intersection(prices.index)
+    freq = utils.get_frequency((prices.index[1] - prices.index[0]).days)
+    raw_values_dict = {}
+    column_list = []
+    for period in sorted(periods):
+        returns = prices.pct_change(period)
+        forward_returns = returns.shift(-period).reindex(factor_dateindex)
+        label = '%d%s' % (period, freq)
+        column_list.append(label)
+        raw_values_dict[label] = np.concatenate(forward_returns.values)
+    df = pd.DataFrame.from_dict(raw_values_dict)
+    df.set_index(pd.MultiIndex.from_product(
+        [factor_dateindex, prices.columns], names=['date', 'asset']),
+        inplace=True)
+    df = df.reindex(factor.index)[column_list]
+    df.index.set_names(['date', 'asset'], inplace=True)
+    return df
+
+def test_forward_returns_match_pct_change():
+    factor, prices = make_inputs(n_dates=20)
+    rng = np.random.default_rng(1)
+    prices[rng.random(prices.shape) < 0.1] = np.nan
+    prices.iloc[:3, 0] = np.nan
+    prices.iloc[12:, 1] = np.nan
+
+    # assets absent from the prices, in an unsorted factor
+    extra = pd.Series(1.0, index=pd.MultiIndex.from_product(
+        [prices.index, ['ZZ', 'A100']], names=['date', 'asset']))
+    factor = pd.concat([factor, extra]).sample(frac=1, random_state=0)
+
+    expected = baseline_forward_returns(factor, prices, (3, 1, 5))
+    result = utils.compute_forward_returns(factor, prices, (3, 1, 5))
+    assert list(result.columns) == ['1M', '3M', '5M']
+    pd.testing.assert_frame_equal(result, expected)
+    assert result.loc[(slice(None), 'ZZ'), :].isnull().all().all()
+
+@pytest.mark.parametrize('shared_index', [True, False])
+def test_clean_factors_match_single(shared_index):
+    factor, prices = make_inputs(n_dates=20)
+    other = -factor if shared_index else \
+        factor.sample(frac=0.7, random_state=0).sort_index() * 2
+    factors = {'a': factor, 'b': other}
+
+    results = utils.get_clean_factors_and_forward_returns(
+        factors, prices, periods=(1, 3), max_loss=1)
+    assert list(results) == ['a', 'b']
+    for name, factor_data in results.items():
+        expected = utils.get_clean_factor_and_forward_returns(
+            factors[name], prices, periods=(1, 3), max_loss=1)
+        pd.testing.assert_frame_equal(factor_data, expected)
+
+    results = utils.get_clean_factors_and_forward_returns(
+        factors, prices, periods=(1, 3), max_loss=1,
+        func=perf.factor_returns)
+    for name, returns in results.items():
+        expected = perf.factor_returns(
+            utils.get_clean_factor_and_forward_returns(
+                factors[name], prices, periods=(1, 3), max_loss=1))
+        pd.testing.assert_frame_equal(returns, expected)
+
+    with pytest.raises(ValueError):
+        utils.get_clean_factors_and_forward_returns({}, prices)